@@ -21,6 +21,9 @@ import gc
 import select
 import threading
 import weakref
+import time
+import random
+import cProfile
 from functools import partial
 from multiprocessing import Pipe
 from Exscript.Logger import logger_registry
@@ -29,6 +32,10 @@ from Exscript.util.cast import to_hosts
 from Exscript.util.tty import get_terminal_size
 from Exscript.util.impl import format_exception, serializeable_sys_exc_info
 from Exscript.util.decorator import get_label
+from Exscript.util.stats import Stats
+from Exscript.util.profiler import Profile
+from Exscript.util.trace import Span
+from Exscript.util import trace
 from Exscript.AccountManager import AccountManager
 from Exscript.workqueue import WorkQueue, Task
 from Exscript.AccountProxy import AccountProxy
@@ -60,36 +67,76 @@ def _prepare_connection(func):
         to_parent = job.data['pipe']
         host      = job.data['host']
 
+        # Continue the trace of whoever enqueued the job, if any.
+        span    = None
+        context = job.data.get('trace')
+        if context is not None:
+            span = Span('job',
+                        context[0],
+                        context[1],
+                        host    = host.get_name(),
+                        attempt = job.failures + 1)
+
         # Create a protocol adapter.
         mkaccount = partial(_account_factory, to_parent, host)
+        stats     = Stats()
         pargs     = {'account_factory': mkaccount,
-                     'stdout':          job.data['stdout']}
+                     'stdout':          job.data['stdout'],
+                     'stats':           stats,
+                     'span':            span}
         pargs.update(host.get_options())
         conn = prepare(host, **pargs)
 
+        # Profile a sample of the jobs, if requested.
+        profiler = None
+        if job.data.get('profile'):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
         # Connect and run the function.
+        start       = time.time()
         log_options = get_label(func, 'log_to')
-        if log_options is not None:
-            # Enable logging.
-            proxy  = LoggerProxy(to_parent, log_options['logger_id'])
-            log_cb = partial(proxy.log, job_id)
-            proxy.add_log(job_id, job.name, job.failures + 1)
-            conn.data_received_event.listen(log_cb)
-            try:
+        try:
+            if log_options is not None:
+                # Enable logging.
+                proxy  = LoggerProxy(to_parent, log_options['logger_id'])
+                log_cb = partial(proxy.log, job_id)
+                proxy.add_log(job_id, job.name, job.failures + 1)
+                conn.data_received_event.listen(log_cb)
+                try:
+                    conn.connect(host.get_address(), host.get_tcp_port())
+                    result = func(job, host, conn, *args, **kwargs)
+                    conn.close(force = True)
+                except:
+                    proxy.log_aborted(job_id, serializeable_sys_exc_info())
+                    raise
+                else:
+                    proxy.log_succeeded(job_id)
+                finally:
+                    conn.data_received_event.disconnect(log_cb)
+            else:
                 conn.connect(host.get_address(), host.get_tcp_port())
                 result = func(job, host, conn, *args, **kwargs)
                 conn.close(force = True)
-            except:
-                proxy.log_aborted(job_id, serializeable_sys_exc_info())
-                raise
-            else:
-                proxy.log_succeeded(job_id)
-            finally:
-                conn.data_received_event.disconnect(log_cb)
-        else:
-            conn.connect(host.get_address(), host.get_tcp_port())
-            result = func(job, host, conn, *args, **kwargs)
-            conn.close(force = True)
+        except Exception, e:
+            if span is not None:
+                span.set_attribute('error', str(e))
+            raise
+        finally:
+            # Pass the timings to the parent process.
+            duration = time.time() - start
+            stats.record('job', duration)
+            stats.record_host(host.get_name(), duration)
+            stats.record_completion()
+            stats.increment('sessions', label = conn.get_driver().name)
+            to_parent.send(('stats-merge', stats))
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                to_parent.send(('profile-merge', profiler.stats))
+            if span is not None:
+                span.finish()
+                to_parent.send(('trace-export', span))
         return result
 
     return _wrapped
@@ -111,10 +158,12 @@ class _PipeHandler(threading.Thread):
     Each PipeHandler holds an open pipe to a subprocess, to allow the
     sub-process to access the accounts and communicate status information.
     """
-    def __init__(self, account_manager):
+    def __init__(self, account_manager, stats, profile):
         threading.Thread.__init__(self)
-        self.daemon = True
-        self.accm   = account_manager
+        self.daemon  = True
+        self.accm    = account_manager
+        self.stats   = stats
+        self.profile = profile
         self.to_child, self.to_parent = Pipe()
 
     def _send_account(self, account):
@@ -128,19 +177,32 @@ class _PipeHandler(threading.Thread):
                     account.get_key())
         self.to_child.send(response)
 
+    def _acquire(self, func, *args, **kwargs):
+        # Records how long we had to wait for the account pool.
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stats.record('account_wait', time.time() - start)
+
     def _handle_request(self, request):
         try:
             command, arg = request
             if command == 'acquire-account-for-host':
-                account = self.accm.acquire_account_for(arg, self)
+                account = self._acquire(self.accm.acquire_account_for,
+                                        arg,
+                                        self)
                 self._send_account(account)
             elif command == 'acquire-account-from-hash':
                 account = self.accm.get_account_from_hash(arg)
                 if account is not None:
-                    account = self.accm.acquire_account(account, self)
+                    account = self._acquire(self.accm.acquire_account,
+                                            account,
+                                            self)
                 self._send_account(account)
             elif command == 'acquire-account':
-                account = self.accm.acquire_account(owner = self)
+                account = self._acquire(self.accm.acquire_account,
+                                        owner = self)
                 self._send_account(account)
             elif command == 'release-account':
                 account = self.accm.get_account_from_hash(arg)
@@ -155,6 +217,12 @@ class _PipeHandler(threading.Thread):
                 _call_logger('log_aborted', *arg)
             elif command == 'log-succeeded':
                 _call_logger('log_succeeded', *arg)
+            elif command == 'stats-merge':
+                self.stats.merge(arg)
+            elif command == 'profile-merge':
+                self.profile.add(arg)
+            elif command == 'trace-export':
+                trace.export(arg)
             else:
                 raise Exception('invalid command on pipe: ' + repr(command))
         except Exception, e:
@@ -170,6 +238,26 @@ class _PipeHandler(threading.Thread):
                 break
             self._handle_request(request)
 
+class _StatusBarRenderer(threading.Thread):
+    """
+    Redraws the status bar of a queue at most a given number of times per
+    second, such that job events never have to wait for the terminal.
+    The thread terminates as soon as there is nothing left to redraw.
+    """
+    def __init__(self, queue, rate):
+        threading.Thread.__init__(self)
+        self.daemon   = True
+        self.queue    = weakref.ref(queue)
+        self.interval = 1.0 / rate
+
+    def run(self):
+        while True:
+            queue = self.queue()
+            if queue is None or not queue._render_status_bar():
+                break
+            del queue
+            time.sleep(self.interval)
+
 class Queue(object):
     """
     Manages hosts/tasks, accounts, connections, and threads.
@@ -181,7 +269,8 @@ class Queue(object):
                  mode        = 'threading',
                  max_threads = 1,
                  stdout      = sys.stdout,
-                 stderr      = sys.stderr):
+                 stderr      = sys.stderr,
+                 status_rate = 10):
         """
         Constructor. All arguments should be passed as keyword arguments.
         Depending on the verbosity level, the following types
@@ -216,6 +305,9 @@ class Queue(object):
         @param stdout: The output channel, defaults to sys.stdout.
         @type  stderr: file
         @param stderr: The error channel, defaults to sys.stderr.
+        @type  status_rate: int
+        @param status_rate: The maximum number of status bar updates
+            per second.
         """
         self.workqueue         = WorkQueue(mode = mode)
         self.account_manager   = AccountManager()
@@ -230,7 +322,17 @@ class Queue(object):
         self.completed         = 0
         self.total             = 0
         self.failed            = 0
+        self.errors            = 0
         self.status_bar_length = 0
+        self.status_rate       = status_rate
+        self.status_lock       = threading.RLock()
+        self.output_lock       = threading.RLock()
+        self.status_pending    = None
+        self.status_renderer   = None
+        self.running_jobs      = {}
+        self.stats             = Stats()
+        self.profile           = Profile()
+        self.profile_rate      = 0.0
         self.set_max_threads(max_threads)
 
         # Listen to what the workqueue is doing.
@@ -297,16 +399,89 @@ class Queue(object):
 
             pipe.close()
         """
-        child = _PipeHandler(self.account_manager)
+        child = _PipeHandler(self.account_manager, self.stats, self.profile)
         self.pipe_handlers[id(child)] = child
         child.start()
         return child.to_parent
 
+    # The status lock protects the counters, and is never held while
+    # writing to the terminal. The output lock serializes the writes.
     def _del_status_bar(self):
-        if self.status_bar_length == 0:
+        with self.output_lock:
+            if self.status_bar_length == 0:
+                return
+            self._write('status_bar', '\b \b' * self.status_bar_length)
+            self.status_bar_length = 0
+
+    def _get_status_snapshot(self):
+        with self.status_lock:
+            return self.completed, self.total, self.running_jobs.values()
+
+    def _refresh_status_bar(self):
+        """
+        Schedules a redraw of the status bar without waiting for it.
+        Changes are coalesced until the renderer's next redraw, but every
+        job that was started is shown at least once.
+        """
+        if self.channel_map['status_bar'] is self.devnull:
             return
-        self._write('status_bar', '\b \b' * self.status_bar_length)
-        self.status_bar_length = 0
+        with self.status_lock:
+            completed, total, names = self._get_status_snapshot()
+            if self.status_pending is not None:
+                old_names = self.status_pending[2]
+                names    += [n for n in old_names if n not in names]
+            self.status_pending = completed, total, names
+            if self.status_renderer is None:
+                renderer = _StatusBarRenderer(self, self.status_rate)
+                self.status_renderer = renderer
+                renderer.start()
+
+    def _render_status_bar(self):
+        """
+        Called by the renderer thread. Redraws the status bar if
+        necessary and returns False if there was nothing to do.
+        """
+        with self.status_lock:
+            snapshot = self.status_pending
+            if snapshot is None:
+                self.status_renderer = None
+                return False
+
+        with self.output_lock:
+            self._del_status_bar()
+            self._print_status_bar(snapshot)
+
+        # Jobs that completed since the last redraw were included,
+        # so another redraw is needed to remove them again. If the
+        # pending update was replaced in the meantime, it is kept.
+        with self.status_lock:
+            if self.status_pending is snapshot:
+                current = self._get_status_snapshot()
+                if current == snapshot:
+                    self.status_pending = None
+                else:
+                    self.status_pending = current
+            return True
+
+    def _flush_status_bar(self):
+        """
+        Draws any pending update, followed by the current status.
+        """
+        with self.status_lock:
+            pending             = self.status_pending
+            current             = self._get_status_snapshot()
+            self.status_pending = None
+        with self.output_lock:
+            if pending is not None:
+                self._del_status_bar()
+                self._print_status_bar(pending)
+            self._del_status_bar()
+            self._print_status_bar(current)
+
+    def _cancel_status_bar(self):
+        with self.status_lock:
+            self.status_pending = None
+        self._del_status_bar()
 
     def get_progress(self):
         """
@@ -319,13 +494,13 @@ class Queue(object):
             return 0.0
         return 100.0 / self.total * self.completed
 
-    def _print_status_bar(self, exclude = None):
-        if self.total == 0:
+    def _print_status_bar(self, snapshot):
+        completed, total, names = snapshot
+        if total == 0:
             return
-        percent  = 100.0 / self.total * self.completed
-        progress = '%d/%d (%d%%)' % (self.completed, self.total, percent)
-        jobs     = self.workqueue.get_running_jobs()
-        running  = '|'.join([j.name for j in jobs if j.name != exclude])
+        percent  = 100.0 / total * completed
+        progress = '%d/%d (%d%%)' % (completed, total, percent)
+        running  = '|'.join(names)
         if not running:
             self.status_bar_length = 0
             return
@@ -345,9 +520,10 @@ class Queue(object):
         self.status_bar_length = len(text)
 
     def _print(self, channel, msg):
-        self._del_status_bar()
-        self._write(channel, msg + '\n')
-        self._print_status_bar()
+        with self.output_lock:
+            self._del_status_bar()
+            self._write(channel, msg + '\n')
+        self._refresh_status_bar()
 
     def _dbg(self, level, msg):
         if level > self.verbose:
@@ -357,17 +533,21 @@ class Queue(object):
     def _on_job_init(self, job):
         if job.data is None:
             job.data = {}
-        job.data['pipe']   = self._create_pipe()
-        job.data['stdout'] = self.channel_map['connection']
+        job.data['pipe']    = self._create_pipe()
+        job.data['stdout']  = self.channel_map['connection']
+        job.data['profile'] = random.random() < self.profile_rate
 
     def _on_job_destroy(self, job):
         job.data['pipe'].close()
 
     def _on_job_started(self, job):
-        self._del_status_bar()
-        self._print_status_bar()
+        with self.status_lock:
+            self.running_jobs[job.id] = job.name
+        self._refresh_status_bar()
 
     def _on_job_error(self, job, exc_info):
+        with self.status_lock:
+            self.errors += 1
         msg   = job.name + ' error: ' + str(exc_info[1])
         trace = ''.join(format_exception(*exc_info))
         self._print('errors', msg)
@@ -378,19 +558,19 @@ class Queue(object):
 
     def _on_job_succeeded(self, job):
         self._on_job_destroy(job)
-        self.completed += 1
+        with self.status_lock:
+            self.running_jobs.pop(job.id, None)
+            self.completed += 1
         self._print('status_bar', job.name + ' succeeded.')
         self._dbg(2, job.name + ' job is done.')
-        self._del_status_bar()
-        self._print_status_bar(exclude = job.name)
 
     def _on_job_aborted(self, job):
         self._on_job_destroy(job)
-        self.completed += 1
-        self.failed    += 1
+        with self.status_lock:
+            self.running_jobs.pop(job.id, None)
+            self.completed += 1
+            self.failed    += 1
         self._print('errors', job.name + ' finally failed.')
-        self._del_status_bar()
-        self._print_status_bar(exclude = job.name)
 
     def set_max_threads(self, n_connections):
         """
@@ -411,6 +591,40 @@ class Queue(object):
         """
         return self.workqueue.get_max_threads()
 
+    def set_profile_rate(self, rate):
+        """
+        Enables profiling of the given fraction of all jobs that are
+        started from now on. For example, 0.01 profiles 1% of all jobs,
+        which keeps the overhead low enough for production use.
+        Each sampled job is run under cProfile, and the results of all
+        threads and processes are merged into the profile that is
+        returned by get_profile().
+
+        @type  rate: float
+        @param rate: A number between 0.0 (disabled) and 1.0 (all jobs).
+        """
+        self.profile_rate = float(rate)
+
+    def get_profile_rate(self):
+        """
+        Returns the fraction of jobs that are profiled.
+
+        @rtype:  float
+        @return: A number between 0.0 and 1.0.
+        """
+        return self.profile_rate
+
+    def get_profile(self):
+        """
+        Returns the merged profile of all sampled jobs. Use
+        L{Exscript.util.profiler.Profile.dump()} to write it to a file
+        that can be read using pstats.
+
+        @rtype:  L{Exscript.util.profiler.Profile}
+        @return: The profile.
+        """
+        return self.profile
+
     def add_account_pool(self, pool, match = None):
         """
         Adds a new account pool. If the given match argument is
@@ -499,8 +713,7 @@ class Queue(object):
         self.workqueue.wait_until_done()
         for child in self.pipe_handlers.values():
             child.join()
-        self._del_status_bar()
-        self._print_status_bar()
+        self._flush_status_bar()
         gc.collect()
 
     def shutdown(self, force = False):
@@ -521,7 +734,7 @@ class Queue(object):
         self._dbg(2, 'Shutting down queue...')
         self.workqueue.shutdown(True)
         self._dbg(2, 'Queue shut down.')
-        self._del_status_bar()
+        self._cancel_status_bar()
 
     def destroy(self, force = False):
         """
@@ -542,9 +755,13 @@ class Queue(object):
             self.completed         = 0
             self.total             = 0
             self.failed            = 0
+            self.errors            = 0
             self.status_bar_length = 0
+            self.running_jobs      = {}
+            self.stats.clear()
+            self.profile.clear()
             self._dbg(2, 'Queue destroyed.')
-            self._del_status_bar()
+            self._cancel_status_bar()
 
     def reset(self):
         """
@@ -556,9 +773,13 @@ class Queue(object):
         self.completed         = 0
         self.total             = 0
         self.failed            = 0
+        self.errors            = 0
         self.status_bar_length = 0
+        self.running_jobs      = {}
+        self.stats.clear()
+        self.profile.clear()
         self._dbg(2, 'Queue reset.')
-        self._del_status_bar()
+        self._cancel_status_bar()
 
     def _run(self, hosts, callback, queue_function, *args):
         hosts       = to_hosts(hosts, default_domain = self.domain)
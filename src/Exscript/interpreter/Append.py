@@ -36,11 +36,13 @@ class Append(Token):
 
         self.mark_end()
 
-    def value(self, context):
-        existing = self.parent.get(self.varname)
-        args     = {self.varname: existing + self.expr.value(context)}
-        self.parent.define(**args)
-        return 1
+    def compile(self):
+        expr    = self.expr.compile()
+        varname = self.varname
+        def value(variables):
+            variables[varname] = variables.get(varname) + expr(variables)
+            return 1
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, "to", self.varname
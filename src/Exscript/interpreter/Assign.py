@@ -39,7 +39,15 @@ class Assign(Token):
         self.expression.dump(indent + 1)
         print (' ' * indent) + self.name, self.varname, 'start'
 
-    def value(self, context):
-        result = self.expression.value(context)
-        self.parent.define(**{self.varname: result})
-        return result
+    def compile(self):
+        expression = self.expression.compile()
+        varname    = self.varname
+        raw        = varname.find('.') >= 0 or varname.startswith('_')
+        def value(variables):
+            result = expression(variables)
+            if raw or isinstance(result, list):
+                variables[varname] = result
+            else:
+                variables[varname] = [result]
+            return result
+        return value
@@ -24,8 +24,8 @@ class Enter(Token):
 
         self.execute = Execute(lexer, parser, parent, '')
 
-    def value(self, context):
-        return self.execute.value(context)
+    def compile(self):
+        return self.execute.compile()
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name
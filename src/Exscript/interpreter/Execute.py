@@ -12,15 +12,82 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import re
 from Exscript.parselib           import Token
 from Exscript.interpreter.String import String, string_re
 
+_newline_re = re.compile(r'\r\n|\r|\n')
+
+class _LineMatcher(object):
+    """
+    Matches each line of a response against a list of regular
+    expressions, while the response is received in parts. The lines
+    are the same as those produced by splitting the normalized
+    response, and only the groups of the matches are kept.
+    """
+
+    def __init__(self, regexes, strip_command):
+        self.regexes = regexes
+        self.groups  = [[] for regex in regexes]
+        self.skip    = strip_command
+        self.partial = ''
+
+    def _match(self, line):
+        if self.skip:
+            self.skip = False
+            return
+        for regex, groups in zip(self.regexes, self.groups):
+            match = regex.search(line)
+            if match is not None:
+                groups.append(match.groups())
+
+    def _split(self, data, end):
+        # Matches the lines that end before the given position, and
+        # returns the remaining data.
+        start = 0
+        for match in _newline_re.finditer(data, 0, end):
+            self._match(data[start:match.start()])
+            start = match.end()
+        return data[start:]
+
+    def feed(self, data):
+        """
+        Matches the complete lines in the given part of the response.
+
+        @type  data: str
+        @param data: The next part of the response.
+        """
+        # A trailing \r may be the first half of a \r\n.
+        data = self.partial + data
+        if data.endswith('\r'):
+            self.partial = self._split(data, len(data) - 1)
+        else:
+            self.partial = self._split(data, len(data))
+
+    def close(self):
+        """
+        Matches the last line, once the whole response was fed.
+        """
+        line         = self._split(self.partial, len(self.partial))
+        self.partial = ''
+
+        # A response without any line break contains only the echo of
+        # the command.
+        if self.skip:
+            self.skip = False
+            line      = ''
+        self._match(line)
+
 class Execute(String):
     def __init__(self, lexer, parser, parent, command):
         Token.__init__(self, 'Execute', lexer, parser, parent)
         self.string        = command
         self.no_prompt     = parser.no_prompt
         self.strip_command = parser.strip_command
+        self.window        = parser.window
+        self.extracts      = []
+        self.pipeline      = []
+        self.pipelined     = False
 
         # The lexer has parsed the command, including a newline.
         # Make the debugger point to the beginning of the command.
@@ -31,31 +98,101 @@ class Execute(String):
         string_re.sub(self.variable_test_cb, command)
         self.parent.define(__response__ = [])
 
-    def value(self, context):
+    def _get_connection(self):
         if not self.parent.is_defined('__connection__'):
             error = 'Undefined variable "__connection__"'
             self.lexer.runtime_error(error, self)
-        conn = self.parent.get('__connection__')
+        return self.parent.get('__connection__')
 
-        # Substitute variables in the command for values.
-        command = string_re.sub(self.variable_sub_cb, self.string)
-        command = command.lstrip()
+    def compile(self):
+        if self.pipelined:
+            return lambda variables: 1
+        substitutes = [e.compile_string() for e in [self] + self.pipeline]
+        def value(variables):
+            conn     = self._get_connection()
+            commands = [substitute(variables) for substitute in substitutes]
+            return self._execute(variables, conn, commands)
+        return value
 
-        # Execute the command.
-        if self.no_prompt:
-            conn.send(command + '\r')
-            response = ''
-        else:
+    def add_extract(self, extract):
+        """
+        Makes the given extract statement match the lines of the response
+        while they are read, such that the response does not need to be
+        stored. The statement must directly follow this command.
+
+        @type  extract: Extract
+        @param extract: The extract statement.
+        """
+        extract.streamed = True
+        self.extracts.append(extract)
+
+    def add_pipelined(self, execute):
+        """
+        Makes this command also execute the given command, without
+        waiting for the prompt of each command before sending the next
+        one. The command must directly follow this command (or the
+        command that was last added).
+
+        @type  execute: Execute
+        @param execute: The command.
+        """
+        execute.pipelined = True
+        self.pipeline.append(execute)
+
+    def _create_matcher(self, variables):
+        regexes = [e.regex.compile()(variables) for e in self.extracts]
+        return _LineMatcher(regexes, self.strip_command)
+
+    def _store(self, variables, matcher, response):
+        matcher.feed(response)
+        matcher.close()
+        for extract, groups in zip(self.extracts, matcher.groups):
+            extract.store(variables, groups)
+        variables['__response__'] = []
+        return 1
+
+    def _stream(self, variables, conn, command):
+        # The lines are matched while the response is received, and are
+        # then dropped by the connection.
+        matcher = self._create_matcher(variables)
+        conn.set_response_handler(matcher.feed)
+        try:
             conn.execute(command)
-            response = conn.response.replace('\r\n', '\n')
-            response = response.replace('\r', '\n').split('\n')
+        finally:
+            conn.set_response_handler(None)
+        return self._store(variables, matcher, conn.response)
+
+    def _execute(self, variables, conn, commands):
+        commands = [command.lstrip() for command in commands]
+
+        # Execute the commands.
+        if self.no_prompt:
+            conn.send(commands[0] + '\r')
+            variables['__response__'] = ['']
+            return 1
+        elif self.pipeline:
+            conn.execute_pipelined(commands, self.window)
+            return self.pipeline[-1]._receive(variables, conn.response)
+        elif self.extracts:
+            return self._stream(variables, conn, commands[0])
+        conn.execute(commands[0])
+        return self._receive(variables, conn.response)
+
+    def _receive(self, variables, response):
+        # The responses of pipelined commands are only separated once
+        # they were received, so they can not be streamed.
+        if self.extracts:
+            matcher = self._create_matcher(variables)
+            return self._store(variables, matcher, response)
 
+        response = response.replace('\r\n', '\n')
+        response = response.replace('\r', '\n').split('\n')
         if self.strip_command:
             response = response[1:]
         if len(response) == 0:
             response = ['']
 
-        self.parent.define(__response__ = response)
+        variables['__response__'] = response
         return 1
 
 
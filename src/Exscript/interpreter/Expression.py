@@ -69,8 +69,8 @@ class Expression(Token):
         self.prioritize(current.lft, prio + 1)
         self.prioritize(current.rgt, prio)
 
-    def value(self, context):
-        return self.root.value(context)
+    def compile(self):
+        return self.root.compile()
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, 'start'
@@ -15,6 +15,27 @@
 import Term
 from Exscript.parselib import Token
 
+# Maps each two-term operator to a function that receives the first item
+# and the list of both operands.
+operators = {
+    'is':     lambda lft, rgt, lft_lst, rgt_lst: [lft == rgt],
+    'is not': lambda lft, rgt, lft_lst, rgt_lst: [lft != rgt],
+    'in':     lambda lft, rgt, lft_lst, rgt_lst: [lft in rgt_lst],
+    'not in': lambda lft, rgt, lft_lst, rgt_lst: [lft not in rgt_lst],
+    'ge':     lambda lft, rgt, lft_lst, rgt_lst: [int(lft) >= int(rgt)],
+    'gt':     lambda lft, rgt, lft_lst, rgt_lst: [int(lft) > int(rgt)],
+    'le':     lambda lft, rgt, lft_lst, rgt_lst: [int(lft) <= int(rgt)],
+    'lt':     lambda lft, rgt, lft_lst, rgt_lst: [int(lft) < int(rgt)],
+    'and':    lambda lft, rgt, lft_lst, rgt_lst: [lft and rgt],
+    'or':     lambda lft, rgt, lft_lst, rgt_lst: [lft or rgt],
+    '*':      lambda lft, rgt, lft_lst, rgt_lst: [int(lft) * int(rgt)],
+    '/':      lambda lft, rgt, lft_lst, rgt_lst: [int(lft) / int(rgt)],
+    '%':      lambda lft, rgt, lft_lst, rgt_lst: [int(lft) % int(rgt)],
+    '.':      lambda lft, rgt, lft_lst, rgt_lst: [str(lft) + str(rgt)],
+    '+':      lambda lft, rgt, lft_lst, rgt_lst: [int(lft) + int(rgt)],
+    '-':      lambda lft, rgt, lft_lst, rgt_lst: [int(lft) - int(rgt)],
+}
+
 class ExpressionNode(Token):
     def __init__(self, lexer, parser, parent, parent_node = None):
         # Skip whitespace before initializing the token to make sure that self.start
@@ -82,87 +103,71 @@ class ExpressionNode(Token):
             raise Exception('Invalid operator.')
 
 
-    def value(self, context):
-        # Special behavior where we only have one term.
+    def _matches(self, lft, rgt, lft_lst, rgt_lst):
+        # The "matches" keyword requires a regular expression as the right hand
+        # operand. The exception throws if "regex" does not have a match() method.
+        regex = rgt_lst
+        try:
+            regex.match(str(lft))
+        except AttributeError:
+            error = 'Right hand operator is not a regular expression'
+            self.lexer.runtime_error(error, self.rgt)
+        for line in lft_lst:
+            if regex.search(str(line)):
+                return [1]
+        return [0]
+
+    def compile(self):
         if self.op is None:
-            return self.lft.value(context)
+            return self.lft.compile()
         elif self.op == 'not':
-            return [not self.rgt.value(context)[0]]
-
-        # There are only two types of values: Regular expressions and lists.
-        # We also have to make sure that empty lists do not cause an error.
-        lft_lst = self.lft.value(context)
-        if type(lft_lst) == type([]):
-            if len(lft_lst) > 0:
-                lft = lft_lst[0]
+            rgt_value = self.rgt.compile()
+            return lambda variables: [not rgt_value(variables)[0]]
+
+        if self.op == 'matches':
+            operator = self._matches
+        elif self.op in operators:
+            operator = operators[self.op]
+        else:
+            raise Exception('Invalid operator.')
+
+        lft_value  = self.lft.compile()
+        rgt_value  = self.rgt.compile()
+        arithmetic = self.op_type == 'arithmetic_operator' and self.op != '.'
+        error      = 'Operand for %s is not a number' % (self.op)
+        lexer      = self.lexer
+        lft_node   = self.lft
+        rgt_node   = self.rgt
+
+        def value(variables):
+            lft_lst = lft_value(variables)
+            if isinstance(lft_lst, list):
+                if lft_lst:
+                    lft = lft_lst[0]
+                else:
+                    lft = ''
             else:
-                lft = ''
-        rgt_lst = self.rgt.value(context)
-        if type(rgt_lst) == type([]):
-            if len(rgt_lst) > 0:
-                rgt = rgt_lst[0]
+                lft = lft_lst
+            rgt_lst = rgt_value(variables)
+            if isinstance(rgt_lst, list):
+                if rgt_lst:
+                    rgt = rgt_lst[0]
+                else:
+                    rgt = ''
             else:
-                rgt = ''
-
-        if self.op_type == 'arithmetic_operator' and self.op != '.':
-            error = 'Operand for %s is not a number' % (self.op)
-            try:
-                lft = int(lft)
-            except ValueError:
-                self.lexer.runtime_error(error, self.lft)
-            try:
-                rgt = int(rgt)
-            except ValueError:
-                self.lexer.runtime_error(error, self.rgt)
-
-        # Two-term expressions.
-        if self.op == 'is':
-            return [lft == rgt]
-        elif self.op == 'matches':
-            regex = rgt_lst
-            # The "matches" keyword requires a regular expression as the right hand
-            # operand. The exception throws if "regex" does not have a match() method.
-            try:
-                regex.match(str(lft))
-            except AttributeError:
-                error = 'Right hand operator is not a regular expression'
-                self.lexer.runtime_error(error, self.rgt)
-            for line in lft_lst:
-                if regex.search(str(line)):
-                    return [1]
-            return [0]
-        elif self.op == 'is not':
-            #print "LFT: '%s', RGT: '%s', RES: %s" % (lft, rgt, [lft != rgt])
-            return [lft != rgt]
-        elif self.op == 'in':
-            return [lft in rgt_lst]
-        elif self.op == 'not in':
-            return [lft not in rgt_lst]
-        elif self.op == 'ge':
-            return [int(lft) >= int(rgt)]
-        elif self.op == 'gt':
-            return [int(lft) > int(rgt)]
-        elif self.op == 'le':
-            return [int(lft) <= int(rgt)]
-        elif self.op == 'lt':
-            return [int(lft) < int(rgt)]
-        elif self.op == 'and':
-            return [lft and rgt]
-        elif self.op == 'or':
-            return [lft or rgt]
-        elif self.op == '*':
-            return [int(lft) * int(rgt)]
-        elif self.op == '/':
-            return [int(lft) / int(rgt)]
-        elif self.op == '%':
-            return [int(lft) % int(rgt)]
-        elif self.op == '.':
-            return [str(lft) + str(rgt)]
-        elif self.op == '+':
-            return [int(lft) + int(rgt)]
-        elif self.op == '-':
-            return [int(lft) - int(rgt)]
+                rgt = rgt_lst
 
+            if arithmetic:
+                try:
+                    lft = int(lft)
+                except ValueError:
+                    lexer.runtime_error(error, lft_node)
+                try:
+                    rgt = int(rgt)
+                except ValueError:
+                    lexer.runtime_error(error, rgt_node)
+            return operator(lft, rgt, lft_lst, rgt_lst)
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, self.op, 'start'
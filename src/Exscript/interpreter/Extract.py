@@ -23,6 +23,7 @@ class Extract(Token):
         self.variables = {}
         self.append    = False
         self.source    = None
+        self.streamed  = False
 
         if parser.no_prompt: 
             msg = "'extract' keyword does not work with --no-prompt"
@@ -73,50 +74,85 @@ class Extract(Token):
             self.source = Term(lexer, parser, parent)
         self.mark_end()
 
-    def extract(self, context):
-        # Re-initialize the variable content, because this method
-        # might be called multiple times.
-        for varname in self.varnames:
-            self.variables[varname] = []
+    def _get_groups(self, groups):
+        # Returns a dict that maps each variable name to the list of
+        # substrings that were extracted into it.
+        if groups:
+            n_groups = len(groups[0])
+            if n_groups < len(self.varnames):
+                # This happens if the user provided a regex with less 
+                # groups in it than the number of variables.
+                i    = n_groups + 1
+                msg  = 'Extract: %s variables, but regular expression' % i
+                msg += '\ncontains only %s groups.' % (i - 1)
+                self.lexer.runtime_error(msg, self)
+        return dict((varname, [group[i] for group in groups])
+                    for i, varname in enumerate(self.varnames))
 
-        if self.source is None:
-            buffer = self.parent.get('__response__')
-        else:
-            buffer = self.source.value(context)
-        #print "Buffer contains", buffer
+    def _extract(self, buffer, regex, line_regex, variables):
+        # The result is collected in a new dict, because this method
+        # might be called multiple times, possibly from several threads
+        # that execute the same program.
+        if not buffer:
+            return self._get_groups([])
+
+        # If the regular expression can not match across a line break,
+        # the lines are joined and searched in a single pass.
+        pattern = line_regex(variables)
+        if pattern is not None:
+            text = '\n'.join(buffer)
+            if text.count('\n') == len(buffer) - 1:
+                groups = [m.groups() for m in pattern.finditer(text)]
+                return self._get_groups(groups)
 
-        # Walk through all lines, matching each one against the regular
-        # expression.
+        pattern = regex(variables)
+        groups  = []
+
+        # Otherwise, walk through all lines, matching each one against the
+        # regular expression.
         for line in buffer:
-            match = self.regex.value(context).search(line)
-            if match is None:
-                continue
+            match = pattern.search(line)
+            if match is not None:
+                groups.append(match.groups())
+        return self._get_groups(groups)
 
-            # If there was a match, store the extracted substrings in our
-            # list variables.
-            i = 0
-            for varname in self.varnames:
-                i += 1
-                try:
-                    value = match.group(i)
-                except IndexError:
-                    # This happens if the user provided a regex with less 
-                    # groups in it than the number of variables.
-                    msg  = 'Extract: %s variables, but regular expression' % i
-                    msg += '\ncontains only %s groups.' % (i - 1)
-                    self.lexer.runtime_error(msg, self)
-                self.variables[varname].append(value)
-
-    def value(self, context):
-        self.extract(context)
+    def _define(self, variables, result):
         if not self.append:
-            self.parent.define(**self.variables)
+            variables.update(result)
+        else:
+            for key in result:
+                variables[key] = variables.get(key) + result[key]
+
+    def store(self, variables, groups):
+        """
+        Defines the variables of the statement, given the groups that
+        were matched by the regular expression. Used by the Execute
+        token in streaming mode, which matches the lines of the response
+        as they are read.
+
+        @type  variables: dict
+        @param variables: The variables of the running program.
+        @type  groups: list[tuple(str)]
+        @param groups: The groups of each matching line.
+        """
+        self._define(variables, self._get_groups(groups))
+
+    def compile(self):
+        if self.streamed:
+            return lambda variables: 1
+        regex      = self.regex.compile()
+        line_regex = self.regex.compile_lines()
+        if self.source is None:
+            source = lambda variables: variables.get('__response__')
         else:
-            for key in self.variables:
-                existing = self.parent.get(key)
-                self.parent.define(**{key: existing + self.variables[key]})
-        return 1
+            source = self.source.compile()
 
+        def value(variables):
+            buffer = source(variables)
+            result = self._extract(buffer, regex, line_regex, variables)
+            self._define(variables, result)
+            return 1
+        return value
 
     def dump(self, indent = 0):
         mode = self.append and 'into' or 'as'
@@ -36,10 +36,17 @@ class Fail(Token):
         self.mark_end()
         lexer.skip(['whitespace', 'newline'])
 
-    def value(self, context):
-        if self.expression is None or self.expression.value(context)[0]:
-            raise FailException(self.msg.value(context)[0])
-        return 1
+    def compile(self):
+        msg = self.msg.compile()
+        if self.expression is None:
+            expression = lambda variables: [True]
+        else:
+            expression = self.expression.compile()
+        def value(variables):
+            if expression(variables)[0]:
+                raise FailException(msg(variables)[0])
+            return 1
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, 'start'
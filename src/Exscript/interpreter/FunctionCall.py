@@ -53,9 +53,14 @@ class FunctionCall(Token):
             argument.dump(indent + 1)
         print (' ' * indent) + self.name, self.funcname, 'end.'
 
-    def value(self, context):
-        argument_values = [arg.value(context) for arg in self.arguments]
-        function        = self.parent.get(self.funcname)
-        if function is None:
-            self.lexer.runtime_error('Undefined function %s' % self.funcname, self)
-        return function(self.parent, *argument_values)
+    def compile(self):
+        arguments = [arg.compile() for arg in self.arguments]
+        scope     = self.parent
+        funcname  = self.funcname
+        def value(variables):
+            argument_values = [arg(variables) for arg in arguments]
+            function        = variables.get(funcname)
+            if function is None:
+                self.lexer.runtime_error('Undefined function %s' % funcname, self)
+            return function(scope, *argument_values)
+        return value
@@ -46,12 +46,20 @@ class IfCondition(Token):
         # There was no "elif", so we handle a normal "else" condition here.
         self.else_block = Code.Code(lexer, parser, parent)
 
-    def value(self, context):
-        if self.expression.value(context)[0]:
-            self.if_block.value(context)
-        elif self.else_block is not None:
-            self.else_block.value(context)
-        return 1
+    def compile(self):
+        expression = self.expression.compile()
+        if_block   = self.if_block.compile()
+        if self.else_block is None:
+            else_block = lambda variables: 1
+        else:
+            else_block = self.else_block.compile()
+        def value(variables):
+            if expression(variables)[0]:
+                if_block(variables)
+            else:
+                else_block(variables)
+            return 1
+        return value
 
 
     def dump(self, indent = 0):
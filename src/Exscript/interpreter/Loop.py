@@ -102,48 +102,67 @@ class Loop(Token):
         self.block = Code.Code(lexer, parser, parent)
 
 
-    def value(self, context):
+    def compile(self):
+        block = self.block.compile()
+        vars  = self.iter_varnames
+        if self.during is None:
+            during = None
+        else:
+            during = self.during.compile()
+        if self.until is None:
+            until = None
+        else:
+            until = self.until.compile()
+
         if len(self.list_variables) == 0 and not self.thefrom:
             # If this is a "while" loop, iterate as long as the condition is True.
-            if self.during is not None:
-                while self.during.value(context)[0]:
-                    self.block.value(context)
-                return 1
+            if during is not None:
+                def value(variables):
+                    while during(variables)[0]:
+                        block(variables)
+                    return 1
+                return value
 
             # If this is an "until" loop, iterate until the condition is True.
-            if self.until is not None:
-                while not self.until.value(context)[0]:
-                    self.block.value(context)
-                return 1
+            if until is not None:
+                def value(variables):
+                    while not until(variables)[0]:
+                        block(variables)
+                    return 1
+                return value
 
         # Retrieve the lists from the list terms.
         if self.thefrom:
-            start = self.thefrom.value(context)[0]
-            stop  = self.theto.value(context)[0]
-            lists = [range(start, stop)]
+            thefrom   = self.thefrom.compile()
+            theto     = self.theto.compile()
+            get_lists = lambda variables: [range(thefrom(variables)[0],
+                                                 theto(variables)[0])]
         else:
-            lists = [var.value(context) for var in self.list_variables]
-        vars  = self.iter_varnames
-        
-        # Make sure that all lists have the same length.
-        for list in lists:
-            if len(list) != len(lists[0]):
-                msg = 'All list variables must have the same length'
-                self.lexer.runtime_error(msg, self)
-
-        # Iterate.
-        for i in xrange(len(lists[0])):
-            f = 0
+            list_variables = [var.compile() for var in self.list_variables]
+            get_lists      = lambda variables: [var(variables)
+                                                for var in list_variables]
+
+        def value(variables):
+            lists = get_lists(variables)
+
+            # Make sure that all lists have the same length.
             for list in lists:
-                self.block.define(**{vars[f]: [list[i]]})
-                f += 1
-            if self.until is not None and self.until.value(context)[0]:
-                break
-            if self.during is not None and not self.during.value(context)[0]:
-                break
-            self.block.value(context)
-        return 1
+                if len(list) != len(lists[0]):
+                    msg = 'All list variables must have the same length'
+                    self.lexer.runtime_error(msg, self)
 
+            # Iterate.
+            iterators = zip(vars, lists)
+            for i in xrange(len(lists[0])):
+                for varname, list in iterators:
+                    variables[varname] = [list[i]]
+                if until is not None and until(variables)[0]:
+                    break
+                if during is not None and not during(variables)[0]:
+                    break
+                block(variables)
+            return 1
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name,
@@ -16,8 +16,9 @@ class Number(object):
     def __init__(self, number):
         self.number = int(number)
 
-    def value(self, context):
-        return [self.number]
+    def compile(self):
+        number = self.number
+        return lambda variables: [number]
 
     def dump(self, indent = 0):
         print (' ' * indent) + 'Number', self.number
@@ -12,7 +12,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
-import copy
 from Exscript.parselib            import Lexer
 from Exscript.interpreter.Program import Program
 
@@ -20,6 +19,8 @@ class Parser(object):
     def __init__(self, **kwargs):
         self.no_prompt     = kwargs.get('no_prompt',     False)
         self.strip_command = kwargs.get('strip_command', True)
+        self.stream        = kwargs.get('stream',        False)
+        self.window        = kwargs.get('window',        1)
         self.secure_only   = kwargs.get('secure',        False)
         self.debug         = kwargs.get('debug',         0)
         self.variables     = {}
@@ -35,7 +36,8 @@ class Parser(object):
         self.variables.update(kwargs)
 
     def _create_lexer(self):
-        variables = copy.deepcopy(self.variables)
+        # The program freezes the values of its own copy.
+        variables = dict(self.variables)
         return Lexer(Program, self, variables, debug = self.debug)
 
     def parse(self, string, filename = None):
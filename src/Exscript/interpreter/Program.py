@@ -13,28 +13,62 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import copy
+import threading
 from Exscript.interpreter.Template import Template
-from Exscript.interpreter.Scope    import Scope
+from Exscript.interpreter.Scope    import Scope, FrozenList
 
 class Program(Scope):
     def __init__(self, lexer, parser, variables, **kwargs):
+        self._local         = threading.local()
+        self.init_variables = variables
         Scope.__init__(self, 'Program', lexer, parser, None, **kwargs)
         self.variables      = variables
-        self.init_variables = variables
         self.add(Template(lexer, parser, self))
+        self.code           = self.compile()
+        self._freeze()
+
+    # The variables of a running program are kept per thread, such that
+    # a compiled program may be executed by multiple threads at once.
+    def _get_variables(self):
+        return getattr(self._local, 'variables', self.init_variables)
+
+    def _set_variables(self, variables):
+        self._local.variables = variables
+
+    variables = property(_get_variables, _set_variables)
+
+    # The initial variables are the bottom layer of every run. Runs bind
+    # their variables in a copy of the layer, so the layer itself is only
+    # changed by init(), and its lists are frozen, as every run shares
+    # them.
+    def _freeze(self):
+        for key, value in self.init_variables.iteritems():
+            if isinstance(value, list) and not isinstance(value, FrozenList):
+                self.init_variables[key] = FrozenList(value)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        del state['code']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self.code   = self.compile()
 
     def init(self, *args, **kwargs):
         for key in kwargs:
             if key.find('.') >= 0 or key.startswith('_'):
                 continue
-            if type(kwargs[key]) == type([]):
-                self.init_variables[key] = kwargs[key]
+            if isinstance(kwargs[key], list):
+                self.init_variables[key] = FrozenList(kwargs[key])
             else:
-                self.init_variables[key] = [kwargs[key]]
+                self.init_variables[key] = FrozenList([kwargs[key]])
 
     def execute(self, *args, **kwargs):
         self.variables = copy.copy(self.init_variables)
         if 'variables' in kwargs:
             self.variables.update(kwargs.get('variables'))
-        self.value(self)
+        self.code(self.variables)
         return self.variables
@@ -13,6 +13,11 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import re
+import sre_parse
+import sre_compile
+import sre_constants as sre
+import threading
+from collections                 import OrderedDict
 from Exscript.interpreter.String import String
 
 # Matches any opening parenthesis that is neither preceeded by a backslash
@@ -28,6 +33,98 @@ modifier_grammar_c = []
 for thetype, regex in modifier_grammar:
     modifier_grammar_c.append((thetype, re.compile(regex, re.M|re.S)))
 
+# Regular expressions that contain variables are compiled when the
+# template is executed. The results are kept in a bounded LRU cache,
+# keyed by the substituted pattern and the flags.
+_cache      = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = 500
+
+# Operators of a parsed regular expression that match a single character.
+_char_ops = sre.LITERAL, sre.NOT_LITERAL, sre.ANY, sre.IN, sre.CATEGORY
+
+def compile_regex(pattern, flags = 0):
+    """
+    Like re.compile(), but uses an LRU cache that is larger than the one
+    of the re module.
+
+    @type  pattern: str
+    @param pattern: The regular expression.
+    @type  flags: int
+    @param flags: The flags that are passed to re.compile().
+    @rtype:  re.RegexObject
+    @return: The compiled regular expression.
+    """
+    return _cached((pattern, flags), re.compile, pattern, flags)
+
+def compile_line_regex(pattern, flags = 0):
+    """
+    Returns a regular expression that, when passed to finditer() with
+    the lines of a text joined by newlines, yields the same matches as
+    searching each of the lines separately.
+    This is only possible for patterns that are anchored at the start
+    of the line and can not match across a line break. For any other
+    pattern, None is returned, and the lines must be searched
+    separately.
+
+    @type  pattern: str
+    @param pattern: The regular expression.
+    @type  flags: int
+    @param flags: The flags that are passed to re.compile().
+    @rtype:  re.RegexObject|None
+    @return: The compiled regular expression, or None.
+    """
+    return _cached((pattern, flags, 'lines'), _line_regex, pattern, flags)
+
+def _cached(key, func, *args):
+    with _cache_lock:
+        if key in _cache:
+            result = _cache.pop(key)
+            _cache[key] = result
+            return result
+    result = func(*args)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > _cache_size:
+            _cache.popitem(last = False)
+    return result
+
+def _line_regex(pattern, flags):
+    # Each match starts at the beginning of a line and ends on the same
+    # line, so there is at most one match per line.
+    parsed = sre_parse.parse(pattern, flags)
+    flags  = parsed.pattern.flags | flags
+    if not parsed.data or parsed[0] != (sre.AT, sre.AT_BEGINNING):
+        return None
+    if flags & re.S or not _is_line_local(parsed, flags):
+        return None
+    return re.compile(pattern, flags | re.M)
+
+def _is_line_local(subpattern, flags):
+    # True if the parsed pattern can not match a newline, and does not
+    # look at text outside of the current line.
+    for op, av in subpattern:
+        if op in _char_ops:
+            item = sre_parse.SubPattern(subpattern.pattern, [(op, av)])
+            if sre_compile.compile(item, flags).match('\n'):
+                return False
+        elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+            if not _is_line_local(av[2], flags):
+                return False
+        elif op == sre.SUBPATTERN:
+            if not _is_line_local(av[1], flags):
+                return False
+        elif op == sre.BRANCH:
+            for item in av[1]:
+                if not _is_line_local(item, flags):
+                    return False
+        elif op == sre.AT:
+            if av in (sre.AT_BEGINNING_STRING, sre.AT_END_STRING):
+                return False
+        elif op != sre.GROUPREF:
+            return False
+    return True
+
 class Regex(String):
     def __init__(self, lexer, parser, parent):
         self.delimiter = lexer.token()[1]
@@ -54,15 +151,47 @@ class Regex(String):
             error = 'Invalid regular expression %s: %s' % (repr(self.string), e)
             lexer.syntax_error(error, self)
 
+        # Patterns that do not contain variables are compiled only once.
+        self.regex_c = None
+        self.lines_c = None
+        pattern      = self.get_constant()
+        if pattern is not None:
+            try:
+                self.regex_c = re.compile(pattern, self.flags)
+                self.lines_c = compile_line_regex(pattern, self.flags)
+            except Exception:
+                pass
+
     def _escape(self, token):
         char = token[1]
         if char == self.delimiter:
             return char
         return token
 
-    def value(self, context):
-        pattern = String.value(self, context)[0]
-        return re.compile(pattern, self.flags)
+    def compile(self):
+        if self.regex_c is not None:
+            regex = self.regex_c
+            return lambda variables: regex
+        substitute = self.compile_string()
+        flags      = self.flags
+        return lambda variables: compile_regex(substitute(variables), flags)
+
+    def compile_lines(self):
+        """
+        Like compile(), but the returned function returns the regular
+        expression as produced by compile_line_regex(), or None if the
+        lines of a text need to be searched separately.
+
+        @rtype:  callable
+        @return: A function that takes the variables as its only argument.
+        """
+        if self.regex_c is not None:
+            regex = self.lines_c
+            return lambda variables: regex
+        substitute = self.compile_string()
+        flags      = self.flags
+        return lambda variables: compile_line_regex(substitute(variables),
+                                                    flags)
 
 
     def dump(self, indent = 0):
@@ -12,9 +12,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
-from copy              import deepcopy
 from Exscript.parselib import Token
 
+class FrozenList(list):
+    """
+    A list that can not be modified in place. Used for the initial values
+    of a program's variables, which are shared by all of its runs.
+    """
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    __setitem__  = __delitem__  = _frozen
+    __setslice__ = __delslice__ = _frozen
+    __iadd__     = __imul__     = _frozen
+    append = extend = insert = pop = remove = reverse = sort = _frozen
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
 class Scope(Token):
     def __init__(self, name, lexer, parser, parent = None, *args, **kwargs):
         Token.__init__(self, name, lexer, parser, parent)
@@ -23,7 +38,7 @@ class Scope(Token):
         self.exit_requested = 0
         for key in self.variables:
             if key.find('.') < 0 and not key.startswith('_'):
-                assert type(self.variables[key]) == type([])
+                assert isinstance(self.variables[key], list)
 
     def exit_request(self):
         self.exit_requested = 1
@@ -33,7 +48,7 @@ class Scope(Token):
             return self.parent.define(**kwargs)
         for key in kwargs:
             if key.find('.') >= 0 or key.startswith('_') \
-              or type(kwargs[key]) == type([]):
+              or isinstance(kwargs[key], list):
                 self.variables[key] = kwargs[key]
             else:
                 self.variables[key] = [kwargs[key]]
@@ -63,12 +78,11 @@ class Scope(Token):
 
     def copy_public_vars(self):
         """
-        Like get_vars(), but does not include any private variables and
-        deep copies each variable.
+        Like get_vars(), but does not include any private variables.
+        The values are shared with this scope.
         """
         vars = self.get_vars()
-        vars = dict([k for k in vars.iteritems() if not k[0].startswith('_')])
-        return deepcopy(vars)
+        return dict([k for k in vars.iteritems() if not k[0].startswith('_')])
 
     def get(self, name, default = None):
         if name in self.variables:
@@ -77,11 +91,14 @@ class Scope(Token):
             return default
         return self.parent.get(name, default)
 
-    def value(self, context):
-        result = 1
-        for child in self.children:
-            result = child.value(context)
-        return result
+    def compile(self):
+        children = [child.compile() for child in self.children]
+        def value(variables):
+            result = 1
+            for child in children:
+                result = child(variables)
+            return result
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, 'start'
@@ -26,20 +26,35 @@ grammar_c = []
 for thetype, regex in grammar:
     grammar_c.append((thetype, re.compile(regex)))
 
+# Maps each delimiter to the grammar of strings using it.
+_grammars = {}
+
+def _get_grammar(delimiter):
+    grammar = _grammars.get(delimiter)
+    if grammar is None:
+        escaped_delimiter = '\\' + delimiter
+        data              = r'[^\r\n\\' + escaped_delimiter + ']+'
+        delimiter_re      = re.compile(escaped_delimiter)
+        data_re           = re.compile(data)
+        grammar           = grammar_c[:]
+        grammar.append(('string_data',      data_re))
+        grammar.append(('string_delimiter', delimiter_re))
+        _grammars[delimiter] = grammar
+    return grammar
+
+class _Field(object):
+    # The position of a variable reference within a string.
+    def __init__(self, start, end):
+        self.start = start
+        self.end   = end
+
 class String(Token):
     def __init__(self, lexer, parser, parent):
         Token.__init__(self, self.__class__.__name__, lexer, parser, parent)
 
         # Create a grammar depending on the delimiting character.
         tok_type, delimiter = lexer.token()
-        escaped_delimiter   = '\\' + delimiter
-        data                = r'[^\r\n\\' + escaped_delimiter + ']+'
-        delimiter_re        = re.compile(escaped_delimiter)
-        data_re             = re.compile(data)
-        grammar_with_delim  = grammar_c[:]
-        grammar_with_delim.append(('string_data',      data_re))
-        grammar_with_delim.append(('string_delimiter', delimiter_re))
-        lexer.set_grammar(grammar_with_delim)
+        lexer.set_grammar(_get_grammar(delimiter))
 
         # Begin parsing the string.
         lexer.expect(self, 'string_delimiter')
@@ -73,9 +88,11 @@ class String(Token):
         return char
 
     def _variable_error(self, field, msg):
-        self.start += self.string.find(field)
-        self.end    = self.start + len(field)
-        self.lexer.runtime_error(msg, self)
+        # The token may be shared by many runs of a compiled program, so
+        # the position of the field is not stored in the token. The
+        # field is located after the opening delimiter.
+        start = self.start + 1 + self.string.find(field)
+        self.lexer.runtime_error(msg, _Field(start, start + len(field)))
 
     # Tokens that include variables in a string may use this callback to
     # substitute the variable against its value.
@@ -114,8 +131,75 @@ class String(Token):
         self.variable_sub_cb(match)
         return match.group(0)
 
-    def value(self, context):
-        return [string_re.sub(self.variable_sub_cb, self.string)]
+    def _split(self):
+        # Splits the string into literal fragments and variable references.
+        fragments = []
+        pos       = 0
+        for match in string_re.finditer(self.string):
+            if match.start() > pos:
+                fragments.append(self.string[pos:match.start()])
+            pos     = match.end()
+            field   = match.group(0)
+            varname = match.group(2)
+            if match.group(1):
+                fragments.append('$' + varname)
+            elif varname == '':
+                fragments.append('$')
+            else:
+                valid = varname_re.match(varname) is not None
+                fragments.append((field, varname, valid))
+        if pos < len(self.string):
+            fragments.append(self.string[pos:])
+        return fragments
+
+    def get_constant(self):
+        """
+        Returns the value of the string if it does not contain any
+        variables, None otherwise.
+        """
+        fragments = self._split()
+        if [f for f in fragments if isinstance(f, tuple)]:
+            return None
+        return ''.join(fragments)
+
+    def compile_string(self):
+        """
+        Returns a function that takes the variables of the running
+        program and returns the string with all variables substituted.
+        The string is split into literal fragments and
+        variable names in advance.
+        """
+        string = self.get_constant()
+        if string is not None:
+            return lambda variables: string
+
+        fragments = self._split()
+        def substitute(variables):
+            result = []
+            for fragment in fragments:
+                if not isinstance(fragment, tuple):
+                    result.append(fragment)
+                    continue
+                field, varname, valid = fragment
+                value                 = variables.get(varname)
+                if not valid:
+                    msg = '%s is not a variable name' % repr(varname)
+                    self._variable_error(field, msg)
+                if value is None:
+                    msg = 'Undefined variable %s' % repr(varname)
+                    self._variable_error(field, msg)
+                elif hasattr(value, 'func_name'):
+                    msg = '%s is a function, not a variable name' % repr(varname)
+                    self._variable_error(field, msg)
+                elif isinstance(value, list):
+                    value = '\n'.join([str(v) for v in value])
+                result.append(str(value))
+            return ''.join(result)
+        return substitute
+
+    def compile(self):
+        substitute = self.compile_string()
+        return lambda variables: [substitute(variables)]
 
     def dump(self, indent = 0):
         print (' ' * indent) + 'String "' + self.string + '"'
@@ -16,6 +16,7 @@ import re
 from Exscript.interpreter.Scope   import Scope
 from Exscript.interpreter.Code    import Code
 from Exscript.interpreter.Execute import Execute
+from Exscript.interpreter.Extract import Extract
 
 grammar = (
     ('escaped_data',        r'\\.'),
@@ -45,6 +46,8 @@ class Template(Scope):
                 if isinstance(parent, Code):
                     break
                 self.add(Code(lexer, parser, self))
+                if parser.stream:
+                    self._stream_extracts()
             elif lexer.current_is('raw_data'):
                 if lexer.token()[1].lstrip().startswith('#'):
                     while not lexer.current_is('newline'):
@@ -68,7 +71,35 @@ class Template(Scope):
             else:
                 ttype = lexer.token()[0]
                 lexer.syntax_error('Unexpected %s' % ttype, self)
+        if parser.window > 1:
+            self._pipeline_commands()
         lexer.restore_grammar()
 
+    def _stream_extracts(self):
+        # Extract statements that directly follow a command and read
+        # from its response are handed to the command, which applies
+        # them to each line while it reads the response.
+        if len(self.children) < 2:
+            return
+        execute, code = self.children[-2:]
+        if not isinstance(execute, Execute) or execute.no_prompt:
+            return
+        for child in code.children:
+            if not isinstance(child, Extract) or child.source is not None:
+                break
+            execute.add_extract(child)
+
+    def _pipeline_commands(self):
+        # The first command of each run of consecutive commands executes
+        # the whole run, sending the commands in windows.
+        first = None
+        for child in self.children:
+            if not isinstance(child, Execute) or child.no_prompt:
+                first = None
+            elif first is None:
+                first = child
+            else:
+                first.add_pipelined(child)
+
     def execute(self):
-        return self.value(self)
+        return self.compile()(self.variables)
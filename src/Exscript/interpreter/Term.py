@@ -56,8 +56,8 @@ class Term(Token):
     def priority(self):
         return 6
 
-    def value(self, context):
-        return self.term.value(context)
+    def compile(self):
+        return self.term.compile()
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name
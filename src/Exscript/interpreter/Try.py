@@ -25,12 +25,15 @@ class Try(Scope):
         lexer.skip(['whitespace', 'newline'])
         self.block = Code.Code(lexer, parser, parent)
 
-    def value(self, context):
-        try:
-            self.block.value(context)
-        except ProtocolException, e:
+    def compile(self):
+        block = self.block.compile()
+        def value(variables):
+            try:
+                block(variables)
+            except ProtocolException, e:
+                return 1
             return 1
-        return 1
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + self.name, 'start'
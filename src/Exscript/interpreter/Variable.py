@@ -21,12 +21,15 @@ class Variable(Token):
         lexer.expect(self, 'varname')
         self.mark_end()
 
-    def value(self, context):
-        val = self.parent.get(self.varname)
-        if val is None:
-            msg = 'Undefined variable %s' % self.varname
-            self.lexer.runtime_error(msg, self)
-        return val
+    def compile(self):
+        varname = self.varname
+        def value(variables):
+            val = variables.get(varname)
+            if val is None:
+                msg = 'Undefined variable %s' % varname
+                self.lexer.runtime_error(msg, self)
+            return val
+        return value
 
     def dump(self, indent = 0):
         print (' ' * indent) + 'Variable', self.varname, '.'
@@ -12,10 +12,65 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import re
+from bisect import bisect_right
 from Exscript.parselib.Exception import LexerException, \
                                         CompileError, \
                                         ExecuteError
 
+# Maps each grammar to its master regular expression. Since grammars
+# are usually constants, lookups by identity are tried first.
+_master_cache = {}
+_grammar_ids  = {}
+
+def _compile_grammar(grammar):
+    """
+    Combines the regular expressions of the given grammar into a single
+    regular expression in which each token type is an alternative. Since
+    alternatives are tried from left to right, the first token type that
+    matches wins, just like when trying each expression in turn.
+    Returns a tuple (regex, types), where types maps the index of each
+    alternative's group to the token type, or None if the expressions
+    can not be combined (because they use different flags).
+    """
+    entry = _grammar_ids.get(id(grammar))
+    if entry is not None and entry[0] is grammar:
+        return entry[1]
+    key = tuple((t, r.pattern, r.flags) for t, r in grammar)
+    if key in _master_cache:
+        master = _master_cache[key]
+        _remember(grammar, master)
+        return master
+
+    master = None
+    flags  = set(r.flags for t, r in grammar)
+    if len(flags) == 1:
+        flags   = flags.pop()
+        pattern = '|'.join('(?P<_%d>%s)' % (i, r.pattern)
+                           for i, (t, r) in enumerate(grammar))
+        try:
+            regex = re.compile(pattern, flags)
+        except Exception:
+            regex = None
+
+        # Inline flags in one of the expressions would apply to all of
+        # them.
+        if regex is not None and regex.flags == flags:
+            types = {}
+            for i, (t, r) in enumerate(grammar):
+                types[regex.groupindex['_%d' % i]] = t
+            master = regex, types
+
+    _master_cache[key] = master
+    _remember(grammar, master)
+    return master
+
+def _remember(grammar, master):
+    # A reference to the grammar is kept, so that its id is not reused.
+    if len(_grammar_ids) >= 100:
+        _grammar_ids.clear()
+    _grammar_ids[id(grammar)] = grammar, master
+
 class Lexer(object):
     def __init__(self, parser_cls, *args, **kwargs):
         """
@@ -30,38 +85,63 @@ class Lexer(object):
         self.last_char       = 0
         self.token_buffer    = None
         self.grammar         = []
+        self.master          = []
+        self.line_offsets    = None
         self.debug           = kwargs.get('debug', False)
 
     def set_grammar(self, grammar):
         self.grammar.append(grammar)
+        self.master.append(_compile_grammar(grammar))
         self.token_buffer = None
 
     def restore_grammar(self):
         self.grammar.pop()
+        self.master.pop()
         self.token_buffer = None
 
     def match(self):
         if self.current_char >= self.input_length:
             self.token_buffer = ('EOF', '')
             return
-        for token_type, token_regex in self.grammar[-1]:
-            match = token_regex.match(self.input, self.current_char)
+        master = self.master[-1]
+        if master is not None:
+            regex, types = master
+            match        = regex.match(self.input, self.current_char)
             if match is not None:
-                self.token_buffer = (token_type, match.group(0))
-                #print "Match:", self.token_buffer
+                self.token_buffer = (types[match.lastindex], match.group(0))
                 return
+        else:
+            for token_type, token_regex in self.grammar[-1]:
+                match = token_regex.match(self.input, self.current_char)
+                if match is not None:
+                    self.token_buffer = (token_type, match.group(0))
+                    #print "Match:", self.token_buffer
+                    return
         end   = self.input.find('\n', self.current_char + 2)
         error = 'Invalid syntax: %s' % repr(self.input[self.current_char:end])
         self.syntax_error(error)
 
+    def _get_line_offsets(self):
+        # The offset of the first character of each line, built once
+        # per input.
+        if self.line_offsets is None:
+            offsets = [0]
+            offsets.extend(m.end() for m in re.finditer('\n', self.input))
+            self.line_offsets = offsets
+        return self.line_offsets
+
     def _get_line_number_from_char(self, char):
-        return self.input[:char].count('\n') + 1
+        return bisect_right(self._get_line_offsets(), char)
 
     def _get_current_line_number(self):
         return self._get_line_number_from_char(self.current_char)
 
     def _get_line(self, number):
-        return self.input.split('\n')[number - 1]
+        offsets = self._get_line_offsets()
+        start   = offsets[number - 1]
+        if number < len(offsets):
+            return self.input[start:offsets[number] - 1]
+        return self.input[start:]
 
     def get_current_line(self):
         line = self._get_current_line_number()
@@ -72,12 +152,9 @@ class Lexer(object):
         return self._get_line(line)
 
     def _get_line_position_from_char(self, char):
-        line_start = char
-        while line_start != 0:
-            if self.input[line_start - 1] == '\n':
-                break
-            line_start -= 1
-        line_end = self.input.find('\n', char)
+        line       = self._get_line_number_from_char(char)
+        line_start = self._get_line_offsets()[line - 1]
+        line_end   = self.input.find('\n', char)
         return line_start, line_end
 
     def _error(self, exc_cls, error, sender = None):
@@ -175,6 +252,8 @@ class Lexer(object):
         self.last_char    = 0
         self.token_buffer = None
         self.grammar      = []
+        self.master       = []
+        self.line_offsets = None
         compiled          = self.parser_cls(self, *self.parser_cls_args)
         if self.debug > 3:
             compiled.dump()
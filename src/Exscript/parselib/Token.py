@@ -75,9 +75,22 @@ class Token(object):
         self.start    = lexer.current_char
         self.end      = lexer.current_char + 1
 
-    def value(self, context):
-        for child in self.get_children():
-            child.value(context)
+    def compile(self):
+        """
+        Returns a function that evaluates the token, such that the tree
+        is not walked at runtime. The function receives the dict that
+        holds the variables of the running program, so that variables
+        are looked up without walking the scopes. By default, the
+        children are evaluated in order.
+
+        @rtype:  callable
+        @return: A function that takes the variables as its only argument.
+        """
+        children = [child.compile() for child in self.get_children()]
+        def value(variables):
+            for child in children:
+                child(variables)
+        return value
 
     def mark_start(self):
         self.start = self.lexer.current_char
@@ -68,6 +68,7 @@ class Dummy(Protocol):
     def _say(self, string):
         self._receive_cb(string)
         self.buffer.append(string)
+        self._stream_response(self.buffer)
 
     def cancel_expect(self):
         self.cancel = True
@@ -22,6 +22,7 @@ import socket
 import signal
 import errno
 import os
+import time
 from functools import partial
 from Exscript.util.impl import Context, _Context
 from Exscript.util.buffer import MonitoredBuffer
@@ -209,7 +210,9 @@ class Protocol(object):
                  logfile            = None,
                  termtype           = 'dumb',
                  verify_fingerprint = True,
-                 account_factory    = None):
+                 account_factory    = None,
+                 stats              = None,
+                 span               = None):
         """
         Constructor.
         The following events are provided:
@@ -232,6 +235,12 @@ class Protocol(object):
             e.g. 'vt100'.
         @keyword verify_fingerprint: Whether to verify the host's fingerprint.
         @keyword account_factory: A function that produces a new L{Account}.
+        @keyword stats: An L{Exscript.util.stats.Stats} instance in which
+            the duration of connect(), login(), execute() and of matching
+            the response, as well as the number of received bytes are
+            recorded.
+        @keyword span: An L{Exscript.util.trace.Span}. If given, the same
+            operations are also recorded as child spans.
         """
         self.data_received_event   = Event()
         self.otp_requested_event   = Event()
@@ -256,8 +265,12 @@ class Protocol(object):
         self.timeout               = timeout
         self.logfile               = logfile
         self.response              = None
+        self.response_handler      = None
+        self.streamed_error        = None
         self.buffer                = MonitoredBuffer()
         self.account_factory       = account_factory
+        self.stats                 = stats
+        self.span                  = span
         if stdout is None:
             self.stdout = open(os.devnull, 'w')
         else:
@@ -300,6 +313,9 @@ class Protocol(object):
         self._dbg(1, msg)
 
     def _receive_cb(self, data, remove_cr = True):
+        if self.stats is not None:
+            self.stats.increment('bytes_received', len(data))
+
         # Clean the data up.
         if remove_cr:
             text = data.replace('\r', '')
@@ -333,6 +349,18 @@ class Protocol(object):
         """
         return False
 
+    def _record_time(self, phase, start, command = None):
+        end = time.time()
+        if self.stats is not None:
+            self.stats.record(phase, end - start)
+            if command is not None:
+                self.stats.record_command(command, end - start)
+        if self.span is not None:
+            span = self.span.create_child(phase, start)
+            if command is not None:
+                span.set_attribute('command', command)
+            span.finish(end)
+
     def _dbg(self, level, msg):
         if self.debug < level:
             return
@@ -552,7 +580,11 @@ class Protocol(object):
         """
         if hostname is not None:
             self.host = hostname
-        return self._connect_hook(self.host, port)
+        start = time.time()
+        try:
+            return self._connect_hook(self.host, port)
+        finally:
+            self._record_time('connect', start)
 
     def _get_account(self, account):
         if isinstance(account, Context) or isinstance(account, _Context):
@@ -588,13 +620,17 @@ class Protocol(object):
         @type  flush: bool
         @param flush: Whether to flush the last prompt from the buffer.
         """
-        with self._get_account(account) as account:
-            if app_account is None:
-                app_account = account
-            self.authenticate(account, flush = False)
-            if self.get_driver().supports_auto_authorize():
-                self.expect_prompt()
-            self.auto_app_authorize(app_account, flush = flush)
+        start = time.time()
+        try:
+            with self._get_account(account) as account:
+                if app_account is None:
+                    app_account = account
+                self.authenticate(account, flush = False)
+                if self.get_driver().supports_auto_authorize():
+                    self.expect_prompt()
+                self.auto_app_authorize(app_account, flush = flush)
+        finally:
+            self._record_time('login', start)
 
     def authenticate(self, account = None, app_account = None, flush = True):
         """
@@ -884,8 +920,12 @@ class Protocol(object):
         @return: The index of the prompt regular expression that matched,
           and the match object.
         """
-        self.send(command + '\r')
-        return self.expect_prompt()
+        start = time.time()
+        try:
+            self.send(command + '\r')
+            return self.expect_prompt()
+        finally:
+            self._record_time('execute', start, command)
 
     def _domatch(self, prompt, flush):
         """
@@ -897,8 +937,11 @@ class Protocol(object):
         re_list  = to_regexs(prompt)
         patterns = [p.pattern for p in re_list]
         self._dbg(2, 'waiting for: ' + repr(patterns))
-        result = self._domatch(re_list, False)
-        return result
+        start = time.time()
+        try:
+            return self._domatch(re_list, False)
+        finally:
+            self._record_time('match', start)
 
     def waitfor(self, prompt):
         """
@@ -941,8 +984,11 @@ class Protocol(object):
             return result
 
     def _expect(self, prompt):
-        result = self._domatch(to_regexs(prompt), True)
-        return result
+        start = time.time()
+        try:
+            return self._domatch(to_regexs(prompt), True)
+        finally:
+            self._record_time('match', start)
 
     def expect(self, prompt):
         """
@@ -985,19 +1031,161 @@ class Protocol(object):
           and the match object.
         """
         result = self.expect(self.get_prompt())
+        self._check_response()
+        return result
 
+    def _has_error(self, response):
         # We skip the first line because it contains the echo of the command
         # sent.
-        self._dbg(5, "Checking %s for errors" % repr(self.response))
-        for line in self.response.split('\n')[1:]:
+        for line in response.split('\n')[1:]:
             for prompt in self.get_error_prompt():
                 if not prompt.search(line):
                     continue
                 args = repr(prompt.pattern), repr(line)
                 self._dbg(5, "error prompt (%s) matches %s" % args)
-                raise InvalidCommandException('Device said:\n' + self.response)
+                return True
+        return False
 
-        return result
+    def _check_response(self):
+        # Errors in the data that was passed to the response handler are
+        # raised only once the prompt was received.
+        if self.streamed_error is not None:
+            response, self.streamed_error = self.streamed_error, None
+            raise InvalidCommandException('Device said:\n' + response)
+        self._dbg(5, "Checking %s for errors" % repr(self.response))
+        if self._has_error(self.response):
+            raise InvalidCommandException('Device said:\n' + self.response)
+
+    def _find_echo(self, data, command, start):
+        # Returns the match of the prompt that precedes the echo of the
+        # given command in the given data, or None if the echo was not
+        # (yet) received. Occurrences of the command that do not directly
+        # follow a prompt are part of a response.
+        pos = data.find(command, start + 1)
+        while pos != -1:
+            for prompt in self.get_prompt():
+                match = prompt.search(data, start, pos)
+                if match is not None and match.end() == pos:
+                    return match
+            pos = data.find(command, pos + 1)
+        return None
+
+    def execute_pipelined(self, commands, window = 10):
+        """
+        Like execute(), but executes all of the given commands, sending up
+        to the given number of commands at once before waiting for their
+        prompts. On links with a high latency, this takes roughly one round
+        trip per window instead of one per command.
+
+        The prompts in the received data are correlated back to each
+        command using the echo of the following command, so the device
+        must echo the commands. Each response is checked for errors like
+        in expect_prompt(). Note that if a command fails, the commands
+        that follow it in the same window were already sent.
+
+        The response of the last command is stored in the response
+        attribute (self.response).
+
+        @type  commands: list[string]
+        @param commands: The commands that are sent to the remote host.
+        @type  window: int
+        @param window: The maximum number of commands sent at once.
+        @rtype:  list[string]
+        @return: The response of each command.
+        """
+        responses = []
+        for offset in range(0, len(commands), window):
+            pending = commands[offset:offset + window]
+            start   = time.time()
+            for command in pending:
+                self.send(command + '\r')
+
+            while pending:
+                index, match = self.expect(self.get_prompt())
+                prompt       = match.group(0)
+                data         = self.response
+
+                # Protocol adapters differ in how much of the prompt they
+                # include in the response.
+                included = len(prompt)
+                while included and not data.endswith(prompt[:included]):
+                    included -= 1
+                data += prompt[included:]
+
+                # The data may contain the responses of several commands.
+                # Each of them ends with the prompt that precedes the echo
+                # of the next command, except for the last one, which ends
+                # with the prompt that was just matched.
+                ends = []
+                while len(pending) > len(ends) + 1:
+                    begin   = ends and ends[-1][1] or 0
+                    command = pending[len(ends) + 1]
+                    found   = self._find_echo(data, command, begin)
+                    if found is None:
+                        break
+                    ends.append((found.start(), found.end()))
+                ends.append((len(data) - len(prompt), len(data)))
+
+                begin = 0
+                for prompt_start, prompt_end in ends:
+                    self.response = data[begin:prompt_start + included]
+                    command = pending.pop(0)
+                    self._record_time('execute', start, command)
+                    self._check_response()
+                    responses.append(self.response)
+                    begin = prompt_end
+        return responses
+
+    def set_response_handler(self, handler = None):
+        """
+        Passes the response of the remote host to the given function
+        while it is received, instead of collecting it until the prompt
+        arrives. Whenever complete lines were received, they are removed
+        from the buffer and passed to the handler, such that the memory
+        that is used does not grow with the size of the response.
+        The last line before a prompt is kept in the buffer, so the
+        response attribute (self.response) only contains the data that
+        was not passed to the handler. Joining all data that was passed
+        to the handler and the response gives the complete response.
+        Error prompts are also detected in the data that was passed to
+        the handler.
+
+        The handler is meant for use with execute(); since the data is
+        removed from the buffer, it does not work with waitfor() or
+        execute_pipelined().
+        Pass None to disable the handler again.
+
+        @type  handler: callable|None
+        @param handler: Receives each part of the response as a string.
+        """
+        self.response_handler = handler
+        self.streamed_error   = None
+
+    def _stream_response(self, buffer):
+        # Passes the complete lines at the head of the given buffer to the
+        # response handler, and removes them from the buffer. The line
+        # break before the last line remains in the buffer, as does the
+        # line break before a prompt, so that prompts are still found.
+        # Returns the number of bytes that were removed.
+        if self.response_handler is None:
+            return 0
+        data  = str(buffer)
+        limit = len(data)
+        for prompt in self.get_prompt():
+            match = prompt.search(data)
+            if match is not None:
+                limit = min(limit, match.start())
+        end = data.rfind('\n', 0, limit)
+        if end > 0 and data[end - 1] == '\r':
+            end -= 1
+        if end <= 0:
+            return 0
+
+        response = buffer.pop(end)
+        if self.streamed_error is None and self._has_error(response):
+            self.streamed_error = response
+        self.response_handler(response)
+        return end
 
     def add_monitor(self, pattern, callback, limit = 80):
         """
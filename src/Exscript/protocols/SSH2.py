@@ -308,6 +308,7 @@ class SSH2(Protocol):
             return False
         self._receive_cb(data)
         self.buffer.append(data)
+        self._stream_response(self.buffer)
         return True
 
     def _domatch(self, prompt, flush):
@@ -16,6 +16,7 @@
 The Telnet protocol.
 """
 from Exscript.util.tty            import get_terminal_size
+from Exscript.util.buffer         import MonitoredBuffer
 from Exscript.protocols           import telnetlib
 from Exscript.protocols.Protocol  import Protocol
 from Exscript.protocols.Exception import ProtocolException, \
@@ -30,12 +31,20 @@ class Telnet(Protocol):
 
     def __init__(self, **kwargs):
         Protocol.__init__(self, **kwargs)
-        self.tn = None
+        self.tn    = None
+        self.queue = None
 
     def _telnetlib_received(self, data):
         self._receive_cb(data)
         self.buffer.append(data)
 
+        # Prompts are matched against the queue of telnetlib, so the data
+        # that was passed to the response handler is removed from there,
+        # and from our own buffer.
+        removed = self._stream_response(self.queue)
+        if removed:
+            self.buffer.pop(removed)
+
     def _connect_hook(self, hostname, port):
         assert self.tn is None
         rows, cols = get_terminal_size()
@@ -49,6 +58,7 @@ class Telnet(Protocol):
             self.tn.set_debuglevel(1)
         if self.tn is None:
             return False
+        self.queue = MonitoredBuffer(self.tn.cookedq)
         return True
 
     def send(self, data):
@@ -111,5 +121,6 @@ class Telnet(Protocol):
             except Exception:
                 pass
         self.tn.close()
-        self.tn = None
+        self.tn    = None
+        self.queue = None
         self.buffer.clear()
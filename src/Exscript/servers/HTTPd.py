@@ -15,11 +15,14 @@
 """
 A threaded HTTP server with support for HTTP/Digest authentication.
 """
+import os
 import sys
 import time
 import urllib
+from io import BytesIO
 from urlparse import urlparse
 from traceback import format_exc
+from threading import Lock
 from BaseHTTPServer import BaseHTTPRequestHandler
 from BaseHTTPServer import HTTPServer
 from SocketServer import ThreadingMixIn
@@ -77,20 +80,36 @@ def _parse_url(path):
 
     return path, args
 
-def _error_401(handler, msg):
+def _error_401(handler, msg, stale = False):
+    # Discard a small request body, so that the client may send the
+    # authenticated request over the same connection. Larger bodies
+    # are not read from unauthenticated clients; the connection is
+    # closed instead.
+    limit   = handler.server.max_discarded_body_size
+    discard = handler._read_body(limit)
+    body    = msg.encode('utf8')
+    realm   = handler.server.realm
+    nonce   = handler.server.get_nonce()
+    auth    = 'Digest realm="%s",qop="auth",algorithm="MD5",nonce="%s"'
+    if stale:
+        auth += ',stale=TRUE'
     handler.send_response(401)
-    realm = handler.server.realm
-    nonce = (u"%d:%s" % (time.time(), realm)).encode('utf8')
-    handler.send_header('WWW-Authenticate',
-                        'Digest realm="%s",'
-                        'qop="auth",'
-                        'algorithm="MD5",'
-                        'nonce="%s"' % (realm, nonce))
+    handler.send_header('WWW-Authenticate', auth % (realm, nonce))
+    handler.send_header('Content-Length', str(len(body)))
+    if discard is None:
+        handler.send_header('Connection', 'close')
     handler.end_headers()
-    handler.rfile.read()
-    handler.rfile.close()
-    handler.wfile.write(msg.encode('utf8'))
-    handler.wfile.close()
+    handler.wfile.write(body)
+
+def _error_413(handler):
+    # The rest of the body was not read, so the connection can not be
+    # used for another request.
+    body = 'Request body too large'.encode('utf8')
+    handler.send_response(413)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+    handler.wfile.write(body)
 
 def _require_authenticate(func):
     '''A decorator to add digest authorization checks to HTTP Request Handlers'''
@@ -120,6 +139,10 @@ def _require_authenticate(func):
             return _error_401(self, 'Incorrect realm')
         if 'qop' in cred and ('nc' not in cred or 'cnonce' not in cred):
             return _error_401(self, 'qop with missing nc or cnonce')
+        try:
+            count = int(cred.get('nc', '0'), 16)
+        except ValueError:
+            return _error_401(self, 'Invalid nonce count')
 
         # Check the username.
         username = cred['username']
@@ -146,6 +169,14 @@ def _require_authenticate(func):
         if expect != cred['response']:
             return _error_401(self, 'Invalid username or password')
 
+        # Clients may keep using a nonce until it expires, which
+        # saves them the round trip to fetch a new one. Nonces of a
+        # previous server instance are also reported as stale, because
+        # the credentials were correct. A request that reuses a nonce
+        # count is a replay, and is also rejected.
+        if not self.server.check_nonce(cred['nonce'], count):
+            return _error_401(self, 'Nonce expired', stale = True)
+
         # Success!
         self.authenticated = True
         return func(self)
@@ -169,7 +200,11 @@ class HTTPd(ThreadingMixIn, HTTPServer):
         print 'started httpserver...'
         server.serve_forever()
     """
-    daemon_threads = True
+    daemon_threads          = True
+    nonce_lifetime          = 3600
+    nonce_window            = 64 # Nonce counts that may arrive out of order.
+    max_body_size           = 64 * 1024 * 1024 # Larger requests get a 413.
+    max_discarded_body_size = 64 * 1024 # Read before a 401, if not larger.
 
     def __init__(self, addr, handler_cls, user_data = None):
         """
@@ -182,10 +217,14 @@ class HTTPd(ThreadingMixIn, HTTPServer):
         @type  user_data: object
         @param user_data: Optional data that, stored in self.user_data.
         """
-        self.debug     = False
-        self.realm     = default_realm
-        self.accounts  = {}
-        self.user_data = user_data
+        self.debug         = False
+        self.realm         = default_realm
+        self.accounts      = {}
+        self.user_data     = user_data
+        self.secret        = os.urandom(16)
+        self.nonces        = {} # map nonce to (highest count, seen counts)
+        self.nonce_lock    = Lock()
+        self.nonces_pruned = time.time()
         HTTPServer.__init__(self, addr, handler_cls)
 
     def add_account(self, username, password):
@@ -208,6 +247,74 @@ class HTTPd(ThreadingMixIn, HTTPServer):
         """
         return self.accounts.get(username)
 
+    def _sign_nonce(self, timestamp, salt):
+        return md5hex('%d:%s:%s:%s' % (timestamp,
+                                       salt,
+                                       self.realm,
+                                       self.secret))
+
+    def get_nonce(self):
+        """
+        Returns a new nonce for HTTP/Digest authentication. Nonces are
+        signed, so they can be verified without storing them until
+        they are used.
+
+        @rtype:  str
+        @return: The nonce.
+        """
+        timestamp = int(time.time())
+        salt      = os.urandom(8).encode('hex')
+        signature = self._sign_nonce(timestamp, salt)
+        return '%d:%s:%s' % (timestamp, salt, signature)
+
+    def _prune_nonces(self, now):
+        if now - self.nonces_pruned < 60:
+            return
+        self.nonces_pruned = now
+        for nonce in self.nonces.keys():
+            if now - int(nonce.split(':', 1)[0]) > self.nonce_lifetime:
+                del self.nonces[nonce]
+
+    def check_nonce(self, nonce, count = 0):
+        """
+        Returns True if the given nonce was issued by this server, has
+        not yet expired, and was not yet used with the given nonce
+        count. Clients that send no nonce count may use each nonce
+        only once.
+
+        @type  nonce: str
+        @param nonce: The nonce that was sent by the client.
+        @type  count: int
+        @param count: The nonce count that was sent by the client.
+        @rtype:  bool
+        @return: Whether the nonce is valid.
+        """
+        try:
+            timestamp, salt, signature = nonce.split(':', 2)
+            timestamp                  = int(timestamp)
+        except ValueError:
+            return False
+        if signature != self._sign_nonce(timestamp, salt):
+            return False
+        now = time.time()
+        if now - timestamp > self.nonce_lifetime:
+            return False
+
+        # Concurrent requests may arrive out of order, so any count
+        # within the window below the highest count is accepted once.
+        with self.nonce_lock:
+            self._prune_nonces(now)
+            highest, seen = self.nonces.get(nonce, (0, set()))
+            if count in seen or count <= highest - self.nonce_window:
+                return False
+            seen.add(count)
+            if count > highest:
+                highest = count
+                seen    = set(c for c in seen
+                              if c > highest - self.nonce_window)
+            self.nonces[nonce] = highest, seen
+        return True
+
     def _dbg(self, msg):
         if self.debug:
             print(msg)
@@ -215,8 +322,12 @@ class HTTPd(ThreadingMixIn, HTTPServer):
 class RequestHandler(BaseHTTPRequestHandler):
     """
     A drop-in replacement for Python's BaseHTTPRequestHandler that
-    handles HTTP/Digest.
+    handles HTTP/Digest and HTTP/1.1 persistent connections. Responses
+    are buffered, so that the Content-Length header can be added
+    automatically.
     """
+    protocol_version = 'HTTP/1.1'
+    timeout          = 60 # Close idle connections after this many seconds.
 
     def _do_POSTGET(self, handler):
         """handle an HTTP request"""
@@ -225,12 +336,11 @@ class RequestHandler(BaseHTTPRequestHandler):
 
         self.path, self.args = _parse_url(self.path)
 
-        # Extract POST data, if any. Clumsy syntax due to Python 2 and
-        # 2to3's lack of a byte literal.
-        self.data = u"".encode()
-        length = self.headers.get('Content-Length')
-        if length and length.isdigit():
-            self.data = self.rfile.read(int(length))
+        # Extract POST data, if any.
+        self.data = self._read_body()
+        if self.data is None:
+            self.authenticated = False
+            return _error_413(self)
 
         # POST data gets automatically decoded into Unicode. The bytestring
         # will still be available in the bdata attribute.
@@ -241,12 +351,80 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.data = None
 
         # Run the handler.
+        wfile            = self.wfile
+        self.wfile       = BytesIO()
+        self.length_sent = False
         try:
             handler()
         except:
+            self.wfile       = BytesIO()
+            self.length_sent = False
             self.send_response(500)
             self.end_headers()
             self.wfile.write(format_exc().encode('utf8'))
+        finally:
+            response   = self.wfile.getvalue()
+            self.wfile = wfile
+
+            # The next request on a persistent connection must be
+            # authenticated again.
+            self.authenticated = False
+        self._send_buffered(response)
+
+    def _send_buffered(self, response):
+        head, sep, body = response.partition(u'\r\n\r\n'.encode())
+        if not sep:
+            # The handler did not finish the headers, so the end of the
+            # response can only be signalled by closing the connection.
+            self.close_connection = 1
+        elif not self.length_sent:
+            length   = u'\r\nContent-Length: %d' % len(body)
+            response = head + length.encode() + sep + body
+        self.wfile.write(response)
+
+    def _read_body(self, limit = None):
+        """
+        Reads the request body. Returns None if the body is larger than
+        the given number of bytes, which defaults to the max_body_size
+        of the server. In that case, the body is not read completely.
+        """
+        # Clumsy syntax due to Python 2 and 2to3's lack of a byte literal.
+        if limit is None:
+            limit = self.server.max_body_size
+        length   = self.headers.get('Content-Length')
+        encoding = self.headers.get('Transfer-Encoding', '')
+        if encoding.lower() == 'chunked':
+            return self._read_chunked(limit)
+        elif length and length.isdigit():
+            if int(length) > limit:
+                return None
+            return self.rfile.read(int(length))
+        return u"".encode()
+
+    def _read_chunked(self, limit):
+        """
+        Reads a request body that was sent using chunked transfer
+        encoding, so clients can upload data of unknown size.
+        Returns None as soon as the body exceeds the given number
+        of bytes.
+        """
+        chunks = []
+        total  = 0
+        while True:
+            line = self.rfile.readline()
+            size = int(line.split(';', 1)[0].strip() or '0', 16)
+            if size == 0:
+                break
+            total += size
+            if total > limit:
+                return None
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline() # CRLF after each chunk
+
+        # Skip the trailer, if any.
+        while self.rfile.readline() not in _HEADER_NEWLINES:
+            pass
+        return u"".encode().join(chunks)
 
     @_require_authenticate
     def do_POST(self):
@@ -280,12 +458,13 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write('not found'.encode('utf8'))
 
-    def send_response(self, code):
+    def send_header(self, keyword, value):
         """
-        See Python's BaseHTTPRequestHandler.send_response().
+        See Python's BaseHTTPRequestHandler.send_header().
         """
-        BaseHTTPRequestHandler.send_response(self, code)
-        self.send_header("Connection", "close")
+        if keyword.lower() == 'content-length':
+            self.length_sent = True
+        BaseHTTPRequestHandler.send_header(self, keyword, value)
 
 if __name__ == '__main__':
     try:
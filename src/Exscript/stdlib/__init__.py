@@ -18,6 +18,7 @@ from Exscript.stdlib import file
 from Exscript.stdlib import ipv4
 from Exscript.stdlib import list
 from Exscript.stdlib import string
+from Exscript.stdlib import table
 from Exscript.stdlib import mysys
 
 functions = {
@@ -57,6 +58,9 @@ functions = {
     'list.unique':               list.unique,
     'string.replace':            string.replace,
     'string.tolower':            string.tolower,
+    'table.column':              table.column,
+    'table.fixed':               table.fixed,
+    'table.fsm':                 table.fsm,
     'sys.exec':                  mysys.execute,
     'sys.message':               mysys.message,
     'sys.wait':                  mysys.wait,
@@ -0,0 +1,104 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+from Exscript.util.table  import get_parser, ColumnParser, \
+                                 FixedWidthParser, StateMachine
+from Exscript.stdlib.util import secure_function
+
+def _get_column(parser, source, name):
+    try:
+        return parser.parse(source)[name]
+    except KeyError:
+        raise ValueError('no such column: %s' % repr(name))
+
+@secure_function
+def column(scope, source, header, name):
+    """
+    Returns the values of the column with the given title, from the table
+    in the given source. The columns are aligned with a header line that
+    contains the given titles; see L{Exscript.util.table.ColumnParser}.
+    Example::
+
+        {connection.execute("show ip interface brief")}
+        {header = "Interface IP-Address OK? Method Status Protocol"}
+        {interfaces = table.column(__response__, header, "Interface")}
+        {status = table.column(__response__, header, "Status")}
+
+    The table is parsed only once, no matter how many of its columns are
+    retrieved.
+
+    @type  source: string
+    @param source: A list of lines, e.g. the response of a command.
+    @type  header: string
+    @param header: The column titles, separated by whitespace.
+    @type  name: string
+    @param name: The title of the column.
+    @rtype:  string
+    @return: The list of values in the column.
+    """
+    parser = get_parser(ColumnParser, ' '.join(header))
+    return _get_column(parser, source, name[0])
+
+@secure_function
+def fixed(scope, source, widths, index):
+    """
+    Returns the values of the column with the given index, from a table
+    whose columns have a fixed width; see
+    L{Exscript.util.table.FixedWidthParser}. Example::
+
+        {vlans = table.fixed(__response__, "5 33 10 *", 0)}
+
+    @type  source: string
+    @param source: A list of lines, e.g. the response of a command.
+    @type  widths: string
+    @param widths: The widths of the columns, separated by whitespace.
+    @type  index: string
+    @param index: The number of the column, starting with 0.
+    @rtype:  string
+    @return: The list of values in the column.
+    """
+    try:
+        index = int(index[0])
+    except IndexError:
+        raise ValueError('index variable is required')
+    except ValueError:
+        raise ValueError('index is not an integer')
+    parser = get_parser(FixedWidthParser, ' '.join(widths))
+    return _get_column(parser, source, index)
+
+@secure_function
+def fsm(scope, source, definition, name):
+    """
+    Parses the given source using a state machine in the style of
+    TextFSM, and returns the values that were recorded for the value with
+    the given name; see L{Exscript.util.table.StateMachine}. The
+    definition may be given as a string, or as a list of lines, such as
+    the content of a file::
+
+        {definition = file.read("show_interfaces.textfsm")}
+        {interfaces = table.fsm(__response__, definition, "Interface")}
+        {mtu = table.fsm(__response__, definition, "Mtu")}
+
+    @type  source: string
+    @param source: A list of lines, e.g. the response of a command.
+    @type  definition: string
+    @param definition: The definition of the state machine.
+    @type  name: string
+    @param name: The name of a value.
+    @rtype:  string
+    @return: The list of recorded values.
+    """
+    definition = '\n'.join(line.rstrip('\r\n') for line in definition)
+    parser     = get_parser(StateMachine, definition)
+    return _get_column(parser, source, name[0])
@@ -134,6 +134,32 @@ def get_hosts_from_csv(filename,
     @rtype:  list[Host]
     @return: The newly created host instances.
     """
+    return list(iter_hosts_from_csv(filename,
+                                    default_protocol,
+                                    default_domain,
+                                    encoding))
+
+def iter_hosts_from_csv(filename,
+                        default_protocol = 'telnet',
+                        default_domain   = '',
+                        encoding         = 'utf-8'):
+    """
+    Like get_hosts_from_csv(), but returns an iterator that reads the file
+    while the hosts are consumed, so that the file does not need to be
+    loaded into memory at once. Each host is returned as soon as all of
+    its lines are read.
+
+    @type  filename: string
+    @param filename: A full filename.
+    @type  default_protocol: str
+    @param default_protocol: Passed to the Host constructor.
+    @type  default_domain: str
+    @param default_domain: Appended to each hostname that has no domain.
+    @type  encoding: str
+    @param encoding: The encoding of the file.
+    @rtype:  iterator[Host]
+    @return: The newly created host instances.
+    """
     # Open the file.
     if not os.path.exists(filename):
         raise IOError('No such file: %s' % filename)
@@ -152,11 +178,11 @@ def get_hosts_from_csv(filename,
         varnames = [str(v) for v in header.split('\t')]
         varnames.pop(0)
 
-        # Walk through all lines and create a map that maps hostname to
-        # definitions.
+        # Walk through all lines. Consecutive lines with the same
+        # hostname define the variables of the same host.
         last_uri = ''
         line_re  = re.compile(r'[\r\n]*$')
-        hosts    = []
+        host     = None
         for line in file_handle:
             if line.strip() == '':
                 continue
@@ -165,12 +191,12 @@ def get_hosts_from_csv(filename,
             values = line.split('\t')
             uri    = values.pop(0).strip()
 
-            # Add the hostname to our list.
+            # Start a new host.
             if uri != last_uri:
-                #print "Reading hostname", hostname_url, "from csv."
+                if host is not None:
+                    yield host
                 host     = to_host(uri, default_protocol, default_domain)
                 last_uri = uri
-                hosts.append(host)
 
             # Define variables according to the definition.
             for i, varname in enumerate(varnames):
@@ -183,4 +209,5 @@ def get_hosts_from_csv(filename,
                 else:
                     host.append(varname, value)
 
-    return hosts
+        if host is not None:
+            yield host
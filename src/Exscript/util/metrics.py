@@ -0,0 +1,220 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Exporting live metrics of running queues in the Prometheus text format.
+"""
+import threading
+from Exscript.servers.HTTPd import HTTPd, RequestHandler
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+quantiles    = 0.5, 0.9, 0.99
+
+def _escape(value):
+    value = str(value).replace('\\', '\\\\')
+    return value.replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    labels = ['%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items())]
+    return '{' + ','.join(labels) + '}'
+
+def _to_queue_dict(queues):
+    if isinstance(queues, dict):
+        return queues
+    return {'default': queues}
+
+def collect(queues):
+    """
+    Returns a list of metrics describing the current state of the given
+    queues. Each metric is a tuple (name, type, help, samples), where
+    samples is a list of (suffix, labels, value) tuples.
+    Note that timings, byte counts and session counts are only updated
+    when a job completes.
+
+    @type  queues: Queue|dict(str, Queue)
+    @param queues: A queue, or a dictionary mapping names to queues.
+    @rtype:  list[(str, str, str, list)]
+    @return: The metrics.
+    """
+    metrics = [
+        ('exscript_queue_jobs_total', 'counter',
+         'Number of jobs that were enqueued.'),
+        ('exscript_queue_jobs_completed_total', 'counter',
+         'Number of jobs that were completed, successfully or not.'),
+        ('exscript_queue_jobs_failed_total', 'counter',
+         'Number of jobs that finally failed.'),
+        ('exscript_queue_job_errors_total', 'counter',
+         'Number of failed attempts, including retried ones.'),
+        ('exscript_queue_depth', 'gauge',
+         'Number of jobs that are waiting to be started.'),
+        ('exscript_queue_jobs_in_flight', 'gauge',
+         'Number of jobs that are currently running.'),
+        ('exscript_queue_jobs_per_second', 'gauge',
+         'Jobs completed per second, averaged over the last minute.'),
+        ('exscript_queue_account_waits_total', 'counter',
+         'Number of times an account was acquired from the account pool.'),
+        ('exscript_queue_account_wait_seconds_total', 'counter',
+         'Time spent waiting for an account to become available.'),
+        ('exscript_queue_bytes_received_total', 'counter',
+         'Number of bytes received from remote hosts.'),
+        ('exscript_queue_sessions_total', 'counter',
+         'Number of sessions, by protocol driver.'),
+        ('exscript_queue_duration_seconds', 'summary',
+         'Duration of connect, login, execute and complete jobs.'),
+    ]
+    samples = dict((name, []) for name, type, help in metrics)
+
+    for queue_name, queue in sorted(_to_queue_dict(queues).items()):
+        labels   = {'queue': queue_name}
+        stats    = queue.stats
+        running  = len(queue.workqueue.get_running_jobs())
+        waiting  = max(0, queue.workqueue.get_length() - running)
+        waits    = stats.get_histogram('account_wait')
+        sessions = stats.get_counters('sessions')
+
+        def add(name, value, suffix = '', **kwargs):
+            thelabels = labels.copy()
+            thelabels.update(kwargs)
+            samples[name].append((suffix, thelabels, value))
+
+        n_waits      = waits and waits.get_count() or 0
+        wait_seconds = waits and waits.get_total() or 0.0
+        received     = stats.get_counter('bytes_received')
+        add('exscript_queue_jobs_total',                 queue.total)
+        add('exscript_queue_jobs_completed_total',       queue.completed)
+        add('exscript_queue_jobs_failed_total',          queue.failed)
+        add('exscript_queue_job_errors_total',           queue.errors)
+        add('exscript_queue_depth',                      waiting)
+        add('exscript_queue_jobs_in_flight',             running)
+        add('exscript_queue_jobs_per_second',            stats.get_rate(60))
+        add('exscript_queue_account_waits_total',        n_waits)
+        add('exscript_queue_account_wait_seconds_total', wait_seconds)
+        add('exscript_queue_bytes_received_total',       received)
+        for driver, count in sorted(sessions.items()):
+            add('exscript_queue_sessions_total', count, driver = driver)
+        for phase in stats.get_phases():
+            if phase == 'account_wait':
+                continue
+            histogram = stats.get_histogram(phase)
+            for quantile in quantiles:
+                value = histogram.get_percentile(quantile * 100)
+                add('exscript_queue_duration_seconds',
+                    value,
+                    phase    = phase,
+                    quantile = quantile)
+            add('exscript_queue_duration_seconds',
+                histogram.get_total(),
+                '_sum',
+                phase = phase)
+            add('exscript_queue_duration_seconds',
+                histogram.get_count(),
+                '_count',
+                phase = phase)
+
+    return [(name, type, help, samples[name])
+            for name, type, help in metrics
+            if samples[name]]
+
+def format(queues):
+    """
+    Returns the current metrics of the given queues in the Prometheus
+    text exposition format.
+
+    @type  queues: Queue|dict(str, Queue)
+    @param queues: A queue, or a dictionary mapping names to queues.
+    @rtype:  str
+    @return: The formatted metrics.
+    """
+    output = []
+    for name, type, help, samples in collect(queues):
+        output.append('# HELP %s %s' % (name, help))
+        output.append('# TYPE %s %s' % (name, type))
+        for suffix, labels, value in samples:
+            output.append('%s%s%s %s' % (name,
+                                         suffix,
+                                         _format_labels(labels),
+                                         repr(value)))
+    return '\n'.join(output) + '\n'
+
+class MetricsHandler(RequestHandler):
+    """
+    Serves the metrics of the queues that are passed to L{MetricsServer}
+    under the /metrics path. If no accounts were added to the server,
+    authentication is not required.
+    """
+
+    def do_GET(self):
+        if self.server.accounts:
+            return RequestHandler.do_GET(self)
+        self._do_POSTGET(self.handle_GET)
+
+    def handle_GET(self):
+        if self.path != '/metrics':
+            return RequestHandler.handle_GET(self)
+        response = format(self.server.user_data)
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(HTTPd):
+    """
+    An HTTP server that exports the metrics of one or more queues for
+    scraping by Prometheus. Usage::
+
+        from Exscript import Queue
+        from Exscript.util.metrics import MetricsServer
+
+        queue  = Queue(max_threads = 10)
+        server = MetricsServer(('', 9100), queue)
+        server.start()
+        queue.run(hosts, do_something)
+        queue.shutdown()
+        server.stop()
+    """
+
+    def __init__(self, addr, queues):
+        """
+        Constructor.
+
+        @type  addr: (str, int)
+        @param addr: The address and port number on which to bind.
+        @type  queues: Queue|dict(str, Queue)
+        @param queues: A queue, or a dictionary mapping names to queues.
+        """
+        HTTPd.__init__(self, addr, MetricsHandler, queues)
+        self.thread = None
+
+    def start(self):
+        """
+        Starts serving requests in a background thread.
+        """
+        self.thread        = threading.Thread(target = self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the server and closes the socket.
+        """
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
@@ -0,0 +1,101 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Aggregating cProfile results of jobs that ran in threads or processes.
+"""
+import marshal
+import pstats
+from Exscript.util.impl import synchronized
+
+class _Snapshot(object):
+    # Implements the interface that pstats.Stats() expects of a profiler.
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class Profile(object):
+    """
+    Collects the raw statistics of any number of cProfile runs and
+    merges them into one profile. The result can be written to a file
+    that is compatible with pstats, and hence with the usual viewers
+    and flamegraph converters (snakeviz, gprof2dot, flameprof, ...).
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.count = 0
+
+    @synchronized
+    def add(self, stats):
+        """
+        Adds the statistics of one profiler run. The argument is the
+        stats attribute of a cProfile.Profile after calling its
+        create_stats() method.
+
+        @type  stats: dict
+        @param stats: The raw statistics.
+        """
+        for func, stat in stats.iteritems():
+            old = self.stats.get(func)
+            if old is None:
+                self.stats[func] = stat
+            else:
+                self.stats[func] = pstats.add_func_stats(old, stat)
+        self.count += 1
+
+    @synchronized
+    def clear(self):
+        """
+        Removes all statistics. The object is cleared in place, so that
+        whoever holds a reference to it keeps adding to the same object.
+        """
+        self.stats.clear()
+        self.count = 0
+
+    def get_count(self):
+        """
+        Returns the number of profiler runs that were added.
+
+        @rtype:  int
+        @return: The number of runs.
+        """
+        return self.count
+
+    @synchronized
+    def get_stats(self):
+        """
+        Returns the merged profile as a pstats.Stats object, or None if
+        nothing was recorded.
+
+        @rtype:  pstats.Stats|None
+        @return: The profile.
+        """
+        if not self.stats:
+            return None
+        return pstats.Stats(_Snapshot(self.stats.copy()))
+
+    @synchronized
+    def dump(self, filename):
+        """
+        Writes the merged profile to the given file, in the format that
+        is read by pstats.Stats(filename).
+
+        @type  filename: str
+        @param filename: The name of the output file.
+        """
+        with open(filename, 'wb') as fp:
+            marshal.dump(self.stats, fp)
@@ -15,6 +15,7 @@
 """
 Formatting logs into human readable reports.
 """
+import time
 
 def _underline(text, line = '-'):
     return [text, line * len(text)]
@@ -99,3 +100,111 @@ def format(logger,
         output.append('')
 
     return '\n'.join(output).strip()
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return '%.3f' % seconds
+
+def _format_table(header, rows):
+    widths = [len(h) for h in header]
+    for row in rows:
+        widths = [max(w, len(c)) for w, c in zip(widths, row)]
+    lines = []
+    for row in [header] + rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [c.rjust(w) for c, w in zip(row[1:], widths[1:])]
+        lines.append('  '.join(cells).rstrip())
+    return lines
+
+def latency(stats, percentiles = (50, 90, 99)):
+    """
+    Creates a table containing the latency of every phase (connect, login,
+    execute, job, ...) that was recorded in the given statistics, in
+    seconds.
+
+    @type  stats: L{Exscript.util.stats.Stats}
+    @param stats: The statistics, e.g. Queue.stats.
+    @type  percentiles: list[int]
+    @param percentiles: The percentiles that are included in the table.
+    @rtype:  string
+    @return: The formatted table.
+    """
+    header = ['Phase', 'Count', 'Min']
+    header += ['p%d' % p for p in percentiles]
+    header += ['Max']
+    rows = []
+    for phase in stats.get_phases():
+        histogram = stats.get_histogram(phase)
+        row       = [phase,
+                     str(histogram.get_count()),
+                     _format_seconds(histogram.get_min())]
+        for percentile in percentiles:
+            row.append(_format_seconds(histogram.get_percentile(percentile)))
+        row.append(_format_seconds(histogram.get_max()))
+        rows.append(row)
+    output = _underline('Latency (seconds):')
+    output += _format_table(header, rows)
+    return '\n'.join(output)
+
+def slowest_hosts(stats, n = 10):
+    """
+    Creates a list of the n hosts on which the most time was spent.
+
+    @type  stats: L{Exscript.util.stats.Stats}
+    @param stats: The statistics, e.g. Queue.stats.
+    @type  n: int
+    @param n: The maximum number of hosts.
+    @rtype:  string
+    @return: The formatted list.
+    """
+    rows = [[host, _format_seconds(seconds)]
+            for host, seconds in stats.get_slowest_hosts(n)]
+    output = _underline('Slowest hosts:')
+    output += _format_table(['Host', 'Seconds'], rows)
+    return '\n'.join(output)
+
+def slowest_commands(stats, n = 10, percentile = 95):
+    """
+    Creates a list of the n commands that had the highest latency at
+    the given percentile. Commands that only differ in whitespace or
+    numbers are grouped together.
+
+    @type  stats: L{Exscript.util.stats.Stats}
+    @param stats: The statistics, e.g. Queue.stats.
+    @type  n: int
+    @param n: The maximum number of commands.
+    @type  percentile: int
+    @param percentile: The percentile by which commands are ranked.
+    @rtype:  string
+    @return: The formatted list.
+    """
+    rows = []
+    for command, histogram in stats.get_slowest_commands(n, percentile):
+        rows.append([command,
+                     str(histogram.get_count()),
+                     _format_seconds(histogram.get_percentile(percentile))])
+    header = ['Command', 'Count', 'p%d' % percentile]
+    output = _underline('Slowest commands:')
+    output += _format_table(header, rows)
+    return '\n'.join(output)
+
+def throughput(stats, interval = 60):
+    """
+    Creates a list showing the number of jobs that were completed in
+    each time interval.
+
+    @type  stats: L{Exscript.util.stats.Stats}
+    @param stats: The statistics, e.g. Queue.stats.
+    @type  interval: int
+    @param interval: The length of each interval in seconds.
+    @rtype:  string
+    @return: The formatted list.
+    """
+    rows = []
+    for timestamp, count in stats.get_throughput(interval):
+        thetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+        rows.append([thetime, str(count)])
+    output = _underline('Throughput (jobs per %d seconds):' % interval)
+    output += _format_table(['Time', 'Jobs'], rows)
+    return '\n'.join(output)
@@ -0,0 +1,91 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Read-only data that is shared between processes.
+"""
+import mmap
+import tempfile
+import cPickle
+from collections import Mapping
+
+class SharedData(Mapping):
+    """
+    A read-only mapping whose values are kept outside of the Python heap,
+    in a memory mapped temporary file.
+    When running in multiprocessing mode, every job is a process that is
+    forked from the parent, and the time it takes to fork grows with the
+    size of the parent. Values that are moved into a SharedData object
+    do not add to that size; instead, a forked child references them by
+    key and only loads the values that it accesses. Example::
+
+        shared = SharedData((n, host.get_all()) for n, host in ...)
+        def do_something(job, host, conn, key):
+            variables = shared[key]
+
+    Note that each access returns a new copy of the value, so changing the
+    returned value does not change the SharedData object.
+    """
+
+    def __init__(self, items = ()):
+        """
+        Constructor. The items are pickled one by one as they are
+        consumed, so the given iterable may be a generator that produces
+        the values lazily.
+
+        @type  items: dict|iterable
+        @param items: A dict, or a list of (key, value) tuples.
+        """
+        if hasattr(items, 'iteritems'):
+            items = items.iteritems()
+        self.index = {}
+        self.map   = None
+        thefile    = tempfile.TemporaryFile()
+        try:
+            offset = 0
+            for key, value in items:
+                data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+                thefile.write(data)
+                self.index[key] = offset, len(data)
+                offset += len(data)
+            thefile.flush()
+            if offset:
+                self.map = mmap.mmap(thefile.fileno(),
+                                     0,
+                                     access = mmap.ACCESS_READ)
+        finally:
+            thefile.close()
+
+    def __getitem__(self, key):
+        offset, size = self.index[key]
+        return cPickle.loads(self.map[offset:offset + size])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def close(self):
+        """
+        Releases the shared memory. The object can no longer be used
+        afterwards.
+        """
+        if self.map is not None:
+            self.map.close()
+        self.map   = None
+        self.index = {}
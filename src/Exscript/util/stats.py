@@ -0,0 +1,440 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Collecting timing statistics of jobs, connections and commands.
+"""
+import re
+import time
+import copy
+from collections import defaultdict
+from Exscript.util.impl import synchronized
+
+_number_re = re.compile(r'\d+')
+
+def normalize_command(command):
+    """
+    Returns a normalized version of the given command, such that commands
+    that only differ in whitespace or in numbers (interface names, VLAN
+    ids, IP addresses, ...) are grouped together. Example::
+
+        normalize_command('show  interface Gi0/12') # 'show interface Gi#/#'
+
+    @type  command: str
+    @param command: A command as sent to the remote host.
+    @rtype:  str
+    @return: The normalized command.
+    """
+    command = ' '.join(command.split())
+    return _number_re.sub('#', command)
+
+class Histogram(object):
+    """
+    A histogram with logarithmic buckets in the style of HdrHistogram.
+    Values are stored with a relative precision that is defined by the
+    number of sub-buckets per power of two, so the memory footprint does
+    not depend on the number of recorded values.
+    Histograms are picklable and may be merged, so they can be collected
+    in separate processes and combined later.
+    """
+
+    def __init__(self, sub_bucket_bits = 7, unit = 1000000):
+        """
+        Constructor.
+
+        @type  sub_bucket_bits: int
+        @param sub_bucket_bits: Defines the precision. 7 means that values
+            are stored with a relative error of less than 1/64.
+        @type  unit: int
+        @param unit: The resolution; values are stored as multiples of
+            1/unit. The default stores seconds with microsecond resolution.
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.unit            = unit
+        self.counts          = defaultdict(int)
+        self.count           = 0
+        self.sum             = 0
+        self.min             = None
+        self.max             = None
+
+    def _get_index(self, value):
+        if value < (1 << self.sub_bucket_bits):
+            return value
+        shift    = value.bit_length() - self.sub_bucket_bits
+        half     = 1 << (self.sub_bucket_bits - 1)
+        mantissa = value >> shift
+        return shift * half + mantissa
+
+    def _get_range(self, index):
+        if index < (1 << self.sub_bucket_bits):
+            return index, index
+        half     = 1 << (self.sub_bucket_bits - 1)
+        shift    = index // half - 1
+        mantissa = index - shift * half
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count = 1):
+        """
+        Records the given value.
+
+        @type  value: float
+        @param value: The value, e.g. a duration in seconds.
+        @type  count: int
+        @param count: The number of times the value is recorded.
+        """
+        value = max(0, int(round(value * self.unit)))
+        self.counts[self._get_index(value)] += count
+        self.count += count
+        self.sum   += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Adds all values that were recorded in the given histogram to this
+        histogram. Both histograms must use the same precision and unit.
+
+        @type  other: Histogram
+        @param other: The histogram to merge.
+        """
+        if other.sub_bucket_bits != self.sub_bucket_bits \
+          or other.unit != self.unit:
+            raise ValueError('can not merge histograms of different type')
+        if other.count == 0:
+            return
+        for index, count in other.counts.iteritems():
+            self.counts[index] += count
+        self.count += other.count
+        self.sum   += other.sum
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+    def get_count(self):
+        """
+        Returns the number of recorded values.
+
+        @rtype:  int
+        @return: The number of values.
+        """
+        return self.count
+
+    def get_min(self):
+        """
+        Returns the smallest recorded value, or None.
+
+        @rtype:  float|None
+        @return: The smallest value.
+        """
+        if self.min is None:
+            return None
+        return float(self.min) / self.unit
+
+    def get_max(self):
+        """
+        Returns the largest recorded value, or None.
+
+        @rtype:  float|None
+        @return: The largest value.
+        """
+        if self.max is None:
+            return None
+        return float(self.max) / self.unit
+
+    def get_mean(self):
+        """
+        Returns the average of all recorded values, or None.
+
+        @rtype:  float|None
+        @return: The average.
+        """
+        if self.count == 0:
+            return None
+        return float(self.sum) / self.count / self.unit
+
+    def get_total(self):
+        """
+        Returns the sum of all recorded values.
+
+        @rtype:  float
+        @return: The sum.
+        """
+        return float(self.sum) / self.unit
+
+    def get_percentile(self, percentile):
+        """
+        Returns the value below which the given percentage of all recorded
+        values lies, or None if no values were recorded.
+
+        @type  percentile: float
+        @param percentile: A number between 0 and 100.
+        @rtype:  float|None
+        @return: The value at the given percentile.
+        """
+        if self.count == 0:
+            return None
+        wanted = max(1, int(round(self.count * percentile / 100.0)))
+        seen   = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                low, high = self._get_range(index)
+                value     = min(max(high, self.min), self.max)
+                return float(value) / self.unit
+        return self.get_max()
+
+class Stats(object):
+    """
+    Collects timing information about a run. Phases are things such as
+    'connect', 'login', 'execute', or 'job', commands are grouped by
+    L{normalize_command()}. In addition, named counters (such as the
+    number of bytes received) may be maintained.
+    Like histograms, Stats objects are picklable and may be merged.
+    """
+
+    def __init__(self):
+        self.phases      = defaultdict(Histogram)
+        self.commands    = defaultdict(Histogram)
+        self.hosts       = defaultdict(float)
+        self.completions = defaultdict(int) # Maps timestamp to count.
+        self.counters    = defaultdict(int) # Maps (name, label) to count.
+
+    def __getstate__(self):
+        # The lock created by the synchronized decorator can not be pickled.
+        state = self.__dict__.copy()
+        state.pop('_sync_lock', None)
+        return state
+
+    @synchronized
+    def record(self, phase, seconds):
+        """
+        Records the duration of the given phase.
+
+        @type  phase: str
+        @param phase: The name of the phase, e.g. 'connect'.
+        @type  seconds: float
+        @param seconds: The duration.
+        """
+        self.phases[phase].record(seconds)
+
+    @synchronized
+    def record_command(self, command, seconds):
+        """
+        Records the duration of the given command.
+
+        @type  command: str
+        @param command: The command, normalized automatically.
+        @type  seconds: float
+        @param seconds: The duration.
+        """
+        self.commands[normalize_command(command)].record(seconds)
+
+    @synchronized
+    def record_host(self, host, seconds):
+        """
+        Adds the given duration to the total time spent on the given host.
+
+        @type  host: str
+        @param host: The name of the host.
+        @type  seconds: float
+        @param seconds: The duration.
+        """
+        self.hosts[host] += seconds
+
+    @synchronized
+    def record_completion(self, timestamp = None):
+        """
+        Records that a job was completed at the given time.
+
+        @type  timestamp: float
+        @param timestamp: A unix timestamp, defaults to the current time.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.completions[int(timestamp)] += 1
+
+    @synchronized
+    def increment(self, name, value = 1, label = None):
+        """
+        Increments the counter with the given name.
+
+        @type  name: str
+        @param name: The name of the counter, e.g. 'bytes_received'.
+        @type  value: int
+        @param value: The value that is added to the counter.
+        @type  label: str
+        @param label: An optional label, e.g. the name of a driver.
+        """
+        self.counters[(name, label)] += value
+
+    @synchronized
+    def clear(self):
+        """
+        Removes everything that was recorded. The object is cleared in
+        place, so that whoever holds a reference to it keeps recording
+        into the same object.
+        """
+        self.phases.clear()
+        self.commands.clear()
+        self.hosts.clear()
+        self.completions.clear()
+        self.counters.clear()
+
+    @synchronized
+    def merge(self, other):
+        """
+        Adds everything that was recorded in the given object to this one.
+
+        @type  other: Stats
+        @param other: The statistics to merge.
+        """
+        for phase, histogram in other.phases.iteritems():
+            self.phases[phase].merge(histogram)
+        for command, histogram in other.commands.iteritems():
+            self.commands[command].merge(histogram)
+        for host, seconds in other.hosts.iteritems():
+            self.hosts[host] += seconds
+        for timestamp, count in other.completions.iteritems():
+            self.completions[timestamp] += count
+        for key, value in other.counters.iteritems():
+            self.counters[key] += value
+
+    @synchronized
+    def get_phases(self):
+        """
+        Returns a sorted list of the phases for which timings were recorded.
+
+        @rtype:  list[str]
+        @return: The phase names.
+        """
+        return sorted(self.phases.keys())
+
+    @synchronized
+    def get_histogram(self, phase):
+        """
+        Returns a copy of the histogram of the given phase, or None.
+
+        @type  phase: str
+        @param phase: The name of the phase.
+        @rtype:  Histogram|None
+        @return: The histogram.
+        """
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            return None
+        return copy.deepcopy(histogram)
+
+    @synchronized
+    def get_counter(self, name, label = None):
+        """
+        Returns the value of the counter with the given name and label.
+
+        @type  name: str
+        @param name: The name of the counter.
+        @type  label: str
+        @param label: The label of the counter.
+        @rtype:  int
+        @return: The value of the counter.
+        """
+        return self.counters.get((name, label), 0)
+
+    @synchronized
+    def get_counters(self, name):
+        """
+        Returns the values of all counters with the given name.
+
+        @type  name: str
+        @param name: The name of the counters.
+        @rtype:  dict(str, int)
+        @return: Maps each label to the value of the counter.
+        """
+        return dict((label, value)
+                    for (thename, label), value in self.counters.items()
+                    if thename == name)
+
+    @synchronized
+    def get_slowest_hosts(self, n = 10):
+        """
+        Returns the n hosts on which the most time was spent.
+
+        @type  n: int
+        @param n: The maximum number of hosts returned.
+        @rtype:  list[(str, float)]
+        @return: A list of (hostname, seconds) tuples, slowest first.
+        """
+        hosts = sorted(self.hosts.iteritems(), key = lambda x: -x[1])
+        return hosts[:n]
+
+    @synchronized
+    def get_slowest_commands(self, n = 10, percentile = 95):
+        """
+        Returns the n (normalized) commands with the highest latency at
+        the given percentile.
+
+        @type  n: int
+        @param n: The maximum number of commands returned.
+        @type  percentile: float
+        @param percentile: The percentile by which the commands are ranked.
+        @rtype:  list[(str, Histogram)]
+        @return: A list of (command, histogram) tuples, slowest first. The
+            histograms are copies.
+        """
+        key      = lambda x: -x[1].get_percentile(percentile)
+        commands = sorted(self.commands.iteritems(), key = key)
+        return [(command, copy.deepcopy(histogram))
+                for command, histogram in commands[:n]]
+
+    @synchronized
+    def get_throughput(self, interval = 60):
+        """
+        Returns the number of completed jobs per time interval, from the
+        first to the last completion.
+
+        @type  interval: int
+        @param interval: The length of each interval in seconds.
+        @rtype:  list[(int, int)]
+        @return: A list of (timestamp, count) tuples.
+        """
+        if not self.completions:
+            return []
+        buckets = defaultdict(int)
+        for timestamp, count in self.completions.iteritems():
+            buckets[timestamp - timestamp % interval] += count
+        first = min(buckets)
+        last  = max(buckets)
+        return [(ts, buckets.get(ts, 0))
+                for ts in xrange(first, last + 1, interval)]
+
+    @synchronized
+    def get_rate(self, interval = 60, now = None):
+        """
+        Returns the average number of jobs per second that were completed
+        within the given number of seconds before the given time.
+
+        @type  interval: int
+        @param interval: The length of the time window in seconds.
+        @type  now: float
+        @param now: The end of the time window, defaults to the current time.
+        @rtype:  float
+        @return: The number of jobs per second.
+        """
+        if now is None:
+            now = time.time()
+        start = int(now) - interval
+        total = sum(count for timestamp, count in self.completions.items()
+                    if start < timestamp <= now)
+        return float(total) / interval
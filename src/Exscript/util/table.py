@@ -0,0 +1,501 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Parsing tables in the output of a remote host in a single pass.
+"""
+import re
+import threading
+from bisect      import bisect_right
+from collections import OrderedDict
+
+# Compiled parsers, keyed by their type and definition.
+_cache      = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = 100
+
+# Matches lines that are empty or that only separate a header from the
+# rows, such as "-------- ------".
+_separator_re = re.compile(r'^[\s\-=+|]*$')
+_word_re      = re.compile(r'\S+')
+
+# The syntax of state machine definitions.
+_value_options = ('Required', 'Filldown', 'Fillup', 'Key')
+_value_re      = re.compile(r'^Value\s+(?:([\w,]+)\s+)?(\w+)\s+(\(.*\))\s*$')
+_state_re      = re.compile(r'^\w+$')
+_rule_re       = re.compile(r'^(\^.*?)(?:\s+->\s*(.*?))?\s*$')
+_error_re      = re.compile(r'^Error(?:\s+"?(.*?)"?)?$')
+_action_re     = re.compile(r'^(?:(Next|Continue)'
+                            r'(?:\.(Record|NoRecord|Clear|Clearall))?'
+                            r'|(Record|NoRecord|Clear|Clearall))?'
+                            r'(?:\s*(?<![\w.])(\w+))?$')
+_variable_re   = re.compile(r'\$\$|\$\{(\w+)\}|\$(\w+)')
+_flags_re      = re.compile(r'\(\?[iLmsux]+\)')
+_group_re      = re.compile(r'\(\?P<(\w+)>')
+
+def _get_lines(lines):
+    if isinstance(lines, basestring):
+        return lines.splitlines()
+    return lines
+
+class TableParser(object):
+    """
+    Base class of all table parsers. A parser is created from a
+    definition once, and may then be used to parse any number of tables.
+    """
+
+    def __init__(self, definition):
+        """
+        Constructor.
+
+        @type  definition: str
+        @param definition: Describes the table; see the subclasses.
+        """
+        self.definition = definition
+        self.last       = None, None
+
+    def _parse(self, lines):
+        raise NotImplementedError()
+
+    def parse(self, lines):
+        """
+        Parses the given lines in a single pass and returns the columns.
+        The result of the last call is kept, so that retrieving multiple
+        columns of the same table does not parse it again. The returned
+        dict and its lists must not be modified.
+
+        @type  lines: list[str]|str
+        @param lines: The lines of the table, e.g. a response.
+        @rtype:  OrderedDict(str, list[str])
+        @return: Maps each column name to the list of its values.
+        """
+        lines        = _get_lines(lines)
+        last, result = self.last
+        if last is not None and last == lines:
+            return result
+        result    = self._parse(lines)
+        self.last = list(lines), result
+        return result
+
+class ColumnParser(TableParser):
+    """
+    Parses tables whose columns are aligned with a header line, e.g.::
+
+        Interface          IP-Address      OK? Method Status    Protocol
+        FastEthernet0/0    10.0.0.1        YES NVRAM  up        up
+
+    The definition contains the titles of the columns, separated by
+    whitespace, and each title is also the name of the column. The header
+    is the first line that contains all of the given titles in the given
+    order. Not every word of the header line needs to be listed; words
+    that are not listed are part of the column to their left.
+    Every word in the following lines is assigned to the column whose
+    title it overlaps most, or, if it overlaps none, to the column whose
+    title starts left of it. This way, both left and right aligned
+    columns are supported. Words of the same column are joined by a
+    space.
+    """
+
+    def __init__(self, definition):
+        TableParser.__init__(self, definition)
+        self.names = definition.split()
+        if not self.names:
+            raise ValueError('no column titles given')
+        if len(set(self.names)) != len(self.names):
+            raise ValueError('duplicate column title in %s' % repr(definition))
+        titles         = [r'(?<!\S)(%s)(?!\S)' % re.escape(name)
+                          for name in self.names]
+        self.header_re = re.compile('.*?'.join(titles))
+
+    def _get_column(self, starts, ends, start, end):
+        # Returns the index of the column to which the word with the given
+        # span belongs.
+        best    = max(bisect_right(starts, start) - 1, 0)
+        overlap = min(end, ends[best]) - max(start, starts[best])
+        for i in xrange(best + 1, len(starts)):
+            if starts[i] >= end:
+                break
+            this_overlap = min(end, ends[i]) - starts[i]
+            if this_overlap > overlap:
+                best    = i
+                overlap = this_overlap
+        return best
+
+    def _parse(self, lines):
+        result = OrderedDict((name, []) for name in self.names)
+        lines  = iter(lines)
+
+        # Find the header.
+        for line in lines:
+            match = self.header_re.search(line)
+            if match is not None:
+                break
+        else:
+            return result
+        n_columns = len(self.names)
+        starts    = [match.start(i + 1) for i in range(n_columns)]
+        ends      = [match.end(i + 1) for i in range(n_columns)]
+        columns   = result.values()
+
+        # A word that does not cross the start of a title belongs to the
+        # column in which it starts, so most rows can simply be cut into
+        # slices at those positions. One regular expression finds the
+        # rows that contain a word crossing a cut; only the words of
+        # these rows are assigned one by one.
+        cuts    = starts[1:]
+        slices  = zip([0] + cuts, cuts + [None])
+        crossed = '|'.join(r'.{%d}\S\S' % (cut - 1) for cut in cuts)
+        crossed = re.compile(crossed or '(?!)')
+        for line in lines:
+            if _separator_re.match(line):
+                continue
+            if not crossed.match(line):
+                row = [' '.join(line[start:end].split())
+                       for start, end in slices]
+            else:
+                row = [[] for i in range(n_columns)]
+                for word in _word_re.finditer(line):
+                    start, end = word.span()
+                    column     = self._get_column(starts, ends, start, end)
+                    row[column].append(word.group())
+                row = [' '.join(words) for words in row]
+            for column, value in zip(columns, row):
+                column.append(value)
+        return result
+
+class FixedWidthParser(TableParser):
+    """
+    Parses tables whose columns have a fixed width. The definition
+    contains the widths of the columns, separated by whitespace; the
+    last width may be "*" for a column that extends to the end of the
+    line. The columns are named by their number, starting with 0.
+    Values are stripped of surrounding whitespace, and empty lines are
+    skipped. If the table contains a line that separates the header from
+    the rows (such as "------- ----"), only the lines following it are
+    rows.
+    """
+
+    def __init__(self, definition):
+        TableParser.__init__(self, definition)
+        widths = definition.split()
+        if not widths:
+            raise ValueError('no column widths given')
+        self.slices = []
+        start       = 0
+        for n, width in enumerate(widths):
+            if width == '*' and n == len(widths) - 1:
+                self.slices.append((start, None))
+                break
+            try:
+                width = int(width)
+            except ValueError:
+                raise ValueError('invalid column width: %s' % repr(width))
+            if width <= 0:
+                raise ValueError('invalid column width: %s' % repr(width))
+            self.slices.append((start, start + width))
+            start += width
+
+    def _parse(self, lines):
+        # Skip the header, if there is one.
+        for n, line in enumerate(lines):
+            if line.strip() and _separator_re.match(line):
+                lines = lines[n + 1:]
+                break
+
+        result  = OrderedDict((n, []) for n in range(len(self.slices)))
+        columns = zip(result.values(), self.slices)
+        for line in lines:
+            if not line.strip():
+                continue
+            for column, (start, end) in columns:
+                column.append(line[start:end].strip())
+        return result
+
+class _Rule(object):
+    def __init__(self, regex, names, line_action, record_action, state, error):
+        self.regex         = re.compile(regex)
+        self.names         = names
+        self.line_action   = line_action
+        self.record_action = record_action
+        self.state         = state
+        self.error         = error
+
+class StateMachine(TableParser):
+    """
+    Parses the output of a remote host using a state machine in the style
+    of TextFSM. Example definition::
+
+        Value Required Interface (\\S+)
+        Value Status (up|down|administratively down)
+
+        Start
+          ^${Interface} is ${Status} -> Record
+
+    A definition starts with the values, which are the columns of the
+    result. The options Required, Filldown, Fillup and Key are
+    supported. The values are followed by a list of states, each holding
+    a list of rules; parsing starts in the state named "Start". Every
+    line is matched against the rules of the current state, and the
+    first matching rule is applied. A rule may have actions in the
+    format "-> [Next|Continue][.Record|.NoRecord|.Clear|.Clearall]
+    [NewState]", or "-> Error [message]". The states "End" and "EOF"
+    are handled as in TextFSM.
+
+    The rules of each state are combined into a single regular
+    expression, so every line is only matched once, unless a rule uses
+    the Continue action.
+    """
+
+    def __init__(self, definition):
+        TableParser.__init__(self, definition)
+        self.options = OrderedDict()
+        self.regexes = {}
+        self.states  = OrderedDict()
+        self.masters = {}
+        lines        = definition.splitlines()
+        state        = None
+        for n, line in enumerate(lines):
+            try:
+                state = self._parse_line(state, line)
+            except ValueError, e:
+                raise ValueError('line %d: %s' % (n + 1, e))
+        if 'Start' not in self.states:
+            raise ValueError('missing Start state')
+        for name, rules in self.states.iteritems():
+            for rule in rules:
+                if rule.state and rule.state not in self.states \
+                  and rule.state not in ('End', 'EOF'):
+                    raise ValueError('undefined state %s' % rule.state)
+            self.masters[name] = self._compile_state(name)
+
+    def _parse_line(self, state, line):
+        # Parses the given line of the definition and returns the state
+        # that is being defined.
+        if not line.strip() or line.lstrip().startswith('#'):
+            return state
+
+        # Values.
+        if line.startswith('Value '):
+            if state is not None:
+                raise ValueError('values must be defined before the states')
+            match = _value_re.match(line)
+            if match is None:
+                raise ValueError('invalid value definition: %s' % line)
+            options, name, regex = match.groups()
+            options = options and options.split(',') or []
+            for option in options:
+                if option not in _value_options:
+                    raise ValueError('unsupported value option %s' % option)
+            if name in self.options:
+                raise ValueError('duplicate value %s' % name)
+            self.options[name] = options
+            self.regexes[name] = regex
+            return state
+
+        # States.
+        if not line[0].isspace():
+            name = line.strip()
+            if not _state_re.match(name):
+                raise ValueError('invalid state name %s' % repr(name))
+            if name in self.states:
+                raise ValueError('duplicate state %s' % name)
+            self.states[name] = []
+            return name
+
+        # Rules.
+        if state is None:
+            raise ValueError('rule outside of a state')
+        self.states[state].append(self._parse_rule(line.strip()))
+        return state
+
+    def _parse_rule(self, line):
+        match = _rule_re.match(line)
+        if match is None:
+            raise ValueError('invalid rule: %s' % line)
+        regex, action = match.groups()
+
+        # Replace the variables in the regular expression.
+        names = []
+        def replace(match):
+            if match.group(0) == '$$':
+                return '$'
+            name = match.group(1) or match.group(2)
+            if name not in self.regexes:
+                raise ValueError('undefined value %s' % name)
+            names.append(name)
+            return '(?P<%s>%s)' % (name, self.regexes[name])
+        regex = _variable_re.sub(replace, regex)
+
+        # Parse the action.
+        line_action, record_action, state, error = 'Next', None, None, None
+        if action is not None:
+            match = _error_re.match(action)
+            if match is not None:
+                error = match.group(1) or 'state error'
+            else:
+                match = _action_re.match(action)
+                if match is None:
+                    raise ValueError('invalid action: %s' % action)
+                line_action   = match.group(1) or 'Next'
+                record_action = match.group(2) or match.group(3)
+                state         = match.group(4)
+                if line_action == 'Continue' and state:
+                    raise ValueError('Continue can not change the state')
+        try:
+            return _Rule(regex, names, line_action, record_action, state, error)
+        except re.error, e:
+            raise ValueError('invalid regular expression %s: %s' % (regex, e))
+
+    def _compile_state(self, state):
+        # Combines the rules of the given state into one regular
+        # expression. Returns None if they can not be combined because
+        # they use inline flags, or too many groups.
+        rules   = self.states[state]
+        regexes = []
+        groups  = 0
+        for n, rule in enumerate(rules):
+            if _flags_re.search(rule.regex.pattern):
+                return None
+            regex  = _group_re.sub(r'(?P<_%d_\1>' % n, rule.regex.pattern)
+            groups = groups + rule.regex.groups + 1
+            regexes.append('(?P<_%d>%s)' % (n, regex))
+        if not regexes or groups >= 100:
+            return None
+        master = re.compile('|'.join(regexes))
+        index  = dict((master.groupindex['_%d' % n], n)
+                      for n in range(len(rules)))
+        return master, index
+
+    def _match(self, state, line, start):
+        # Returns the index of the first rule of the given state that
+        # matches the line, starting with the rule with the given index,
+        # and a dict that maps the names of the matched values to the
+        # matched strings.
+        rules  = self.states[state]
+        master = self.masters[state]
+        if start == 0 and master is not None:
+            regex, index = master
+            match        = regex.match(line)
+            if match is None:
+                return None, None
+            n = index[match.lastindex]
+            return n, dict((name, match.group('_%d_%s' % (n, name)))
+                           for name in rules[n].names)
+        for n in xrange(start, len(rules)):
+            match = rules[n].regex.match(line)
+            if match is not None:
+                return n, dict((name, match.group(name))
+                               for name in rules[n].names)
+        return None, None
+
+    def _parse(self, lines):
+        names    = self.options.keys()
+        values   = dict.fromkeys(names)
+        records  = []
+        filldown = [name for name in names
+                    if 'Filldown' in self.options[name]]
+        required = [name for name in names
+                    if 'Required' in self.options[name]]
+        fillup   = [name for name in names
+                    if 'Fillup' in self.options[name]]
+
+        def clear(names):
+            for name in names:
+                if name not in filldown:
+                    values[name] = None
+
+        def record():
+            if all(values[name] is None for name in names):
+                return
+            if all(values[name] is not None for name in required):
+                records.append([values[name] or '' for name in names])
+            clear(names)
+
+        state = 'Start'
+        for line in lines:
+            line  = line.rstrip('\r\n')
+            start = 0
+            while True:
+                n, matched = self._match(state, line, start)
+                if n is None:
+                    break
+                rule = self.states[state][n]
+                if rule.error is not None:
+                    raise ValueError('%s: %s' % (rule.error, repr(line)))
+
+                # Assign the values.
+                for name, value in matched.iteritems():
+                    if value is None:
+                        continue
+                    values[name] = value
+                    if name not in fillup:
+                        continue
+                    column = names.index(name)
+                    for row in reversed(records):
+                        if row[column]:
+                            break
+                        row[column] = value
+
+                # Apply the actions.
+                if rule.record_action == 'Record':
+                    record()
+                elif rule.record_action == 'Clear':
+                    clear(names)
+                elif rule.record_action == 'Clearall':
+                    for name in names:
+                        values[name] = None
+                if rule.line_action == 'Continue':
+                    start = n + 1
+                    continue
+                if rule.state:
+                    state = rule.state
+                break
+            if state in ('End', 'EOF'):
+                break
+
+        # Unless the EOF state was given explicitly, the last record is
+        # stored at the end of the input.
+        if state != 'End' and 'EOF' not in self.states:
+            record()
+
+        result = OrderedDict((name, []) for name in names)
+        for row in records:
+            for name, value in zip(names, row):
+                result[name].append(value)
+        return result
+
+def get_parser(cls, definition):
+    """
+    Returns a parser of the given type for the given definition. Parsers
+    are cached, so each definition is only compiled once.
+
+    @type  cls: class
+    @param cls: A subclass of L{TableParser}.
+    @type  definition: str
+    @param definition: The definition that is passed to the parser.
+    @rtype:  TableParser
+    @return: The (possibly cached) parser.
+    """
+    key = cls, definition
+    with _cache_lock:
+        parser = _cache.pop(key, None)
+        if parser is not None:
+            _cache[key] = parser
+            return parser
+    parser = cls(definition)
+    with _cache_lock:
+        _cache[key] = parser
+        while len(_cache) > _cache_size:
+            _cache.popitem(last = False)
+    return parser
@@ -15,36 +15,284 @@
 """
 Executing Exscript templates on a connection.
 """
+import os
+import stat
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+from collections          import OrderedDict
 from Exscript             import stdlib
+from Exscript.version     import __version__
 from Exscript.interpreter import Parser
 
-def _compile(conn, filename, template, parser_kwargs, **kwargs):
-    if conn:
-        hostname = conn.get_host()
-        account  = conn.last_account
-        username = account is not None and account.get_name() or None
-    else:
-        hostname = 'undefined'
-        username = None
+# Compiled programs, keyed by the template source and parser options. The
+# cache is per process; worker processes that are forked after a template
+# was compiled inherit the compiled program.
+_cache       = OrderedDict()
+_cache_lock  = threading.Lock()
+_cache_size  = 100
+_builtins    = ('__filename__', '__username__', '__hostname__',
+                '__connection__')
+_placeholder = [''] # The value of variables while compiling.
+
+# Options that may be passed in the parser_args argument. They are kept
+# apart from the keyword arguments, which define template variables.
+_parser_options = ('stream', 'window')
 
+# Compiled programs may also be stored in a file next to the template.
+# Artifacts of other versions are ignored.
+_artifact_version = 2, __version__
+_artifact_size    = 10
+
+def _get_cache_key(filename, template, parser, kwargs):
+    # Parsing only depends on the names of the defined variables, not on
+    # their values, so the values are not part of the key.
+    names   = sorted(k for k in kwargs if k not in _builtins)
+    options = (parser.no_prompt,
+               parser.strip_command,
+               parser.stream,
+               parser.window,
+               parser.secure_only,
+               parser.debug)
+    if isinstance(template, unicode):
+        template = template.encode('utf-8')
+    digest  = hashlib.sha1(template).hexdigest()
+    return digest, filename, options, tuple(names)
+
+def _compile(filename, template, parser_kwargs, **kwargs):
     # Init the parser.
     parser = Parser(**parser_kwargs)
-    parser.define(**kwargs)
+    key    = _get_cache_key(filename, template, parser, kwargs)
+    with _cache_lock:
+        program = _cache.pop(key, None)
+        if program is not None:
+            _cache[key] = program
+            return program
 
-    # Define the built-in variables and functions.
+    # Try a precompiled artifact of the template file. Unpickling it may
+    # execute arbitrary code, so it is never done in secure mode.
+    if filename is not None and not parser.secure_only:
+        program = _load_artifact(filename, key)
+        if program is not None:
+            _cache_program(key, program)
+            return program
+
+    # Define the variables and functions. The program is shared by all
+    # callers, so only the names of the variables are defined; their
+    # values, and the built-in variables, are bound when the program
+    # is executed.
+    parser.define(**dict((name, _placeholder) for name in kwargs))
     builtin = dict(__filename__   = [filename or 'undefined'],
-                   __username__   = [username],
-                   __hostname__   = [hostname],
-                   __connection__ = conn)
+                   __username__   = [None],
+                   __hostname__   = ['undefined'],
+                   __connection__ = None)
     parser.define_object(**builtin)
     parser.define_object(**stdlib.functions)
 
     # Compile the template.
-    return parser.parse(template, builtin.get('__filename__')[0])
+    program = parser.parse(template, builtin.get('__filename__')[0])
+    _cache_program(key, program)
+    return program
+
+def _cache_program(key, program):
+    with _cache_lock:
+        _cache[key] = program
+        while len(_cache) > _cache_size:
+            _cache.popitem(last = False)
+
+def _get_artifact_name(filename):
+    return filename + 'c'
+
+def _read_artifact(filename):
+    # Returns the programs in the artifact of the given template file,
+    # or None if there is no artifact or it is stale. The header is
+    # checked before the programs are unpickled.
+    try:
+        with open(_get_artifact_name(filename), 'rb') as fp:
+            version, mtime = pickle.load(fp)
+            if version != _artifact_version:
+                return None
+            if mtime != os.path.getmtime(filename):
+                return None
+            return pickle.load(fp)
+    except Exception:
+        return None
+
+def _load_artifact(filename, key):
+    # The artifact is found through the filename, so the filename is
+    # not part of the keys in it.
+    programs = _read_artifact(filename)
+    if programs is None:
+        return None
+    return programs.get(key[:1] + key[2:])
+
+def _save_artifact(filename, key, program):
+    # Multiple programs (that were compiled with different options or
+    # variables) may be stored in the same artifact.
+    programs = _read_artifact(filename) or OrderedDict()
+    programs.pop(key[:1] + key[2:], None)
+    programs[key[:1] + key[2:]] = program
+    while len(programs) > _artifact_size:
+        programs.popitem(last = False)
+
+    # Write to a temporary file first, such that other processes never
+    # read a partially written artifact.
+    artifact  = _get_artifact_name(filename)
+    dirname   = os.path.dirname(os.path.abspath(artifact))
+    fd, tmp   = tempfile.mkstemp(dir = dirname, suffix = '.tmp')
+    try:
+        os.chmod(tmp, stat.S_IMODE(os.stat(filename).st_mode))
+        with os.fdopen(fd, 'wb') as fp:
+            header = _artifact_version, os.path.getmtime(filename)
+            pickle.dump(header, fp, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(programs, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, artifact)
+    except:
+        os.remove(tmp)
+        raise
+    return artifact
+
+def _get_parser_args(strip_command, no_prompt, parser_args):
+    if no_prompt:
+        return {'no_prompt': True}
+    args = {'strip_command': strip_command}
+    for name, value in (parser_args or {}).iteritems():
+        if name not in _parser_options:
+            raise TypeError('unknown parser option: ' + repr(name))
+        args[name] = value
+    return args
 
 def _run(conn, filename, template, parser_kwargs, **kwargs):
-    compiled = _compile(conn, filename, template, parser_kwargs, **kwargs)
-    return compiled.execute()
+    compiled = _compile(filename, template, parser_kwargs, **kwargs)
+
+    # Bind the variables of this run.
+    if conn:
+        hostname = conn.get_host()
+        account  = conn.last_account
+        username = account is not None and account.get_name() or None
+    else:
+        hostname = 'undefined'
+        username = None
+    # The values of the caller are bound as they are; they are not shared
+    # with other runs.
+    variables = {}
+    for key, value in kwargs.iteritems():
+        if hasattr(value, '__iter__'):
+            variables[key] = value
+        else:
+            variables[key] = [value]
+    variables.update(__filename__   = [filename or 'undefined'],
+                     __username__   = [username],
+                     __hostname__   = [hostname],
+                     __connection__ = conn)
+    return compiled.execute(variables = variables)
+
+def compile(string,
+            strip_command = True,
+            no_prompt     = False,
+            parser_args   = None,
+            **kwargs):
+    """
+    Compiles the given template and stores the result in a per-process
+    cache, such that subsequent calls to eval() or paste() with the same
+    template, options and variable names do not parse it again.
+    Raises an exception if the compilation fails.
+
+    Compiling the template before starting a L{Exscript.Queue} in
+    multiprocessing mode makes the compiled program available to all
+    worker processes.
+
+    @type  string: string
+    @param string: The template to compile.
+    @type  strip_command: bool
+    @param strip_command: Like the argument of eval().
+    @type  no_prompt: bool
+    @param no_prompt: True if the template is run using paste().
+    @type  parser_args: dict
+    @param parser_args: Like the argument of eval().
+    @type  kwargs: dict
+    @param kwargs: Variables to define in the template. Only their
+                   names are used; the values are bound when the
+                   template is run.
+    @rtype:  Exscript.interpreter.Program
+    @return: The compiled program.
+    """
+    parser_kwargs = _get_parser_args(strip_command, no_prompt, parser_args)
+    return _compile(None, string, parser_kwargs, **kwargs)
+
+def compile_file(filename,
+                 strip_command = True,
+                 no_prompt     = False,
+                 parser_args   = None,
+                 **kwargs):
+    """
+    Like compile(), but reads the template from the given file.
+    If an artifact that was created using precompile_file() is found
+    next to the template and is fresh, the program is loaded from it
+    instead of parsing the template.
+
+    @type  filename: string
+    @param filename: The name of the template file.
+    @type  strip_command: bool
+    @param strip_command: Like the argument of eval().
+    @type  no_prompt: bool
+    @param no_prompt: True if the template is run using paste_file().
+    @type  parser_args: dict
+    @param parser_args: Like the argument of eval().
+    @type  kwargs: dict
+    @param kwargs: Variables to define in the template. Only their
+                   names are used; the values are bound when the
+                   template is run.
+    @rtype:  Exscript.interpreter.Program
+    @return: The compiled program.
+    """
+    template      = open(filename).read()
+    parser_kwargs = _get_parser_args(strip_command, no_prompt, parser_args)
+    return _compile(filename, template, parser_kwargs, **kwargs)
+
+def precompile_file(filename,
+                    strip_command = True,
+                    no_prompt     = False,
+                    parser_args   = None,
+                    **kwargs):
+    """
+    Compiles the given template file and stores the program in an
+    artifact next to it (the filename with a "c" appended). The
+    artifact is used by compile_file(), test_file(), eval_file() and
+    paste_file(), as long as it was created by the same version of
+    Exscript, the modification time of the template did not change,
+    and the content, options and variable names match.
+    Raises an exception if the compilation fails.
+
+    The artifact is a pickle and is trusted like the template itself,
+    so it must not be writable by anyone who may not edit the template.
+    For the same reason, artifacts are never used when a template is
+    parsed in secure mode.
+
+    @type  filename: string
+    @param filename: The name of the template file.
+    @type  strip_command: bool
+    @param strip_command: Like the argument of eval().
+    @type  no_prompt: bool
+    @param no_prompt: True if the template is run using paste_file().
+    @type  parser_args: dict
+    @param parser_args: Like the argument of eval().
+    @type  kwargs: dict
+    @param kwargs: Variables to define in the template. Only their
+                   names are used; the values are bound when the
+                   template is run.
+    @rtype:  string
+    @return: The name of the artifact.
+    """
+    template      = open(filename).read()
+    parser_kwargs = _get_parser_args(strip_command, no_prompt, parser_args)
+    program       = _compile(filename, template, parser_kwargs, **kwargs)
+    key           = _get_cache_key(filename,
+                                   template,
+                                   Parser(**parser_kwargs),
+                                   kwargs)
+    return _save_artifact(filename, key, program)
 
 def test(string, **kwargs):
     """
@@ -56,7 +304,7 @@ def test(string, **kwargs):
     @type  kwargs: dict
     @param kwargs: Variables to define in the template.
     """
-    _compile(None, None, string, {}, **kwargs)
+    _compile(None, string, {}, **kwargs)
 
 def test_secure(string, **kwargs):
     """
@@ -70,7 +318,7 @@ def test_secure(string, **kwargs):
     @type  kwargs: dict
     @param kwargs: Variables to define in the template.
     """
-    _compile(None, None, string, {'secure': True}, **kwargs)
+    _compile(None, string, {'secure': True}, **kwargs)
 
 def test_file(filename, **kwargs):
     """
@@ -82,9 +330,13 @@ def test_file(filename, **kwargs):
     @type  kwargs: dict
     @param kwargs: Variables to define in the template.
     """
-    _compile(None, filename, open(filename).read(), {}, **kwargs)
+    _compile(filename, open(filename).read(), {}, **kwargs)
 
-def eval(conn, string, strip_command = True, **kwargs):
+def eval(conn,
+         string,
+         strip_command = True,
+         parser_args   = None,
+         **kwargs):
     """
     Compiles the given template and executes it on the given
     connection.
@@ -109,21 +361,42 @@ def eval(conn, string, strip_command = True, **kwargs):
 
     By setting strip_command to True, the first line is ommitted.
 
+    Options of the parser are passed in the parser_args dict, such
+    that they never collide with the names of template variables.
+
+    If the 'stream' option is True, extract statements that directly
+    follow a command (such as the one above) are applied to each line
+    of the response while it is read, so only the extracted substrings
+    are retained.
+    The lines of the response are not stored in the __response__
+    variable of such a command, which remains empty.
+
+    If the 'window' option is greater than 1, consecutive commands are
+    sent in windows of up to that many commands, without waiting for
+    the prompt of each command before sending the next one. See
+    L{Exscript.protocols.Protocol.execute_pipelined()}.
+
     @type  conn: Exscript.protocols.Protocol
     @param conn: The connection on which to run the template.
     @type  string: string
     @param string: The template to compile.
     @type  strip_command: bool
     @param strip_command: Whether to strip the command echo from the response.
+    @type  parser_args: dict
+    @param parser_args: Options of the parser, see above.
     @type  kwargs: dict
     @param kwargs: Variables to define in the template.
     @rtype:  dict
     @return: The variables that are defined after execution of the script.
     """
-    parser_args = {'strip_command': strip_command}
-    return _run(conn, None, string, parser_args, **kwargs)
+    parser_kwargs = _get_parser_args(strip_command, False, parser_args)
+    return _run(conn, None, string, parser_kwargs, **kwargs)
 
-def eval_file(conn, filename, strip_command = True, **kwargs):
+def eval_file(conn,
+              filename,
+              strip_command = True,
+              parser_args   = None,
+              **kwargs):
     """
     Convenience wrapper around eval() that reads the template from a file
     instead.
@@ -134,12 +407,14 @@ def eval_file(conn, filename, strip_command = True, **kwargs):
     @param filename: The name of the template file.
     @type  strip_command: bool
     @param strip_command: Whether to strip the command echo from the response.
+    @type  parser_args: dict
+    @param parser_args: Like the argument of eval().
     @type  kwargs: dict
     @param kwargs: Variables to define in the template.
     """
-    template    = open(filename, 'r').read()
-    parser_args = {'strip_command': strip_command}
-    return _run(conn, filename, template, parser_args, **kwargs)
+    template      = open(filename, 'r').read()
+    parser_kwargs = _get_parser_args(strip_command, False, parser_args)
+    return _run(conn, filename, template, parser_kwargs, **kwargs)
 
 def paste(conn, string, **kwargs):
     """
@@ -177,4 +452,4 @@ def paste_file(conn, filename, **kwargs):
     @param kwargs: Variables to define in the template.
     """
     template = open(filename, 'r').read()
-    return _run(conn, None, template, {'no_prompt': True}, **kwargs)
+    return _run(conn, filename, template, {'no_prompt': True}, **kwargs)
@@ -0,0 +1,236 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Tracing the time spent in orders, tasks, jobs and connections.
+Spans use OpenTelemetry-style trace and span ids, so they can be
+correlated across threads and processes.
+"""
+import json
+import random
+import threading
+import time
+
+_exporter = None
+
+def new_trace_id():
+    """
+    Returns a new random trace id.
+
+    @rtype:  str
+    @return: A 32 character hex string.
+    """
+    return '%032x' % random.getrandbits(128)
+
+def new_span_id():
+    """
+    Returns a new random span id.
+
+    @rtype:  str
+    @return: A 16 character hex string.
+    """
+    return '%016x' % random.getrandbits(64)
+
+class Span(object):
+    """
+    A named, timed operation within a trace. Spans are picklable, so
+    they may be created in a child process and exported by the parent.
+    """
+
+    def __init__(self,
+                 name,
+                 trace_id  = None,
+                 parent_id = None,
+                 span_id   = None,
+                 start     = None,
+                 **attributes):
+        """
+        Constructor. The span starts immediately, unless a start time
+        is given.
+
+        @type  name: str
+        @param name: A name for the operation.
+        @type  trace_id: str
+        @param trace_id: The trace to which the span belongs, or None to
+            start a new trace.
+        @type  parent_id: str
+        @param parent_id: The id of the parent span, if any.
+        @type  span_id: str
+        @param span_id: The id of the span; a new id is created by default.
+        @type  start: float
+        @param start: The start time, defaults to the current time.
+        @type  attributes: dict
+        @param attributes: Any additional information on the span.
+        """
+        self.name       = name
+        self.trace_id   = trace_id or new_trace_id()
+        self.parent_id  = parent_id
+        self.span_id    = span_id or new_span_id()
+        self.start      = start
+        self.end        = None
+        self.attributes = attributes
+        self.children   = []
+        if start is None:
+            self.start = time.time()
+
+    def __repr__(self):
+        return '<Span %s %s/%s>' % (self.name, self.trace_id, self.span_id)
+
+    def get_context(self):
+        """
+        Returns the ids that are needed to create child spans, e.g. in
+        a different process.
+
+        @rtype:  (str, str)
+        @return: A tuple containing the trace id and span id.
+        """
+        return self.trace_id, self.span_id
+
+    def create_child(self, name, start = None, **attributes):
+        """
+        Creates and returns a new span whose parent is this span.
+        The child is exported together with this span.
+
+        @type  name: str
+        @param name: A name for the operation.
+        @type  start: float
+        @param start: The start time, defaults to the current time.
+        @type  attributes: dict
+        @param attributes: Any additional information on the span.
+        @rtype:  Span
+        @return: The new span.
+        """
+        child = Span(name,
+                     self.trace_id,
+                     self.span_id,
+                     start = start,
+                     **attributes)
+        self.children.append(child)
+        return child
+
+    def set_attribute(self, name, value):
+        """
+        Adds information to the span.
+
+        @type  name: str
+        @param name: The name of the attribute.
+        @type  value: object
+        @param value: A JSON serializable value.
+        """
+        self.attributes[name] = value
+
+    def finish(self, end = None):
+        """
+        Marks the span as completed. Children that are still open are
+        finished as well.
+
+        @type  end: float
+        @param end: The end time, defaults to the current time.
+        """
+        if end is None:
+            end = time.time()
+        self.end = end
+        for child in self.children:
+            if child.end is None:
+                child.finish(end)
+
+    def get_duration(self):
+        """
+        Returns the duration of the span in seconds, or None if the span
+        was not finished.
+
+        @rtype:  float|None
+        @return: The duration.
+        """
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def todict(self):
+        """
+        Returns the span (without children) as a flat dictionary.
+
+        @rtype:  dict
+        @return: A dictionary representing the span.
+        """
+        return dict(name       = self.name,
+                    trace_id   = self.trace_id,
+                    span_id    = self.span_id,
+                    parent_id  = self.parent_id,
+                    start      = self.start,
+                    end        = self.end,
+                    duration   = self.get_duration(),
+                    attributes = self.attributes)
+
+class FileExporter(object):
+    """
+    Appends every exported span to a file, as one JSON object per line.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructor.
+
+        @type  filename: str
+        @param filename: The name of the output file.
+        """
+        self.filename = filename
+        self.lock     = threading.Lock()
+
+    def export(self, span):
+        """
+        Writes the given span to the file.
+
+        @type  span: Span
+        @param span: The span to export.
+        """
+        line = json.dumps(span.todict(), sort_keys = True) + '\n'
+        with self.lock:
+            with open(self.filename, 'a') as fp:
+                fp.write(line)
+
+def set_exporter(exporter):
+    """
+    Defines the object that receives finished spans. The exporter must
+    implement an export(span) method. Passing None disables tracing
+    output.
+
+    @type  exporter: object
+    @param exporter: The exporter, e.g. a L{FileExporter}.
+    """
+    global _exporter
+    _exporter = exporter
+
+def get_exporter():
+    """
+    Returns the exporter that was defined using set_exporter(), or None.
+
+    @rtype:  object
+    @return: The exporter.
+    """
+    return _exporter
+
+def export(span):
+    """
+    Passes the given span and all of its children to the current
+    exporter. Does nothing if no exporter was defined.
+
+    @type  span: Span
+    @param span: The span to export.
+    """
+    if _exporter is None:
+        return
+    _exporter.export(span)
+    for child in span.children:
+        export(child)
@@ -70,6 +70,14 @@ class Pipeline(object):
             return self.id2item[item_id]
         return None
 
+    def get_from_id(self, item_id):
+        """
+        Returns the item with the given id, or None if no such item
+        is known.
+        """
+        with self.condition:
+            return self.id2item.get(item_id)
+
     def has_id(self, item_id):
         """
         Returns True if the queue contains an item with the given id.
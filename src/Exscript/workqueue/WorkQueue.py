@@ -287,6 +287,18 @@ class WorkQueue(object):
             return True
         return self.collection.paused
 
+    def get_job_from_id(self, job_id):
+        """
+        Returns the job with the given id, or None if the job is not
+        queued or running.
+
+        @type  job_id: str
+        @param job_id: The id of the job.
+        @rtype:  Job|None
+        @return: The job with the given id.
+        """
+        return self.collection.get_from_id(job_id)
+
     def get_running_jobs(self):
         """
         Returns a list of all jobs that are currently in progress.
@@ -15,47 +15,177 @@
 """
 Places orders and requests the status from a server.
 """
+import os
 import json
-#HACK: the return value of opener.open(url) does not support
-# __enter__ and __exit__ for Python's "with" in older versions
-# of Python.
-import urllib
-urllib.addinfourl.__enter__ = lambda x: x
-urllib.addinfourl.__exit__ = lambda s, *x: s.close()
-#END HACK
+import gzip
+import socket
+from StringIO import StringIO
+from httplib import HTTPConnection, HTTPException, BadStatusLine
+from threading import Lock
 from datetime import datetime
 from urllib import urlencode
-from urllib2 import HTTPDigestAuthHandler, build_opener, HTTPError
+from urllib2 import parse_http_list, parse_keqv_list
 from lxml import etree
-from Exscript.servers.HTTPd import default_realm
+from Exscript.servers.HTTPd import default_realm, md5hex
 from Exscriptd.Order import Order
 from Exscriptd.Task import Task
 
+def _parse_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    timestamp = timestamp.split('.', 1)[0]
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+
+class _ConnectionPool(object):
+    """
+    Keeps idle HTTP/1.1 connections to the server open for reuse.
+    """
+
+    def __init__(self, host, max_idle = 10):
+        self.host     = host
+        self.max_idle = max_idle
+        self.idle     = []
+        self.lock     = Lock()
+
+    def acquire(self):
+        """
+        Returns a tuple (connection, reused).
+        """
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return HTTPConnection(self.host), False
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
 class Client(object):
     """
     An Exscriptd client that communicates via HTTP.
+    Connections to the server are kept open and reused, and the
+    HTTP/Digest nonce of the server is cached, so that each call
+    normally takes a single round trip. A client may be shared between
+    threads.
     """
 
-    def __init__(self, address, user, password):
+    def __init__(self, address, user, password, max_connections = 10):
         """
         Constructor. Any operations performed with an
         instance of a client are directed to the server with the
         given address, using the given login data.
 
         @type  address: str
-        @param address: The base url of the server.
+        @param address: The address of the server, e.g. 'localhost:8123'.
         @type  user: str
         @param user: The login name on the server.
         @type  password: str
         @param password: The password of the user.
+        @type  max_connections: int
+        @param max_connections: The maximum number of idle connections
+            that are kept open.
+        """
+        self.address     = address
+        self.user        = user
+        self.password    = password
+        self.pool        = _ConnectionPool(address, max_connections)
+        self.auth_lock   = Lock()
+        self.realm       = default_realm
+        self.nonce       = None
+        self.nonce_count = 0
+
+    def _get_authorization(self, method, path):
+        with self.auth_lock:
+            if self.nonce is None:
+                return None
+            self.nonce_count += 1
+            nonce = self.nonce
+            count = '%08x' % self.nonce_count
+        cnonce   = md5hex(os.urandom(8))
+        pwhash   = md5hex('%s:%s:%s' % (self.user, self.realm, self.password))
+        location = md5hex('%s:%s' % (method, path))
+        info     = pwhash, nonce, count, cnonce, 'auth', location
+        response = md5hex(':'.join(info))
+        return 'Digest username="%s", realm="%s", nonce="%s", uri="%s", ' \
+               'response="%s", algorithm="MD5", qop=auth, nc=%s, ' \
+               'cnonce="%s"' % (self.user,
+                                self.realm,
+                                nonce,
+                                path,
+                                response,
+                                count,
+                                cnonce)
+
+    def _set_challenge(self, header):
+        token, fields = header.split(' ', 1)
+        challenge     = parse_keqv_list(parse_http_list(fields))
+        with self.auth_lock:
+            self.realm       = challenge.get('realm', self.realm)
+            self.nonce       = challenge.get('nonce')
+            self.nonce_count = 0
+        return challenge.get('stale', '').lower() == 'true'
+
+    def _send(self, method, path, body, headers):
+        # A connection that was idle may have been closed by the server
+        # in the meantime, in which case the request is repeated with
+        # a new connection. To avoid placing an order twice, POST
+        # requests are only repeated if the server did not respond.
+        while True:
+            conn, reused = self.pool.acquire()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                data     = response.read()
+            except (HTTPException, socket.error), e:
+                conn.close()
+                if reused and (method == 'GET' or isinstance(e, BadStatusLine)):
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.pool.release(conn)
+            return response, data
+
+    def _request(self, path, body = None, content_type = None):
+        method  = body is None and 'GET' or 'POST'
+        headers = {'Accept-Encoding': 'gzip'}
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        # Send the request, using the cached nonce if there is one.
+        # If the server responds with a new nonce, try again.
+        for attempt in range(3):
+            auth = self._get_authorization(method, path)
+            if auth:
+                headers['Authorization'] = auth
+            response, data = self._send(method, path, body, headers)
+            if response.status != 401:
+                break
+            stale = self._set_challenge(response.getheader('WWW-Authenticate'))
+            if auth and not stale:
+                break # The credentials were rejected.
+
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.GzipFile(fileobj = StringIO(data)).read()
+        if response.status != 200:
+            raise Exception('HTTP error %d: %s' % (response.status, data))
+        return data
+
+    def close(self):
+        """
+        Closes all idle connections to the server.
         """
-        self.address = 'http://' + address
-        self.handler = HTTPDigestAuthHandler()
-        self.opener  = build_opener(self.handler)
-        self.handler.add_password(realm  = default_realm,
-                                  uri    = self.address,
-                                  user   = user,
-                                  passwd = password)
+        self.pool.close()
 
     def place_order(self, order):
         """
@@ -72,19 +202,9 @@ class Client(object):
             raise ValueError('incomplete or invalid order')
 
         order.status = 'accepted'
-        url          = self.address + '/order/'
-        xml          = order.toxml()
-        data         = urlencode({'xml': xml})
-        try:
-            with self.opener.open(url, data) as result:
-                if result.getcode() != 200:
-                    raise Exception(result.read())
-                order.id = json.loads(result.read())
-        except HTTPError, e:
-            if hasattr(e, 'read'):
-                raise Exception(str(e) + ' with ' + e.read())
-            else:
-                raise Exception(str(e))
+        xml          = order.toxml(pretty = False)
+        response     = self._request('/order/', xml, 'application/xml')
+        order.id     = json.loads(response)
 
     def get_order_from_id(self, id):
         """
@@ -95,12 +215,8 @@ class Client(object):
         @rtype:  Order
         @return: The order if it exists, None otherwise.
         """
-        args   = 'id=%d' % id
-        url    = self.address + '/order/get/?' + args
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            return Order.from_xml(result.read())
+        args = 'id=%d' % id
+        return Order.from_xml(self._request('/order/get/?' + args))
 
     def get_order_status_from_id(self, order_id):
         """
@@ -119,18 +235,74 @@ class Client(object):
         @rtype:  (str, float, datetime.timestamp)
         @return: The status and progress of the order.
         """
-        url = self.address + '/order/status/?id=%s' % order_id
-        with self.opener.open(url) as result:
-            response = result.read()
-            if result.getcode() != 200:
-                raise Exception(response)
-        data   = json.loads(response)
-        closed = data['closed']
-        if closed is not None:
-            closed = closed.split('.', 1)[0]
-            closed = datetime.strptime(closed, "%Y-%m-%d %H:%M:%S")
+        response = self._request('/order/status/?id=%s' % order_id)
+        data     = json.loads(response)
+        closed = _parse_timestamp(data['closed'])
         return data['status'], data['progress'], closed
 
+    def get_orders_status(self, order_ids):
+        """
+        Like L{get_order_status_from_id()}, but returns the status of
+        many orders at once, using one request per 1000 orders.
+        Orders that do not exist are not included in the result.
+
+        @type  order_ids: list[int]
+        @param order_ids: The ids of the orders.
+        @rtype:  dict(int, (str, float, datetime.timestamp))
+        @return: Maps each order id to the status tuple.
+        """
+        order_ids = list(order_ids)
+        result    = {}
+        for offset in range(0, len(order_ids), 1000):
+            ids      = order_ids[offset:offset + 1000]
+            ids      = ','.join(str(int(i)) for i in ids)
+            response = self._request('/order/status/?ids=' + ids)
+            for order_id, data in json.loads(response).iteritems():
+                closed = _parse_timestamp(data['closed'])
+                status = data['status'], data['progress'], closed
+                result[int(order_id)] = status
+        return result
+
+    def watch(self, order_id = None, since = None, timeout = 30):
+        """
+        Returns a generator that yields status changes of orders and
+        tasks as they happen, using a single long-polling connection
+        at a time. Each change is a dictionary containing the
+        following keys::
+
+            seq, type, id, order_id, status, closed
+
+        where 'type' is either 'order' or 'task', 'seq' is a sequence
+        number that may be passed as the "since" argument to resume
+        watching, and 'closed' is a datetime or None. Task changes
+        also include the 'progress'.
+        The generator never stops; the caller should simply stop
+        iterating once it has seen the changes it is interested in.
+
+        @type  order_id: int
+        @param order_id: Watch only the given order and its tasks.
+        @type  since: int
+        @param since: Return changes after the given sequence number.
+            By default, only changes that happen from now on are returned.
+        @type  timeout: int
+        @param timeout: The number of seconds after which an idle
+            request is renewed.
+        @rtype:  generator
+        @return: A generator yielding dictionaries.
+        """
+        while True:
+            args = {'timeout': timeout}
+            if since is not None:
+                args['since'] = since
+            if order_id is not None:
+                args['order_id'] = order_id
+            response = self._request('/events/?' + urlencode(args))
+            data     = json.loads(response)
+            since    = data['next']
+            for event in data['events']:
+                event['closed'] = _parse_timestamp(event['closed'])
+                yield event
+
     def count_orders(self,
                      order_id    = None,
                      service     = None,
@@ -156,11 +328,7 @@ class Client(object):
             args['status'] = status
         if created_by:
             args['created_by'] = created_by
-        url = self.address + '/order/count/?' + urlencode(args)
-        with self.opener.open(url) as result:
-            response = result.read()
-            if result.getcode() != 200:
-                raise Exception(response)
+        response = self._request('/order/count/?' + urlencode(args))
         return json.loads(response)
 
     def get_order_list(self,
@@ -170,7 +338,8 @@ class Client(object):
                        status      = None,
                        created_by  = None,
                        offset      = 0,
-                       limit       = 0):
+                       limit       = 0,
+                       before      = None):
         """
         Returns a list of currently running orders.
 
@@ -178,6 +347,10 @@ class Client(object):
         @param offset: The number of orders to skip.
         @type  limit: int
         @param limit: The maximum number of orders to return.
+        @type  before: int
+        @param before: Return only orders with a lower id. Passing the
+            id of the last order of the previous page is much faster
+            than using an offset.
         @type  kwargs: dict
         @param kwargs: The following keys may be used:
                          - order_id - the order id (str)
@@ -189,6 +362,8 @@ class Client(object):
         @return: A list of orders.
         """
         args = {'offset': offset, 'limit': limit}
+        if before is not None:
+            args['before'] = before
         if order_id:
             args['order_id'] = order_id
         if service:
@@ -199,11 +374,8 @@ class Client(object):
             args['status'] = status
         if created_by:
             args['created_by'] = created_by
-        url = self.address + '/order/list/?' + urlencode(args)
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            xml = etree.parse(result)
+        response = self._request('/order/list/?' + urlencode(args))
+        xml      = etree.fromstring(response)
         return [Order.from_etree(n) for n in xml.iterfind('order')]
 
     def count_tasks(self, order_id = None):
@@ -216,14 +388,10 @@ class Client(object):
         args = ''
         if order_id:
             args += '?order_id=%d' % order_id
-        url = self.address + '/task/count/' + args
-        with self.opener.open(url) as result:
-            response = result.read()
-            if result.getcode() != 200:
-                raise Exception(response)
+        response = self._request('/task/count/' + args)
         return json.loads(response)
 
-    def get_task_list(self, order_id, offset = 0, limit = 0):
+    def get_task_list(self, order_id, offset = 0, limit = 0, before = None):
         """
         Returns a list of currently running orders.
 
@@ -231,15 +399,17 @@ class Client(object):
         @param offset: The number of orders to skip.
         @type  limit: int
         @param limit: The maximum number of orders to return.
+        @type  before: int
+        @param before: Return only tasks with a lower id, see
+            L{get_order_list()}.
         @rtype:  list[Order]
         @return: A list of orders.
         """
         args = 'order_id=%d&offset=%d&limit=%d' % (order_id, offset, limit)
-        url  = self.address + '/task/list/?' + args
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            xml = etree.parse(result)
+        if before is not None:
+            args += '&before=%d' % before
+        response = self._request('/task/list/?' + args)
+        xml      = etree.fromstring(response)
         return [Task.from_etree(n) for n in xml.iterfind('task')]
 
     def get_task_from_id(self, id):
@@ -252,11 +422,7 @@ class Client(object):
         @return: The task with the given id.
         """
         args = 'id=%d' % id
-        url  = self.address + '/task/get/?' + args
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            return Task.from_xml(result.read())
+        return Task.from_xml(self._request('/task/get/?' + args))
 
     def get_log_from_task_id(self, task_id):
         """
@@ -268,11 +434,7 @@ class Client(object):
         @return: The file content.
         """
         args = 'task_id=%d' % task_id
-        url  = self.address + '/log/?' + args
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            return result.read()
+        return self._request('/log/?' + args)
 
     def get_trace_from_task_id(self, task_id):
         """
@@ -284,8 +446,4 @@ class Client(object):
         @return: The file content.
         """
         args = 'task_id=%d' % task_id
-        url  = self.address + '/trace/?' + args
-        with self.opener.open(url) as result:
-            if result.getcode() != 200:
-                raise Exception(response)
-            return result.read()
+        return self._request('/trace/?' + args)
@@ -18,6 +18,7 @@ import shutil
 import logging
 import logging.handlers
 from functools import partial
+from datetime import timedelta
 from lxml import etree
 from Exscript import Queue
 from Exscript.AccountPool import AccountPool
@@ -25,6 +26,7 @@ from Exscript.util.file import get_accounts_from_file
 from Exscriptd.OrderDB import OrderDB
 from Exscriptd.HTTPDaemon import HTTPDaemon
 from Exscriptd.Service import Service
+from Exscriptd.Retention import Retention
 from Exscriptd.ConfigReader import ConfigReader
 from Exscriptd.util import find_module_recursive
 from Exscriptd.xml import get_accounts_from_etree, add_accounts_to_etree
@@ -113,8 +115,9 @@ class Config(ConfigReader):
         self.save()
         return True
 
-    def get_queues(self):
-        names = [e.get('name') for e in self.cfgtree.iterfind('queue')]
+    def get_queues(self, names = None):
+        if names is None:
+            names = [e.get('name') for e in self.cfgtree.iterfind('queue')]
         return dict((name, self._init_queue_from_name(name))
                     for name in names)
 
@@ -200,12 +203,24 @@ class Config(ConfigReader):
                 return file
         return None
 
-    def _init_service_file(self, filename, dispatcher):
+    def get_service_names(self):
+        """
+        Returns the names of all services, without loading them.
+        """
+        names = []
+        for file in self._get_service_files():
+            cfgtree = ConfigReader(file).cfgtree
+            names  += [e.get('name') for e in cfgtree.iterfind('service')]
+        return names
+
+    def _init_service_file(self, filename, dispatcher, match = None):
         services    = []
         service_dir = os.path.dirname(filename)
         cfgtree     = ConfigReader(filename).cfgtree
         for element in cfgtree.iterfind('service'):
             name = element.get('name')
+            if match is not None and not match(name):
+                continue
             print 'Loading service "%s"...' % name
 
             module     = element.find('module').text
@@ -221,10 +236,15 @@ class Config(ConfigReader):
             services.append(service)
         return services
 
-    def get_services(self, dispatcher):
+    def get_services(self, dispatcher, match = None):
+        """
+        Loads the services. If a match function is given, only services
+        for which it returns True are loaded; it is passed the name of
+        the service.
+        """
         services = []
         for file in self._get_service_files():
-            services += self._init_service_file(file, dispatcher)
+            services += self._init_service_file(file, dispatcher, match)
         return services
 
     def has_account_pool(self, name):
@@ -275,6 +295,32 @@ class Config(ConfigReader):
         dbn     = element.find('dbn').text
         return self._init_database_from_dbn(dbn)
 
+    def get_retention(self, order_db, logger):
+        """
+        Returns a Retention job as configured in the <retention> section,
+        or None if the section does not exist.
+        """
+        element = self.cfgtree.find('exscriptd/retention')
+        if element is None:
+            return None
+        max_age     = element.findtext('max-age')
+        max_orders  = element.findtext('max-orders')
+        archive_dir = element.findtext('archive-dir')
+        interval    = element.findtext('interval')
+        vacuum      = element.findtext('vacuum', 'false')
+        if max_age is not None:
+            max_age = timedelta(days = float(max_age))
+        if max_orders is not None:
+            max_orders = int(max_orders)
+        return Retention(order_db,
+                         logger,
+                         max_age     = max_age,
+                         max_orders  = max_orders,
+                         archive_dir = archive_dir,
+                         logdir      = self.logdir,
+                         interval    = int(interval or 3600),
+                         vacuum      = vacuum.strip().lower() == 'true')
+
     @cache_result
     def get_order_db(self):
         db_elem = self.cfgtree.find('exscriptd/order-db')
@@ -16,9 +16,12 @@ import os
 import logging
 from functools import partial
 from collections import defaultdict
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
+from Exscript.util import trace
+from Exscript.util.trace import Span
 from Exscriptd.util import synchronized
 from Exscriptd import Task
+from Exscriptd.EventFeed import EventFeed
 
 class _AsyncFunction(Thread):
     def __init__ (self, function, *args, **kwargs):
@@ -30,18 +33,97 @@ class _AsyncFunction(Thread):
     def run(self):
         self.function(*self.args, **self.kwargs)
 
+class _TaskWriter(Thread):
+    """
+    Collects changes to tasks in memory and periodically writes them to
+    the database in bulk. Multiple changes to the same task are coalesced,
+    so only the latest value of each field is written.
+    Changes that close a task are flushed immediately by the dispatcher;
+    everything else is lost at most if the daemon crashes, in which case
+    close_open_orders() closes the affected tasks on restart.
+    """
+    def __init__(self, order_db, interval):
+        Thread.__init__(self)
+        self.daemon     = True
+        self.order_db   = order_db
+        self.interval   = interval
+        self.lock       = Lock()
+        self.flush_lock = Lock()
+        self.changes    = {} # map task id to changed fields
+        self.stopped    = Event()
+
+    def update(self, task, *fields):
+        with self.lock:
+            changes = self.changes.setdefault(task.id, {})
+            for field in fields:
+                changes[field] = getattr(task, field)
+
+    def flush(self):
+        # The flush lock ensures that batches are written in order.
+        with self.flush_lock:
+            with self.lock:
+                changes, self.changes = self.changes, {}
+            if changes:
+                self.order_db.update_tasks(changes)
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.stopped.wait(self.interval)
+            self.flush()
+
 class Dispatcher(object):
-    def __init__(self, order_db, queues, logger, logdir):
+    task_fields = ('job_id',
+                   'name',
+                   'status',
+                   'progress',
+                   'closed',
+                   'logfile',
+                   'tracefile')
+
+    def __init__(self,
+                 order_db,
+                 queues,
+                 logger,
+                 logdir,
+                 flush_interval    = .5,
+                 close_open_orders = True):
         self.order_db = order_db
         self.queues   = {}
         self.logger   = logger
         self.loggers  = defaultdict(list) # map order id to loggers
         self.logdir   = logdir
-        self.lock     = Lock()
         self.services = {}
         self.daemons  = {}
-        self.logger.info('Closing all open orders.')
-        self.order_db.close_open_orders()
+        self.spans    = {} # map order and task ids to trace spans
+        self.feed     = EventFeed()
+
+        # In-memory index of the orders and tasks that are still open.
+        # Entries are removed when the task or order is closed.
+        self.index_lock  = Lock()
+        self.orders      = {}                # map order id to order
+        self.tasks       = {}                # map job id to task
+        self.order_tasks = defaultdict(list) # map order id to tasks
+        self.open_tasks  = defaultdict(set)  # map order id to open task ids
+
+        # Events of jobs that were enqueued while an order is entered,
+        # but that are not yet bound to a task.
+        self.entering    = defaultdict(int)  # map queue name to number
+                                             # of orders being entered
+        self.unbound     = defaultdict(list) # map job id to job events
+        self.updates     = defaultdict(dict) # map job id to task fields
+        self.binding     = set()             # ids of jobs being bound
+        # Orders that were open when the daemon was stopped are never
+        # completed. If the database is shared with other dispatchers,
+        # this is the job of the supervisor.
+        if close_open_orders:
+            self.logger.info('Closing all open orders.')
+            self.order_db.close_open_orders()
+        self.writer   = _TaskWriter(order_db, flush_interval)
+        self.writer.start()
 
         if not os.path.isdir(logdir):
             os.makedirs(logdir)
@@ -68,16 +150,16 @@ class Dispatcher(object):
                                              name,
                                              'aborted'))
 
-    def _set_task_status(self, job_id, queue_name, status):
+    def _set_task_status(self, task, job_id, queue_name, status):
         # Log the status change.
-        task = self.order_db.get_task(job_id = job_id)
-        msg  = '%s/%s: %s' % (queue_name, job_id, status)
+        msg = '%s/%s: %s' % (queue_name, job_id, status)
         if task is None:
             self.logger.info(msg + ' (untracked)')
             return
         self.logger.info(msg + ' (order id ' + str(task.order_id) + ')')
 
-        # Update the task in the database.
+        # Update the task. The change is written to the database in
+        # the background, see _on_task_changed().
         if status == 'succeeded':
             task.completed()
         elif status == 'started':
@@ -86,25 +168,117 @@ class Dispatcher(object):
             task.close(status)
         else:
             task.set_status(status)
-        self.order_db.save_task(task)
 
-        # Check whether the order can now be closed.
-        if task.get_closed_timestamp() is not None:
-            order = self.order_db.get_order(id = task.order_id)
-            self._update_order_status(order)
+        # Notify clients that are watching the feed.
+        self.feed.publish('task',
+                          id       = task.id,
+                          order_id = task.order_id,
+                          status   = task.get_status(),
+                          progress = task.get_progress(),
+                          closed   = task.get_closed_timestamp())
 
     def _on_job_event(self, queue_name, status, job, *args):
-        self._set_task_status(job.id, queue_name, status)
+        with self.index_lock:
+            task = self.tasks.get(job.id)
+
+            # A service may still be about to bind the job to its task,
+            # so the event is handled once the task is known.
+            if task is None and (self._is_entering(queue_name)
+                                 or job.id in self.binding):
+                self.unbound[job.id].append((queue_name, status, job))
+                return
+        self._handle_job_event(task, queue_name, status, job)
+
+    def _handle_job_event(self, task, queue_name, status, job):
+        self._set_task_status(task, job.id, queue_name, status)
+
+    def _attach_trace(self, task):
+        # Pass the trace context to the job as soon as it is bound to
+        # the task, so that the job's spans become children of the
+        # task's span. Jobs are usually bound right after they were
+        # enqueued, so they have not yet been started.
+        if task.trace_id is None:
+            return
+        for queue in self.queues.itervalues():
+            job = queue.workqueue.get_job_from_id(task.job_id)
+            if job is None:
+                continue
+            if job.data is None:
+                job.data = {}
+            job.data['trace'] = task.trace_id, task.span_id
+            return
+
+    def _bind_job(self, task):
+        job_id = task.job_id
+        with self.index_lock:
+            if job_id in self.binding or self.tasks.get(job_id) is task:
+                return
+            self.binding.add(job_id)
+        self._attach_trace(task)
+
+        # Replay the events that the job emitted before it was bound.
+        # Events that arrive in the meantime are queued until the
+        # task is indexed, so they are handled in order.
+        while True:
+            with self.index_lock:
+                events = self.unbound.pop(job_id, None)
+                if not events:
+                    self.binding.remove(job_id)
+                    updates = self.updates.pop(job_id, {})
+                    for field, value in updates.iteritems():
+                        self._set_task_field(task, field, value)
+                    if task.get_closed_timestamp() is None:
+                        self.tasks[job_id] = task
+                    return
+            for queue_name, status, job in events:
+                self._handle_job_event(task, queue_name, status, job)
+
+    def _is_entering(self, queue_name):
+        # Services without a queue may enqueue jobs into any queue.
+        return self.entering[None] or self.entering[queue_name]
+
+    def _drop_unbound_jobs(self):
+        # Events of jobs in queues that no order is being entered into
+        # can no longer be bound.
+        unbound = []
+        with self.index_lock:
+            for job_id, events in self.unbound.items():
+                if not self._is_entering(events[0][0]):
+                    unbound.append(self.unbound.pop(job_id))
+                    self.updates.pop(job_id, None)
+        for events in unbound:
+            for queue_name, status, job in events:
+                self._handle_job_event(None, queue_name, status, job)
+
+    def _finish_span(self, key, status):
+        span = self.spans.pop(key, None)
+        if span is None:
+            return
+        span.set_attribute('status', status)
+        span.finish()
+        trace.export(span)
+
+    def _set_task_field(self, task, field, value):
+        getattr(task, 'set_' + field)(value)
+        self.writer.update(task, field)
+
+    def _set_job_field(self, job_id, field, value):
+        with self.index_lock:
+            task = self.tasks.get(job_id)
+
+            # Changes of jobs that are not yet bound to their task are
+            # applied when the job is bound.
+            if task is None:
+                if job_id in self.unbound or job_id in self.binding:
+                    self.updates[job_id][field] = value
+                return
+        self._set_task_field(task, field, value)
 
     def set_job_name(self, job_id, name):
-        task = self.order_db.get_task(job_id = job_id)
-        task.set_name(name)
-        self.order_db.save_task(task)
+        self._set_job_field(job_id, 'name', name)
 
     def set_job_progress(self, job_id, progress):
-        task = self.order_db.get_task(job_id = job_id)
-        task.set_progress(progress)
-        self.order_db.save_task(task)
+        self._set_job_field(job_id, 'progress', progress)
 
     def get_order_logdir(self, order):
         orders_logdir = os.path.join(self.logdir, 'orders')
@@ -159,38 +333,116 @@ class Dispatcher(object):
     def get_order_db(self):
         return self.order_db
 
+    def flush(self):
+        """
+        Writes all pending task changes to the database.
+        """
+        self.writer.flush()
+
+    def shutdown(self):
+        """
+        Stops writing task changes in the background, after writing
+        all pending changes to the database.
+        """
+        self.writer.stop()
+
     def _update_order_status(self, order):
-        remaining = self.order_db.count_tasks(order_id = order.id,
-                                              closed   = None)
-        if remaining == 0:
-            total = self.order_db.count_tasks(order_id = order.id)
-            if total == 1:
-                task = self.order_db.get_task(order_id = order.id)
-                order.set_description(task.get_name())
-            order.close()
-            self.set_order_status(order, 'completed')
-            for logger in self.loggers.pop(order.get_id(), []):
-                self._free_logger(logger)
+        with self.index_lock:
+            if self.open_tasks.get(order.id):
+                return
+            self.open_tasks.pop(order.id, None)
+            tasks = self.order_tasks.pop(order.id, [])
+            if self.orders.pop(order.id, None) is None:
+                return # Not yet running, or already completed.
+
+        if len(tasks) == 1:
+            order.set_description(tasks[0].get_name())
+
+        # Make sure that the tasks are up to date in the database
+        # before the order is marked completed.
+        self.writer.flush()
+        order.close()
+        self.set_order_status(order, 'completed')
+        for logger in self.loggers.pop(order.get_id(), []):
+            self._free_logger(logger)
+
+    def _task_closed(self, task):
+        with self.index_lock:
+            self.tasks.pop(task.job_id, None)
+            open_tasks = self.open_tasks.get(task.order_id)
+            if open_tasks is None or task.id not in open_tasks:
+                return
+            open_tasks.remove(task.id)
+            order = self.orders.get(task.order_id)
+        self._finish_span(('task', task.id), task.get_status())
+
+        # Check whether the order can now be closed.
+        if order is not None:
+            self._update_order_status(order)
 
     def _on_task_changed(self, task):
-        self.order_db.save_task(task)
+        if task.id is None:
+            self.order_db.save_task(task)
+            return
+        if task.job_id is not None:
+            self._bind_job(task)
+        self.writer.update(task, *self.task_fields)
+        if task.get_closed_timestamp() is not None:
+            self.writer.flush()
+            self._task_closed(task)
 
     def create_task(self, order, name):
-        task = Task(order.id, name)
-        task.changed_event.listen(self._on_task_changed)
-        self.order_db.save_task(task)
-        return task
+        return self.create_tasks(order, [name])[0]
+
+    def create_tasks(self, order, names):
+        """
+        Like create_task(), but creates one task for each of the given
+        names, saving all of them in a single transaction.
+        """
+        tasks = []
+        spans = []
+        for name in names:
+            span = Span('task',
+                        order.get_trace_id(),
+                        order.get_span_id(),
+                        task = name)
+            task = Task(order.id, name)
+            task.trace_id, task.span_id = span.get_context()
+            task.changed_event.listen(self._on_task_changed)
+            tasks.append(task)
+            spans.append(span)
+        self.order_db.add_tasks(tasks)
+
+        for task, span in zip(tasks, spans):
+            self.spans[('task', task.id)] = span
+        with self.index_lock:
+            self.order_tasks[order.id] += tasks
+            self.open_tasks[order.id].update(task.id for task in tasks)
+        return tasks
 
     def set_order_status(self, order, status):
         order.status = status
         self.order_db.save_order(order)
         self.log(order, 'Status is now "%s"' % status)
+        self.feed.publish('order',
+                          id       = order.id,
+                          order_id = order.id,
+                          status   = status,
+                          closed   = order.get_closed_timestamp())
+        if order.get_closed_timestamp() is not None:
+            self._finish_span(('order', order.id), status)
 
     def place_order(self, order, daemon_name):
         self.logger.debug('Incoming order from ' + daemon_name)
+        span = Span('order',
+                    order.get_trace_id(),
+                    span_id = order.get_span_id(),
+                    service = order.get_service_name())
 
         # Store it in the database.
         self.set_order_status(order, 'incoming')
+        self.spans[('order', order.id)] = span
+        span.set_attribute('order_id', order.id)
 
         # Loop the requested service up.
         service = self.services.get(order.get_service_name())
@@ -200,6 +452,7 @@ class Dispatcher(object):
             return
 
         # Notify the service of the new order.
+        check_span = span.create_child('check')
         try:
             accepted = service.check(order)
         except Exception, e:
@@ -207,6 +460,8 @@ class Dispatcher(object):
             order.close()
             self.set_order_status(order, 'error')
             raise
+        finally:
+            check_span.finish()
 
         if not accepted:
             order.close()
@@ -226,25 +481,32 @@ class Dispatcher(object):
         self.order_db.save_order(order)
 
         self.set_order_status(order, 'starting')
-        with self.lock:
-            # We must stop the queue while new jobs are placed,
-            # else the queue might start processing a job before
-            # it was attached to a task.
-            for queue in self.queues.itervalues():
-                queue.workqueue.pause()
-
-            try:
-                service.enter(order)
-            except Exception, e:
-                self.log(order, 'Exception: %s' % e)
-                order.close()
-                self.set_order_status(order, 'error')
-                raise
-            finally:
-                # Re-enable the workqueue.
-                for queue in self.queues.itervalues():
-                    queue.workqueue.unpause()
+        span       = self.spans.get(('order', order.id))
+        enter_span = span and span.create_child('enter')
+
+        # Jobs may start as soon as they are enqueued, possibly before
+        # the service has attached them to a task. Events of such jobs
+        # are held back until the job is bound, see _bind_job().
+        # Only events from the queue of the service are held back.
+        queue_name = service.get_queue_name()
+        with self.index_lock:
+            self.entering[queue_name] += 1
+        try:
+            service.enter(order)
+        except Exception, e:
+            self.log(order, 'Exception: %s' % e)
+            order.close()
+            self.set_order_status(order, 'error')
+            raise
+        finally:
+            with self.index_lock:
+                self.entering[queue_name] -= 1
+            self._drop_unbound_jobs()
+            if enter_span is not None:
+                enter_span.finish()
         self.set_order_status(order, 'running')
+        with self.index_lock:
+            self.orders[order.id] = order
 
         # If the service did not enqueue anything, it may already be completed.
         self._update_order_status(order)
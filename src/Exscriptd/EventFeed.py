@@ -0,0 +1,127 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+An in-memory feed of order and task status changes.
+"""
+import time
+from itertools import islice
+from collections import deque
+from threading import Condition
+
+class EventFeed(object):
+    """
+    Keeps the most recent status changes in a bounded buffer. Each event
+    is a dictionary that is assigned a sequence number ('seq'), so that
+    clients can wait for new events and resume reading where they left
+    off without querying the database.
+    """
+
+    def __init__(self, maxlen = 10000):
+        """
+        Constructor.
+
+        @type  maxlen: int
+        @param maxlen: The maximum number of events that are kept.
+        """
+        self.events    = deque(maxlen = maxlen)
+        self.last_seq  = 0
+        self.condition = Condition()
+
+    def publish(self, type, **data):
+        """
+        Appends an event to the feed and wakes up all waiting readers.
+
+        @type  type: str
+        @param type: The type of the event, e.g. 'order' or 'task'.
+        @type  data: dict
+        @param data: The attributes of the event.
+        @rtype:  int
+        @return: The sequence number of the event.
+        """
+        with self.condition:
+            self.last_seq += 1
+            data['seq']    = self.last_seq
+            data['type']   = type
+            self.events.append(data)
+            self.condition.notify_all()
+            return self.last_seq
+
+    def get_last_seq(self):
+        """
+        Returns the sequence number of the most recent event, or 0 if
+        no events were published yet.
+
+        @rtype:  int
+        @return: The sequence number.
+        """
+        return self.last_seq
+
+    def _get_events_since(self, since):
+        # Sequence numbers are contiguous, so the position of the first
+        # event can be computed. If the reader fell behind, events that
+        # were already dropped are skipped.
+        if not self.events:
+            return []
+        first = self.events[0]['seq']
+        return list(islice(self.events, max(0, since + 1 - first), None))
+
+    def get_events(self, since = None, timeout = 0, limit = None, **kwargs):
+        """
+        Returns all events with a sequence number higher than the given
+        one. If there are no such events, this method blocks until one
+        is published or until the timeout expires.
+        Also returns a cursor that is passed as the "since" argument of
+        the next call. If "since" is None, no events are returned and
+        the cursor points to the most recent event.
+
+        If the given cursor is ahead of the feed (because the daemon
+        was restarted), all events in the buffer are returned. If it
+        is too old, the oldest events that were dropped are skipped;
+        the reader may detect this by comparing sequence numbers.
+
+        @type  since: int
+        @param since: The sequence number of the last event that was read.
+        @type  timeout: float
+        @param timeout: The maximum number of seconds to wait.
+        @type  limit: int
+        @param limit: The maximum number of events to return.
+        @type  kwargs: dict
+        @param kwargs: Return only events that have all of the given
+            attributes, e.g. order_id = 1234.
+        @rtype:  (list[dict], int)
+        @return: A tuple containing the events and the new cursor.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            if since is None:
+                return [], self.last_seq
+            if since > self.last_seq:
+                since = 0
+            while True:
+                events = self._get_events_since(since)
+                since  = self.last_seq
+                events = [e for e in events
+                          if all(e.get(k) == v for k, v in kwargs.iteritems())]
+                if events:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return [], since
+                self.condition.wait(remaining)
+
+        if limit is not None and len(events) > limit:
+            events = events[:limit]
+            since  = events[-1]['seq']
+        return events, since
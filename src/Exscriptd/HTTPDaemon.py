@@ -14,50 +14,156 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import os
 import json
+import gzip
 import logging
+from datetime import datetime
+from StringIO import StringIO
 from traceback import format_exc
 from urlparse import parse_qs
 from lxml import etree
 from Exscript import Host
 from Exscript.servers.HTTPd import HTTPd, RequestHandler
 from Exscript.util.event import Event
+from Exscript.util import metrics
 from Exscriptd.Order import Order
 
 """
 URL list:
 
   Path                            Method  Function
-  order/                          POST    Place an XML formatted order
+  order/                          POST    Place an XML formatted order, either
+                                          as the 'xml' form field or as the
+                                          request body (Content-Type
+                                          application/xml, may be chunked).
+                                          Larger bodies than the server's
+                                          max_body_size are rejected (413)
   order/get/?id=1234              GET     Returns order 1234
   order/status/?id=1234           GET     Status and progress for order 1234
+  order/status/?ids=1234,1235     GET     Status and progress for a list of
+                                          orders, mapped by order id
   order/count/                    GET     Get the total number of orders
   order/count/?service=grabber    GET     Number of orders matching the name
   order/list/?offset=10&limit=25  GET     Get a list of orders
   order/list/?service=grabber     GET     Filter list of orders by service name
   order/list/?description=foobar  GET     Filter list of orders by description
   order/list/?status=completed    GET     Filter list of orders by status
+  order/list/?before=1234         GET     Orders with an id lower than 1234
+  order/list/?created_after=2010-01-01
+                                  GET     Filter list of orders by time range;
+                                          also created_before, closed_after
+                                          and closed_before
+  order/list/?format=json         GET     Get the list of orders as JSON
   task/get/?id=1234               GET     Returns task 1234
   task/count/?order_id=1234       GET     Get the number of tasks for order 1234
-  task/list/?order_id=1234        GET     Get a list of tasks for order 1234
+  task/list/?order_id=1234        GET     Get a list of tasks for order 1234;
+                                          supports the same pagination, time
+                                          range (started, closed) and format
+                                          arguments as order/list/
   log/?task_id=4567               GET     Returns the content of the logfile
   trace/?task_id=4567             GET     Returns the content of the trace file
+  events/?since=5678&timeout=30   GET     Waits for order and task status
+                                          changes after the given cursor
+  events/?order_id=1234           GET     Status changes of order 1234 only
+  metrics                         GET     Queue metrics in Prometheus format
   services/                       GET     Service overview   (not implemented)
   services/foo/                   GET     Get info for the "foo" service   (not implemented)
 
+Lists are sorted by id in descending order. To fetch the next page, pass
+the id of the last item as the "before" argument; JSON lists include it
+as "next". Responses are gzip compressed if the client accepts it.
+
+The events/ call returns a JSON object containing the list of "events"
+and the "next" cursor. It returns as soon as events are available, or
+with an empty list when the timeout expires. Without a "since" argument
+it returns immediately with a cursor that points to the latest event.
+
 To test with curl:
 
   curl --digest --user exscript-http:exscript-http --data @postorder localhost:8123/order/
 """
 
+def _parse_datetime(value):
+    if value is None:
+        return None
+    value = value.split('.', 1)[0]
+    for format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('invalid timestamp: %s' % repr(value))
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return str(value)
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
 class HTTPHandler(RequestHandler):
+    max_list_length = 1000
+    min_gzip_length = 1024
+    max_wait        = 60
+
+    def _get_list_args(self, *fields):
+        args = {'limit': min(self.max_list_length,
+                             int(self.args.get('limit', 100))),
+                'before': self.args.get('before')}
+        if args['before'] is None:
+            args['offset'] = int(self.args.get('offset', 0))
+        else:
+            args['before'] = int(args['before'])
+        for field in fields:
+            for suffix in ('_after', '_before'):
+                value = self.args.get(field + suffix)
+                args[field + suffix] = _parse_datetime(value)
+        return args
+
+    def _get_list_response(self, name, items):
+        if self.args.get('format') == 'json':
+            values = []
+            for item in items:
+                value = item.todict()
+                value.pop('vars', None)
+                value['id'] = item.get_id()
+                values.append(value)
+
+            # The next page starts below the last id of this one.
+            cursor = items and items[-1].get_id() or None
+            result = {name: values, 'next': cursor}
+            return 'application/json', json.dumps(result,
+                                                  default    = _json_default,
+                                                  separators = (',', ':'))
+
+        # Assemble an XML document containing the items.
+        pretty = self.args.get('pretty', '1') != '0'
+        xml    = etree.Element('xml')
+        for item in items:
+            xml.append(item.toetree())
+        return etree.tostring(xml, pretty_print = pretty)
+
+    def _compress(self, response):
+        accepted = self.headers.get('Accept-Encoding', '')
+        if 'gzip' not in accepted or len(response) < self.min_gzip_length:
+            return response, None
+        buffer = StringIO()
+        with gzip.GzipFile(fileobj = buffer, mode = 'wb') as file:
+            file.write(response)
+        return buffer.getvalue(), 'gzip'
+
+    def _get_order_xml(self):
+        # Large orders are best sent as the plain request body, which
+        # saves decoding and copying the form data.
+        mime_type = self.headers.get('Content-Type', '').split(';', 1)[0]
+        if mime_type.strip() in ('application/xml', 'text/xml'):
+            return self.bdata
+        return parse_qs(self.data)['xml'][0]
+
     def get_response(self):
-        data     = parse_qs(self.data)
         logger   = self.daemon.logger
         order_db = self.daemon.parent.get_order_db()
 
         if self.path == '/order/':
             logger.debug('Parsing order from HTTP request.')
-            order = Order.from_xml(data['xml'][0])
+            order = Order.from_xml(self._get_order_xml())
             logger.debug('XML order parsed complete.')
             self.daemon.order_incoming_event(order)
             return 'application/json', json.dumps(order.get_id())
@@ -80,6 +186,20 @@ class HTTPHandler(RequestHandler):
                                                created_by  = created_by)
             return 'application/json', json.dumps(n_orders)
 
+        elif self.path == '/order/status/' and 'ids' in self.args:
+            ids    = [int(i) for i in self.args['ids'].split(',') if i]
+            ids    = ids[:self.max_list_length]
+            orders = order_db.get_orders(id = ids) if ids else []
+            result = {}
+            for order in orders:
+                closed = order.get_closed_timestamp()
+                if closed is not None:
+                    closed = str(closed)
+                result[order.get_id()] = {'status':   order.get_status(),
+                                          'progress': order.get_progress(),
+                                          'closed':   closed}
+            return 'application/json', json.dumps(result)
+
         elif self.path == '/order/status/':
             order_id = int(self.args['id'])
             order    = order_db.get_order(id = order_id)
@@ -96,8 +216,7 @@ class HTTPHandler(RequestHandler):
 
         elif self.path == '/order/list/':
             # Fetch the orders.
-            offset     = int(self.args.get('offset', 0))
-            limit      = min(100, int(self.args.get('limit', 100)))
+            list_args  = self._get_list_args('created', 'closed')
             order_id   = self.args.get('order_id')
             service    = self.args.get('service')
             descr      = self.args.get('description')
@@ -108,14 +227,8 @@ class HTTPHandler(RequestHandler):
                                              description = descr,
                                              status      = status,
                                              created_by  = created_by,
-                                             offset      = offset,
-                                             limit       = limit)
-
-            # Assemble an XML document containing the orders.
-            xml = etree.Element('xml')
-            for order in orders:
-                xml.append(order.toetree())
-            return etree.tostring(xml, pretty_print = True)
+                                             **list_args)
+            return self._get_list_response('orders', orders)
 
         elif self.path == '/task/get/':
             id   = int(self.args.get('id'))
@@ -132,18 +245,10 @@ class HTTPHandler(RequestHandler):
 
         elif self.path == '/task/list/':
             # Fetch the tasks.
-            order_id = int(self.args.get('order_id'))
-            offset   = int(self.args.get('offset', 0))
-            limit    = min(100, int(self.args.get('limit', 100)))
-            tasks    = order_db.get_tasks(order_id = order_id,
-                                          offset   = offset,
-                                          limit    = limit)
-
-            # Assemble an XML document containing the orders.
-            xml = etree.Element('xml')
-            for task in tasks:
-                xml.append(task.toetree())
-            return etree.tostring(xml, pretty_print = True)
+            order_id  = int(self.args.get('order_id'))
+            list_args = self._get_list_args('started', 'closed')
+            tasks     = order_db.get_tasks(order_id = order_id, **list_args)
+            return self._get_list_response('tasks', tasks)
 
         elif self.path == '/log/':
             task_id  = int(self.args.get('task_id'))
@@ -165,6 +270,30 @@ class HTTPHandler(RequestHandler):
             else:
                 return ''
 
+        elif self.path == '/events/':
+            feed     = self.daemon.parent.feed
+            since    = self.args.get('since')
+            timeout  = float(self.args.get('timeout', 30))
+            limit    = int(self.args.get('limit', self.max_list_length))
+            order_id = self.args.get('order_id')
+            filter   = {}
+            if since is not None:
+                since = int(since)
+            if order_id is not None:
+                filter['order_id'] = int(order_id)
+            events, cursor = feed.get_events(since,
+                                             min(timeout, self.max_wait),
+                                             min(limit, self.max_list_length),
+                                             **filter)
+            result = {'events': events, 'next': cursor}
+            return 'application/json', json.dumps(result,
+                                                  default    = _json_default,
+                                                  separators = (',', ':'))
+
+        elif self.path == '/metrics':
+            queues = self.daemon.parent.queues
+            return metrics.content_type, metrics.format(queues)
+
         else:
             raise Exception('no such API call')
 
@@ -189,6 +318,9 @@ class HTTPHandler(RequestHandler):
             else:
                 self.daemon.logger.debug('Sending HTTP/json response.')
                 self.send_header('Content-type', mime_type)
+            response, encoding = self._compress(response)
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
             self.end_headers()
             self.wfile.write(response)
         self.daemon.logger.debug('HTTP call complete.')
@@ -20,9 +20,10 @@ from getpass            import getuser
 from datetime           import datetime
 from tempfile           import NamedTemporaryFile
 from lxml               import etree
-from Exscript.util.file import get_hosts_from_csv
+from Exscript.util.file import iter_hosts_from_csv
+from Exscript.util.trace import new_trace_id, new_span_id
 from Exscriptd.DBObject import DBObject
-from Exscriptd.xml      import add_hosts_to_etree
+from Exscriptd.xml      import add_hosts_to_etree, iter_hosts_from_etree
 
 class Order(DBObject):
     """
@@ -48,6 +49,8 @@ class Order(DBObject):
         self.closed     = None
         self.progress   = .0
         self.created_by = getuser()
+        self.trace_id   = new_trace_id()
+        self.span_id    = new_span_id()
         self.xml        = etree.Element('order', service = self.service)
 
     def __repr__(self):
@@ -71,6 +74,8 @@ class Order(DBObject):
         order.id         = order_id is not None and int(order_id) or None
         order.status     = order_node.get('status',     order.status)
         order.created_by = order_node.get('created-by', order.created_by)
+        order.trace_id   = order_node.get('trace-id',   order.trace_id)
+        order.span_id    = order_node.get('span-id',    order.span_id)
         created          = order_node.get('created')
         closed           = order_node.get('closed')
         progress         = order_node.get('progress')
@@ -130,10 +135,21 @@ class Order(DBObject):
         @return: A new instance of an order.
         """
         order = Order(service)
-        hosts = get_hosts_from_csv(filename, encoding = encoding)
+        hosts = iter_hosts_from_csv(filename, encoding = encoding)
         add_hosts_to_etree(order.xml, hosts)
         return order
 
+    def iter_hosts(self):
+        """
+        Returns an iterator over the hosts that are defined in the order.
+        Each host is created only when it is consumed. Note that the XML
+        of the order is held in memory as a whole.
+
+        @rtype:  iterator(Exscript.Host)
+        @return: An iterator over the hosts.
+        """
+        return iter_hosts_from_etree(self.xml)
+
     def toetree(self):
         """
         Returns the order as an lxml etree.
@@ -155,6 +171,8 @@ class Order(DBObject):
             etree.SubElement(self.xml, 'description').text = str(self.descr)
         if self.created_by:
             self.xml.attrib['created-by'] = str(self.created_by)
+        self.xml.attrib['trace-id'] = self.trace_id
+        self.xml.attrib['span-id']  = self.span_id
         return self.xml
 
     def toxml(self, pretty = True):
@@ -301,6 +319,26 @@ class Order(DBObject):
         """
         return self.created_by
 
+    def get_trace_id(self):
+        """
+        Returns the id of the trace that records the processing of
+        the order.
+
+        @rtype:  str
+        @return: The trace id.
+        """
+        return self.trace_id
+
+    def get_span_id(self):
+        """
+        Returns the id of the span that represents the order within
+        its trace.
+
+        @rtype:  str
+        @return: The span id.
+        """
+        return self.span_id
+
     def get_progress(self):
         """
         Returns the progress of the order.
@@ -13,6 +13,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 from datetime import datetime
+from collections import defaultdict
 import sqlalchemy as sa
 from Exscript.util.cast import to_list
 from Exscript.util.impl import synchronized
@@ -60,13 +61,18 @@ class OrderDB(object):
         """
         pfx = self._table_prefix
         self.__add_table(sa.Table(pfx + 'order', self.metadata,
-            sa.Column('id',          sa.Integer,    primary_key = True),
-            sa.Column('service',     sa.String(50), index = True),
-            sa.Column('status',      sa.String(20), index = True),
-            sa.Column('description', sa.String(150)),
-            sa.Column('created',     sa.DateTime,   default = datetime.utcnow),
-            sa.Column('closed',      sa.DateTime),
-            sa.Column('created_by',  sa.String(50)),
+            sa.Column('id',           sa.Integer,    primary_key = True),
+            sa.Column('service',      sa.String(50), index = True),
+            sa.Column('status',       sa.String(20), index = True),
+            sa.Column('description',  sa.String(150)),
+            sa.Column('created',      sa.DateTime,   index = True,
+                      default = datetime.utcnow),
+            sa.Column('closed',       sa.DateTime,   index = True),
+            sa.Column('created_by',   sa.String(50)),
+            sa.Column('task_count',   sa.Integer,    default = 0),
+            sa.Column('progress_sum', sa.Float,      default = 0.0),
+            sa.Column('trace_id',     sa.String(32)),
+            sa.Column('span_id',      sa.String(16)),
             mysql_engine = 'INNODB'
         ))
 
@@ -96,8 +102,47 @@ class OrderDB(object):
         @return: True on success, False otherwise.
         """
         self.metadata.create_all()
+        self.__upgrade_tables()
         return True
 
+    def __upgrade_tables(self):
+        """
+        Adds the indices, as well as the task_count, progress_sum,
+        trace_id and span_id columns to tables that were created by
+        older versions. The task_count and progress_sum columns are
+        computed from the existing tasks.
+        """
+        from sqlalchemy.engine.reflection import Inspector
+        tbl_o    = self._table_map['order']
+        tbl_t    = self._table_map['task']
+        inspect  = Inspector.from_engine(self.engine)
+        for table in tbl_o, tbl_t:
+            indices = [i['name'] for i in inspect.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in indices:
+                    index.create()
+
+        existing = [c['name'] for c in inspect.get_columns(tbl_o.name)]
+        missing  = [c for c in ('task_count',
+                                'progress_sum',
+                                'trace_id',
+                                'span_id')
+                    if c not in existing]
+        if not missing:
+            return
+
+        dialect = self.engine.dialect
+        for name in missing:
+            column = tbl_o.c[name]
+            sql    = 'ALTER TABLE %s ADD COLUMN %s %s' % (
+                        dialect.identifier_preparer.format_table(tbl_o),
+                        name,
+                        column.type.compile(dialect = dialect))
+            self.engine.execute(sql)
+
+        if 'task_count' in missing:
+            self.recount_tasks()
+
     @synchronized
     def uninstall(self):
         """
@@ -167,9 +212,16 @@ class OrderDB(object):
             return
 
         # Insert the task
-        insert  = self._table_map['task'].insert()
-        result  = insert.execute(**task.todict())
-        task_id = result.last_inserted_ids()[0]
+        insert = self._table_map['task'].insert()
+        conn   = self.engine.connect()
+        try:
+            with conn.begin():
+                result  = conn.execute(insert, **task.todict())
+                task_id = result.last_inserted_ids()[0]
+                delta   = {task.order_id: (1, task.progress)}
+                self.__update_order_progress(conn, delta)
+        finally:
+            conn.close()
 
         task.untouch()
         return task_id
@@ -187,20 +239,57 @@ class OrderDB(object):
         if not task.is_dirty():
             return
 
-        # Insert or update the task.
+        # Insert or update the task, and the progress of the order.
+        tbl_o  = self._table_map['order']
         tbl_t  = self._table_map['task']
         fields = task.todict()
-        if task.id is None:
-            query   = tbl_t.insert()
-            result  = query.execute(**fields)
-            task.id = result.last_inserted_ids()[0]
-        else:
-            query   = tbl_t.update(tbl_t.c.id == task.id)
-            result  = query.execute(**fields)
+        conn   = self.engine.connect()
+        try:
+            with conn.begin():
+                if task.id is None:
+                    result  = conn.execute(tbl_t.insert(), **fields)
+                    task.id = result.last_inserted_ids()[0]
+                    delta   = {task.order_id: (1, task.progress)}
+                    self.__update_order_progress(conn, delta)
+                else:
+                    # The delta is computed from the old row, so the
+                    # order is updated before the task.
+                    old   = sa.select([sa.func.coalesce(tbl_t.c.progress, 0)],
+                                      tbl_t.c.id == task.id)
+                    old   = sa.func.coalesce(old.as_scalar(), task.progress)
+                    total = tbl_o.c.progress_sum + task.progress - old
+                    query = tbl_o.update(tbl_o.c.id == task.order_id)
+                    conn.execute(query.values(progress_sum = total))
+                    query = tbl_t.update(tbl_t.c.id == task.id)
+                    conn.execute(query, **fields)
+        finally:
+            conn.close()
 
         task.untouch()
         return task.id
 
+    def __update_order_progress(self, conn, deltas):
+        """
+        Adds the given number of tasks and the given progress to the
+        denormalized task_count and progress_sum columns of each order.
+
+        @type  conn: object
+        @param conn: The connection or engine that executes the query.
+        @type  deltas: dict(int, (int, float))
+        @param deltas: Maps order ids to (task_count, progress) tuples.
+        """
+        tbl_o  = self._table_map['order']
+        params = [dict(_id = order_id, _count = count, _progress = progress)
+                  for order_id, (count, progress) in deltas.iteritems()
+                  if count or progress]
+        if not params:
+            return
+        query = tbl_o.update(tbl_o.c.id == sa.bindparam('_id'))
+        query = query.values(
+            task_count   = tbl_o.c.task_count   + sa.bindparam('_count'),
+            progress_sum = tbl_o.c.progress_sum + sa.bindparam('_progress'))
+        conn.execute(query, params)
+
     def __get_task_from_row(self, row):
         assert row is not None
         tbl_t          = self._table_map['task']
@@ -225,6 +314,24 @@ class OrderDB(object):
         result = query.execute()
         return [self.__get_task_from_row(row) for row in result]
 
+    def __get_range_cond(self, table, where, fields, kwargs):
+        """
+        Adds conditions for the <field>_after and <field>_before
+        arguments of the given timestamp fields, as well as for the
+        'before' cursor, which selects only items with a lower id.
+        """
+        for field in fields:
+            after  = kwargs.get(field + '_after')
+            before = kwargs.get(field + '_before')
+            if after is not None:
+                where = sa.and_(where, table.c[field] >= after)
+            if before is not None:
+                where = sa.and_(where, table.c[field] < before)
+        cursor = kwargs.get('before')
+        if cursor is not None:
+            where = sa.and_(where, table.c.id < int(cursor))
+        return where
+
     def __get_tasks_cond(self, **kwargs):
         tbl_t = self._table_map['task']
 
@@ -243,7 +350,10 @@ class OrderDB(object):
                     cond = sa.or_(cond, tbl_t.c[field] == value)
                 where = sa.and_(where, cond)
 
-        return where
+        return self.__get_range_cond(tbl_t,
+                                     where,
+                                     ('started', 'closed'),
+                                     kwargs)
 
     def __get_tasks_query(self, fields, offset, limit, **kwargs):
         tbl_t = self._table_map['task']
@@ -260,7 +370,10 @@ class OrderDB(object):
 
         # Search conditions.
         where = None
-        for field in ('id', 'service', 'description', 'status', 'created_by'):
+        ids = kwargs.get('id')
+        if ids is not None:
+            where = tbl_o.c.id.in_(to_list(ids))
+        for field in ('service', 'description', 'status', 'created_by'):
             values = kwargs.get(field)
             if values is not None:
                 cond = None
@@ -268,23 +381,32 @@ class OrderDB(object):
                     cond = sa.or_(cond, tbl_o.c[field].like(value))
                 where = sa.and_(where, cond)
 
-        return where
+        return self.__get_range_cond(tbl_o,
+                                     where,
+                                     ('created', 'closed'),
+                                     kwargs)
 
     def __get_orders_query(self, offset = 0, limit = None, **kwargs):
         tbl_o  = self._table_map['order']
-        tbl_t  = self._table_map['task']
         where  = self.__get_orders_cond(**kwargs)
-        fields = list(tbl_o.c)
-        table  = tbl_o.outerjoin(tbl_t, tbl_t.c.order_id == tbl_o.c.id)
-        fields.append(sa.func.avg(tbl_t.c.progress).label('avg_progress'))
-        return sa.select(fields,
+        return sa.select(list(tbl_o.c),
                          where,
-                         from_obj   = [table],
-                         group_by   = [tbl_o.c.id],
+                         from_obj   = [tbl_o],
                          order_by   = [sa.desc(tbl_o.c.id)],
                          offset     = offset,
                          limit      = limit)
 
+    def __get_order_fields(self, order):
+        """
+        Returns the values of the given order that are stored in the
+        order table.
+        """
+        fields = dict(k for k in order.todict().iteritems()
+                      if k[0] not in ('id', 'created', 'progress'))
+        fields['trace_id'] = order.get_trace_id()
+        fields['span_id']  = order.get_span_id()
+        return fields
+
     @synchronized
     def __add_order(self, order):
         """
@@ -295,8 +417,7 @@ class OrderDB(object):
 
         # Insert the order
         insert   = self._table_map['order'].insert()
-        fields   = dict(k for k in order.todict().iteritems()
-                        if k[0] not in ('id', 'created', 'progress'))
+        fields   = self.__get_order_fields(order)
         result   = insert.execute(**fields)
         order.id = result.last_inserted_ids()[0]
         return order.id
@@ -323,8 +444,7 @@ class OrderDB(object):
         if not theorder:
             return self.add_order(order)
         table  = self._table_map['order']
-        fields = dict(k for k in order.todict().iteritems()
-                      if k[0] not in ('id', 'created', 'progress'))
+        fields = self.__get_order_fields(order)
         query  = table.update(table.c.id == order.get_id())
         query.execute(**fields)
 
@@ -338,13 +458,17 @@ class OrderDB(object):
         order.closed     = row[tbl_a.c.closed]
         order.created_by = row[tbl_a.c.created_by]
         order.set_description(row[tbl_a.c.description])
-        try:
-            order.progress = float(row.avg_progress)
-        except TypeError: # Order has no tasks
-            if order.closed:
-                order.progress = 1.0
-            else:
-                order.progress = .0
+        if row[tbl_a.c.trace_id]:
+            order.trace_id = row[tbl_a.c.trace_id]
+            order.span_id  = row[tbl_a.c.span_id]
+        task_count = row[tbl_a.c.task_count]
+        if task_count:
+            progress       = row[tbl_a.c.progress_sum] / task_count
+            order.progress = min(max(progress, .0), 1.0)
+        elif order.closed: # Order has no tasks
+            order.progress = 1.0
+        else:
+            order.progress = .0
         return order
 
     def __get_orders_from_query(self, query):
@@ -401,12 +525,17 @@ class OrderDB(object):
                          - service - the service name (str)
                          - description - the order description (str)
                          - status - the status (str)
-                       All values may also be lists (logical OR).
+                         - created_after, created_before, closed_after,
+                           closed_before - a time range (datetime)
+                         - before - return only orders with a lower id,
+                           for paginating using the last id of the
+                           previous page (int)
+                       All values except for time ranges and the
+                       cursor may also be lists (logical OR).
         @rtype:  list[Order]
         @return: The list of orders.
         """
-        select = self.__get_orders_query(avg    = True,
-                                         offset = offset,
+        select = self.__get_orders_query(offset = offset,
                                          limit  = limit,
                                          **kwargs)
         return self.__get_orders_from_query(select)
@@ -424,16 +553,25 @@ class OrderDB(object):
             for order in to_list(orders):
                 self.__add_order(order)
 
-    def close_open_orders(self):
+    def close_open_orders(self, order_ids = None):
         """
         Sets the 'closed' timestamp of all orders that have none, without
-        changing the status field.
+        changing the status field. The tasks of those orders are also
+        closed.
+
+        @type  order_ids: list[int]
+        @param order_ids: Close only the orders with the given ids.
         """
         closed = datetime.utcnow()
         tbl_o  = self._table_map['order']
         tbl_t  = self._table_map['task']
-        query1 = tbl_t.update(tbl_t.c.closed == None)
-        query2 = tbl_o.update(tbl_o.c.closed == None)
+        cond1  = tbl_t.c.closed == None
+        cond2  = tbl_o.c.closed == None
+        if order_ids is not None:
+            cond1 = sa.and_(cond1, tbl_t.c.order_id.in_(order_ids))
+            cond2 = sa.and_(cond2, tbl_o.c.id.in_(order_ids))
+        query1 = tbl_t.update(cond1)
+        query2 = tbl_o.update(cond2)
         query1.execute(closed = closed)
         query2.execute(closed = closed)
 
@@ -512,7 +650,13 @@ class OrderDB(object):
                          - job_id - the job id of the task (str)
                          - name - the name (str)
                          - status - the status (str)
-                       All values may also be lists (logical OR).
+                         - started_after, started_before, closed_after,
+                           closed_before - a time range (datetime)
+                         - before - return only tasks with a lower id,
+                           for paginating using the last id of the
+                           previous page (int)
+                       All values except for time ranges and the
+                       cursor may also be lists (logical OR).
         @rtype:  list[Task]
         @return: The list of tasks.
         """
@@ -540,6 +684,114 @@ class OrderDB(object):
 
         return self.__save_task(task)
 
+    @synchronized
+    def add_tasks(self, tasks):
+        """
+        Inserts the given new tasks into the database using a single
+        transaction, and assigns an id to each of them. This is much
+        faster than saving each task separately.
+
+        @type  tasks: list[Task]
+        @param tasks: The tasks to be added.
+        """
+        tasks  = list(tasks)
+        tbl_t  = self._table_map['task']
+        deltas = defaultdict(lambda: (0, .0))
+        for task in tasks:
+            if task.order_id is None:
+                raise AttributeError('order id must not be None')
+            if task.id is not None:
+                raise AttributeError('task was already added')
+            count, progress       = deltas[task.order_id]
+            deltas[task.order_id] = count + 1, progress + task.progress
+        if not deltas:
+            return
+
+        query = tbl_t.insert()
+        conn  = self.engine.connect()
+        try:
+            with conn.begin():
+                for task in tasks:
+                    result  = conn.execute(query, **task.todict())
+                    task.id = result.last_inserted_ids()[0]
+                self.__update_order_progress(conn, deltas)
+        finally:
+            conn.close()
+        for task in tasks:
+            task.untouch()
+
+    @synchronized
+    def update_tasks(self, changes):
+        """
+        Updates the given fields of many tasks at once. Tasks for which
+        the same set of fields is changed are updated using a single
+        executemany statement, and all updates are done in one
+        transaction. Tasks that do not exist are ignored.
+        The progress of the affected orders is updated accordingly.
+
+        @type  changes: dict(int, dict)
+        @param changes: Maps task ids to a dict of fields, e.g.
+            {1: {'status': 'running', 'progress': .5}}.
+        """
+        tbl_t  = self._table_map['task']
+        groups = {}
+        for task_id, fields in changes.iteritems():
+            if not fields:
+                continue
+            params = dict(fields)
+            params['_id'] = task_id
+            key = tuple(sorted(fields))
+            groups.setdefault(key, []).append(params)
+        if not groups:
+            return
+
+        query = tbl_t.update(tbl_t.c.id == sa.bindparam('_id'))
+        conn  = self.engine.connect()
+        try:
+            with conn.begin():
+                # Collect the progress deltas of the affected orders.
+                deltas = defaultdict(float)
+                ids    = [task_id for task_id, fields in changes.iteritems()
+                          if 'progress' in fields]
+                if ids:
+                    select = sa.select([tbl_t.c.id,
+                                        tbl_t.c.order_id,
+                                        tbl_t.c.progress],
+                                       tbl_t.c.id.in_(ids))
+                    for row in conn.execute(select):
+                        progress = changes[row.id]['progress']
+                        deltas[row.order_id] += progress - (row.progress or .0)
+
+                for params in groups.itervalues():
+                    conn.execute(query, params)
+                deltas = dict((order_id, (0, delta))
+                              for order_id, delta in deltas.iteritems())
+                self.__update_order_progress(conn, deltas)
+        finally:
+            conn.close()
+
+    @synchronized
+    def recount_tasks(self, order_ids = None):
+        """
+        Computes the denormalized task_count and progress_sum columns
+        of the given orders from their tasks, repairing any drift.
+
+        @type  order_ids: list[int]
+        @param order_ids: Recount only the orders with the given ids.
+        """
+        tbl_o = self._table_map['order']
+        tbl_t = self._table_map['task']
+        count = sa.select([sa.func.count(tbl_t.c.id)],
+                          tbl_t.c.order_id == tbl_o.c.id)
+        total = sa.select([sa.func.coalesce(sa.func.sum(tbl_t.c.progress), 0)],
+                          tbl_t.c.order_id == tbl_o.c.id)
+        query = tbl_o.update()
+        if order_ids is not None:
+            query = query.where(tbl_o.c.id.in_(order_ids))
+        query = query.values(task_count   = count.as_scalar(),
+                             progress_sum = total.as_scalar())
+        query.execute()
+
     @synchronized
     def mark_tasks(self, new_status, offset = 0, limit = None, **kwargs):
         """
@@ -577,3 +829,85 @@ class OrderDB(object):
         all_select = tbl_t.select(tbl_t.c.id.in_(id_list),
                                   order_by = [tbl_t.c.id])
         return self.__get_tasks_from_query(all_select)
+
+    @synchronized
+    def get_expired_orders(self, closed_before = None, keep = None, limit = None):
+        """
+        Returns closed orders that are due for removal, oldest first.
+        An order is expired if it was closed before the given time, or
+        if it is not among the given number of most recent orders.
+        Open orders never expire.
+
+        @type  closed_before: datetime
+        @param closed_before: Orders closed before this time are expired.
+        @type  keep: int
+        @param keep: The number of most recent orders that are kept.
+        @type  limit: int
+        @param limit: The maximum number of orders that is returned.
+        @rtype:  list[Order]
+        @return: The list of orders.
+        """
+        tbl_o = self._table_map['order']
+        where = None
+        if closed_before is not None:
+            where = tbl_o.c.closed < closed_before
+        if keep is not None:
+            # Ids are ascending, so every order with an id up to that of
+            # the first order that is not kept is expired.
+            query  = sa.select([tbl_o.c.id],
+                               order_by = [sa.desc(tbl_o.c.id)],
+                               offset   = keep,
+                               limit    = 1)
+            cutoff = query.execute().scalar()
+            if cutoff is not None:
+                where = sa.or_(where, tbl_o.c.id <= cutoff)
+        if where is None:
+            return []
+
+        query = sa.select(list(tbl_o.c),
+                          sa.and_(tbl_o.c.closed != None, where),
+                          from_obj = [tbl_o],
+                          order_by = [tbl_o.c.id],
+                          limit    = limit)
+        return self.__get_orders_from_query(query)
+
+    @synchronized
+    def delete_orders(self, order_ids):
+        """
+        Deletes the orders with the given ids, including their tasks,
+        in a single transaction. To avoid locking the tables for a long
+        time, pass a limited number of ids at a time.
+
+        @type  order_ids: list[int]
+        @param order_ids: The ids of the orders.
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        tbl_o = self._table_map['order']
+        tbl_t = self._table_map['task']
+        conn  = self.engine.connect()
+        try:
+            with conn.begin():
+                conn.execute(tbl_t.delete(tbl_t.c.order_id.in_(order_ids)))
+                conn.execute(tbl_o.delete(tbl_o.c.id.in_(order_ids)))
+        finally:
+            conn.close()
+
+    @synchronized
+    def vacuum(self):
+        """
+        Returns the space of deleted rows to the operating system and
+        updates the statistics of the query planner. Only SQLite and
+        MySQL are supported; other databases are left unchanged.
+        Note that this may lock the database for a while.
+        """
+        dialect = self.engine.dialect
+        if dialect.name == 'sqlite':
+            self.engine.execute('VACUUM')
+            self.engine.execute('ANALYZE')
+        elif dialect.name == 'mysql':
+            prepare = dialect.identifier_preparer
+            tables  = self._table_map['order'], self._table_map['task']
+            names   = ', '.join(prepare.format_table(t) for t in tables)
+            self.engine.execute('OPTIMIZE TABLE ' + names)
@@ -0,0 +1,213 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Removes old orders from the order database.
+"""
+import os
+import json
+import gzip
+import shutil
+from datetime import datetime
+from threading import Thread, Event
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return str(value)
+    return repr(value)
+
+class Retention(Thread):
+    """
+    A background job that periodically removes closed orders, their
+    tasks and their log directories, optionally archiving them first.
+    Orders are removed if they are older than the maximum age, or if
+    they are not among the most recent orders.
+
+    Orders are processed in batches, each of which is deleted in a
+    short transaction, so other writers are never blocked for long.
+    Archived orders are appended to gzip compressed files that
+    contain one JSON object per line and that are partitioned by the
+    month in which the order was created, for example::
+
+        archive_dir/orders-2010-01.json.gz
+    """
+
+    def __init__(self,
+                 order_db,
+                 logger,
+                 max_age     = None,
+                 max_orders  = None,
+                 archive_dir = None,
+                 logdir      = None,
+                 interval    = 3600,
+                 batch_size  = 500,
+                 pause       = .1,
+                 vacuum      = False):
+        """
+        Constructor.
+
+        @type  order_db: OrderDB
+        @param order_db: The order database.
+        @type  logger: logging.Logger
+        @param logger: The logger.
+        @type  max_age: timedelta
+        @param max_age: Remove orders that were closed longer ago.
+        @type  max_orders: int
+        @param max_orders: Keep at most this number of orders.
+        @type  archive_dir: str
+        @param archive_dir: Where orders are archived. If None, orders
+            are removed without being archived.
+        @type  logdir: str
+        @param logdir: The log directory of the daemon. The log
+            directories of removed orders are deleted.
+        @type  interval: int
+        @param interval: The number of seconds between two runs.
+        @type  batch_size: int
+        @param batch_size: The number of orders removed per transaction.
+        @type  pause: float
+        @param pause: The number of seconds to wait between two batches.
+        @type  vacuum: bool
+        @param vacuum: Whether to compact the database after orders
+            were removed. See L{OrderDB.vacuum()}.
+        """
+        Thread.__init__(self)
+        self.order_db    = order_db
+        self.logger      = logger
+        self.max_age     = max_age
+        self.max_orders  = max_orders
+        self.archive_dir = archive_dir
+        self.logdir      = logdir
+        self.interval    = interval
+        self.batch_size  = batch_size
+        self.pause       = pause
+        self.vacuum      = vacuum
+        self.stopped     = Event()
+        self.daemon      = True
+
+    def _get_order_logdir(self, order_id):
+        return os.path.join(self.logdir, 'orders', str(order_id))
+
+    def run_once(self):
+        """
+        Removes all orders that are currently expired.
+
+        @rtype:  int
+        @return: The number of orders that were removed.
+        """
+        closed_before = None
+        if self.max_age is not None:
+            closed_before = datetime.utcnow() - self.max_age
+
+        removed = 0
+        while not self.stopped.is_set():
+            orders = self.order_db.get_expired_orders(closed_before,
+                                                      self.max_orders,
+                                                      self.batch_size)
+            if not orders:
+                break
+            if self.archive_dir:
+                self.archive(orders)
+            order_ids = [order.get_id() for order in orders]
+            self.order_db.delete_orders(order_ids)
+            removed += len(orders)
+
+            if self.logdir:
+                for order_id in order_ids:
+                    shutil.rmtree(self._get_order_logdir(order_id), True)
+            self.stopped.wait(self.pause)
+        return removed
+
+    def archive(self, orders):
+        """
+        Appends the given orders, including their tasks, to the archive.
+
+        @type  orders: list[Order]
+        @param orders: The orders to archive.
+        """
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+        # Collect the tasks of all orders in one query.
+        order_ids = [order.get_id() for order in orders]
+        tasks     = dict((order_id, []) for order_id in order_ids)
+        for task in self.order_db.get_tasks(order_id = order_ids):
+            tasks[task.order_id].append(task.todict())
+
+        # Group the orders by month.
+        partitions = {}
+        for order in orders:
+            created = order.get_created_timestamp() or datetime.utcnow()
+            item    = order.todict()
+            item['id']    = order.get_id()
+            item['tasks'] = tasks[order.get_id()]
+            line          = json.dumps(item, default = _json_default)
+            partitions.setdefault(created.strftime('%Y-%m'), []).append(line)
+
+        # Each write adds a new gzip member to the file, which is
+        # transparently read by gzip and zcat.
+        for month, lines in partitions.iteritems():
+            filename = os.path.join(self.archive_dir,
+                                    'orders-%s.json.gz' % month)
+            with gzip.open(filename, 'ab') as file:
+                file.write('\n'.join(lines) + '\n')
+
+    def clean_logdirs(self):
+        """
+        Deletes the log directories of orders that no longer exist
+        in the database.
+
+        @rtype:  int
+        @return: The number of directories that were deleted.
+        """
+        orders_dir = os.path.join(self.logdir, 'orders')
+        if not os.path.isdir(orders_dir):
+            return 0
+        names = [n for n in os.listdir(orders_dir) if n.isdigit()]
+        ids   = sorted(int(n) for n in names)
+
+        removed = 0
+        for offset in range(0, len(ids), self.batch_size):
+            batch    = ids[offset:offset + self.batch_size]
+            orders   = self.order_db.get_orders(id = batch)
+            existing = set(order.get_id() for order in orders)
+            for order_id in batch:
+                if order_id not in existing:
+                    shutil.rmtree(self._get_order_logdir(order_id), True)
+                    removed += 1
+        return removed
+
+    def stop(self):
+        """
+        Stops the background job after the current batch.
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                removed = self.run_once()
+                if removed:
+                    self.logger.info('Retention: %d orders removed.' % removed)
+                if removed and self.vacuum:
+                    self.order_db.vacuum()
+                if self.logdir:
+                    removed = self.clean_logdirs()
+                    if removed:
+                        self.logger.info('Retention: %d orphaned log'
+                                         ' directories removed.' % removed)
+            except Exception, e:
+                self.logger.error('Retention failed: %s' % e)
+            self.stopped.wait(self.interval)
@@ -0,0 +1,322 @@
+# Copyright (C) 2007-2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Runs the services of an Exscript daemon in multiple processes.
+"""
+import os
+import time
+import signal
+import logging
+import logging.handlers
+from threading import Thread, Condition
+from multiprocessing import Process, Pipe
+from Exscriptd.Order import Order
+from Exscriptd.EventFeed import EventFeed
+
+def _forward_events(feed, conn):
+    since = feed.get_events()[1]
+    while True:
+        events, since = feed.get_events(since, timeout = 5)
+        if events:
+            conn.send(('events', events))
+
+def _run_worker(config_dir, index, service_names, conn):
+    # Note: This function runs in a child process. Interrupts are
+    # handled by the supervisor.
+    from Exscriptd.Config import Config
+    from Exscriptd.Dispatcher import Dispatcher
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    config  = Config(config_dir)
+    logdir  = os.path.join(config.get_logdir(), 'workers', str(index))
+    logfile = os.path.join(logdir, 'exscriptd.log')
+    if not os.path.isdir(logdir):
+        os.makedirs(logdir)
+
+    # Set up logging.
+    logger  = logging.getLogger('exscript.worker%d' % index)
+    handler = logging.handlers.RotatingFileHandler(logfile,
+                                                   maxBytes    = 2000000,
+                                                   backupCount = 10)
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    # Load the services of this shard, and the queues they use.
+    if service_names is None:
+        match = None
+    else:
+        match = lambda name: name in service_names
+    order_db   = config.get_order_db()
+    dispatcher = Dispatcher(order_db,
+                            {},
+                            logger,
+                            config.get_logdir(),
+                            close_open_orders = False)
+    services = config.get_services(dispatcher, match)
+    names    = set(s.get_queue_name() for s in services)
+    names.discard(None)
+    names.discard(False)
+    for name, queue in config.get_queues(names).iteritems():
+        dispatcher.add_queue(name, queue)
+    logger.info('worker %d started with services %s.'
+                % (index, ', '.join(s.name for s in services)))
+
+    # Status changes are passed on to the supervisor.
+    forwarder = Thread(target = _forward_events, args = (dispatcher.feed, conn))
+    forwarder.daemon = True
+    forwarder.start()
+
+    # Handle orders until the supervisor goes away.
+    while True:
+        try:
+            xml = conn.recv()
+        except EOFError:
+            break
+        if xml is None:
+            break
+        order = Order.from_xml(xml)
+        try:
+            dispatcher.place_order(order, 'supervisor')
+        except Exception, e:
+            logger.error('order %s failed: %s' % (order.get_id(), e))
+    logger.info('worker %d stopping.' % index)
+    for queue in dispatcher.queues.itervalues():
+        queue.destroy(True)
+    dispatcher.shutdown()
+
+class _Worker(object):
+    def __init__(self, index):
+        self.index    = index
+        self.process  = None
+        self.conn     = None
+        self.pending  = set() # ids of orders that are not yet completed
+        self.services = None  # names of the services, None for all
+
+class Supervisor(object):
+    """
+    Takes the place of the L{Dispatcher} in the main process, and
+    distributes orders to a number of worker processes. Each worker
+    has its own dispatcher, services and queues, and all of them share
+    the order database.
+
+    Orders are assigned to a worker either by the name of the service
+    ('service'), so that each worker only loads the services of its
+    shard, or by the order id ('order'), so that the orders of each
+    service are spread over all workers, each of which then runs all
+    queues. Services are distributed over the workers in the order
+    of their names.
+
+    Each worker accepts only a limited number of pending orders. When
+    a worker is busy, placing an order blocks until the worker completes
+    one of its orders. If a worker dies, its pending orders are closed
+    and the worker is restarted; other workers are not affected.
+    """
+    max_pending   = 100  # The maximum number of open orders per worker.
+    wait_timeout  = 60   # Seconds to wait for a busy worker.
+    restart_delay = 1    # Seconds to wait before restarting a worker.
+
+    def __init__(self, config_dir, order_db, logger, n_workers, shard_by):
+        """
+        Constructor.
+
+        @type  config_dir: str
+        @param config_dir: The configuration directory of the daemon.
+        @type  order_db: OrderDB
+        @param order_db: The order database.
+        @type  logger: logging.Logger
+        @param logger: The logger of the supervisor.
+        @type  n_workers: int
+        @param n_workers: The number of worker processes.
+        @type  shard_by: str
+        @param shard_by: Either 'service' or 'order'.
+        """
+        if shard_by not in ('service', 'order'):
+            raise ValueError('invalid shard_by argument: %s' % repr(shard_by))
+        self.config_dir = config_dir
+        self.order_db   = order_db
+        self.logger     = logger
+        self.shard_by   = shard_by
+        self.queues     = {}
+        self.daemons    = {}
+        self.feed       = EventFeed()
+        self.workers    = [_Worker(i) for i in range(n_workers)]
+        self.shards     = {} # maps service names to workers
+        self.condition  = Condition()
+        self.stopping   = False
+
+        if shard_by == 'service':
+            from Exscriptd.Config import Config
+            names = sorted(Config(config_dir).get_service_names())
+            for n, name in enumerate(names):
+                self.shards[name] = self.workers[n % n_workers]
+
+        self.logger.info('Closing all open orders.')
+        self.order_db.close_open_orders()
+
+    def get_order_db(self):
+        return self.order_db
+
+    def daemon_added(self, daemon):
+        """
+        Called by a daemon when it is initialized.
+        """
+        daemon.parent = self
+        self.daemons[daemon.name] = daemon
+        daemon.order_incoming_event.listen(self.place_order, daemon.name)
+
+    def start(self):
+        """
+        Starts the worker processes.
+        """
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def _create_process(self, worker, conn):
+        args = self.config_dir, worker.index, worker.services, conn
+        return Process(target = _run_worker, args = args)
+
+    def _start_worker(self, worker):
+        conn, child_conn = Pipe()
+        if self.shard_by == 'service':
+            worker.services = set(name for name, w in self.shards.iteritems()
+                                  if w is worker)
+        process = self._create_process(worker, child_conn)
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        with self.condition:
+            worker.process = process
+            worker.conn    = conn
+            self.condition.notify_all()
+        self.logger.info('Worker %d started (pid %d).' % (worker.index,
+                                                          process.pid))
+
+        # Receive status changes until the worker dies.
+        thread = Thread(target = self._watch_worker, args = (worker,))
+        thread.daemon = True
+        thread.start()
+
+    def _watch_worker(self, worker):
+        conn = worker.conn
+        while True:
+            try:
+                msg, events = conn.recv()
+            except (EOFError, IOError):
+                break
+            for event in events:
+                self._publish(worker, event)
+        self._worker_died(worker)
+
+    def _publish(self, worker, event):
+        event = event.copy()
+        del event['seq']
+        if event['type'] == 'order' and event['closed'] is not None:
+            with self.condition:
+                worker.pending.discard(event['id'])
+                self.condition.notify_all()
+        self.feed.publish(event.pop('type'), **event)
+
+    def _worker_died(self, worker):
+        worker.process.join()
+        with self.condition:
+            worker.process = None
+            worker.conn    = None
+            pending        = sorted(worker.pending)
+            worker.pending.clear()
+            self.condition.notify_all()
+        if self.stopping:
+            return
+
+        # Orders of the worker will never complete.
+        self.logger.error('Worker %d died, closing %d orders.'
+                          % (worker.index, len(pending)))
+        if pending:
+            self.order_db.close_open_orders(pending)
+            for order in self.order_db.get_orders(id = pending):
+                self.feed.publish('order',
+                                  id       = order.id,
+                                  order_id = order.id,
+                                  status   = order.get_status(),
+                                  closed   = order.get_closed_timestamp())
+
+        time.sleep(self.restart_delay)
+        if not self.stopping:
+            self._start_worker(worker)
+
+    def _get_worker(self, order):
+        if self.shard_by == 'service':
+            # Unknown services are rejected by the first worker.
+            return self.shards.get(order.get_service_name(), self.workers[0])
+        return self.workers[order.get_id() % len(self.workers)]
+
+    def _reject(self, order, status):
+        order.close()
+        order.status = status
+        self.order_db.save_order(order)
+        self.feed.publish('order',
+                          id       = order.id,
+                          order_id = order.id,
+                          status   = status,
+                          closed   = order.get_closed_timestamp())
+
+    def place_order(self, order, daemon_name):
+        self.logger.debug('Incoming order from ' + daemon_name)
+
+        # Store the order, so that it has an id.
+        order.status = 'incoming'
+        self.order_db.save_order(order)
+        worker   = self._get_worker(order)
+        deadline = time.time() + self.wait_timeout
+
+        # Wait until the worker is running and has capacity.
+        with self.condition:
+            while worker.conn is None \
+              or len(worker.pending) >= self.max_pending:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.stopping:
+                    break
+                self.condition.wait(remaining)
+            else:
+                worker.pending.add(order.id)
+                worker.conn.send(order.toxml(pretty = False))
+                return
+
+        self.logger.error('Worker %d is busy, order %d rejected.'
+                          % (worker.index, order.id))
+        self._reject(order, 'busy')
+
+    def shutdown(self):
+        """
+        Stops all worker processes.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            workers = [w for w in self.workers if w.conn is not None]
+            for worker in workers:
+                try:
+                    worker.conn.send(None)
+                except IOError:
+                    pass
+        for worker in workers:
+            process = worker.process
+            if process is None:
+                continue
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
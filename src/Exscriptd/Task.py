@@ -36,6 +36,8 @@ class Task(DBObject):
         self.logfile       = None
         self.tracefile     = None
         self.vars          = {}
+        self.trace_id      = None
+        self.span_id       = None
         self.changed_event = Event()
 
     @staticmethod
@@ -168,6 +170,25 @@ class Task(DBObject):
         """
         return self.job_id
 
+    def get_trace_id(self):
+        """
+        Returns the id of the trace to which the task belongs, or None.
+
+        @rtype:  str|None
+        @return: The trace id.
+        """
+        return self.trace_id
+
+    def get_span_id(self):
+        """
+        Returns the id of the span that represents the task, or None.
+        Spans of the jobs that run the task use this as their parent.
+
+        @rtype:  str|None
+        @return: The span id.
+        """
+        return self.span_id
+
     def set_name(self, name):
         """
         Change the task name.
@@ -261,8 +282,8 @@ class Task(DBObject):
         Like close(), but sets the status to 'completed' and the progress
         to 100%.
         """
-        self.close('completed')
         self.set_progress(1.0)
+        self.close('completed')
 
     def get_closed_timestamp(self):
         """
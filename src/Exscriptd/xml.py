@@ -238,11 +238,20 @@ def get_hosts_from_etree(node):
     @rtype:  list(Exscript.Host)
     @return: A list of hosts.
     """
-    hosts = []
+    return list(iter_hosts_from_etree(node))
+
+def iter_hosts_from_etree(node):
+    """
+    Like get_hosts_from_etree(), but returns an iterator that creates
+    each host only when it is consumed.
+
+    @type  node: lxml.etree.ElementNode
+    @param node: A node containing <host> elements.
+    @rtype:  iterator(Exscript.Host)
+    @return: An iterator over the hosts.
+    """
     for host_elem in node.iterfind('host'):
-        host = get_host_from_etree(host_elem)
-        hosts.append(host)
-    return hosts
+        yield get_host_from_etree(host_elem)
 
 def add_hosts_to_etree(root, hosts):
     """
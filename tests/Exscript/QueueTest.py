@@ -5,6 +5,7 @@ warnings.simplefilter('ignore', DeprecationWarning)
 
 import shutil
 import time
+import threading
 import ctypes
 from functools import partial
 from tempfile import mkdtemp
@@ -164,6 +165,82 @@ class QueueTest(unittest.TestCase):
             self.assertVerbosity(self.out, stdout)
             self.assertVerbosity(self.err, stderr)
 
+    def testStatusBar(self):
+        self.createQueue(verbose = 1, max_threads = 2, status_rate = 50)
+        hosts = ['dummy://host%d' % i for i in range(10)]
+        self.queue.run(hosts, do_nothing)
+        self.queue.join()
+        data = self.out.read()
+        self.assert_('In progress: [' in data, data)
+        self.assert_('/10 (' in data, data)
+        for i in range(10):
+            self.assert_('host%d succeeded.' % i in data, data)
+
+        # The renderer thread exits when there is nothing left to draw.
+        time.sleep(0.2)
+        self.assertEqual(self.queue.status_renderer, None)
+
+    def testStatusBarDoesNotBlockJobEvents(self):
+        # A terminal that blocks while the status bar is drawn.
+        class Terminal(object):
+            def __init__(self):
+                self.drawing = threading.Event()
+                self.release = threading.Event()
+            def write(self, data):
+                if data.startswith('In progress'):
+                    self.drawing.set()
+                    self.release.wait(5)
+            def flush(self):
+                pass
+        class FakeJob(object):
+            def __init__(self, n):
+                self.id   = n
+                self.name = 'job%d' % n
+        terminal = Terminal()
+        self.createQueue(verbose = 1, max_threads = 2, status_rate = 50)
+        self.queue.stdout = terminal
+        self.queue._update_verbosity()
+        self.queue.total = 2
+        self.queue._on_job_started(FakeJob(1))
+        self.assert_(terminal.drawing.wait(5))
+
+        # While the renderer waits for the terminal, job events return.
+        thread = threading.Thread(target = self.queue._on_job_started,
+                                  args = (FakeJob(2),))
+        thread.start()
+        thread.join(1)
+        alive = thread.isAlive()
+        terminal.release.set()
+        thread.join()
+        self.failIf(alive)
+        self.assertEqual(sorted(self.queue.running_jobs), [1, 2])
+
+    def testTrace(self):
+        from Exscript.util import trace
+        class FakeExporter(object):
+            spans = []
+            def export(self, span):
+                self.spans.append(span)
+        def set_trace(job):
+            job.data['trace'] = ('trace', 'parent')
+        exporter = FakeExporter()
+        trace.set_exporter(exporter)
+        try:
+            self.queue.workqueue.job_init_event.connect(set_trace)
+            self.queue.run('dummy://mytest', say_hello)
+            self.queue.join()
+        finally:
+            trace.set_exporter(None)
+        job = exporter.spans[0]
+        self.assertEqual(job.name, 'job')
+        self.assertEqual(job.parent_id, 'parent')
+        self.assertEqual(job.attributes['host'], 'mytest')
+        self.assertEqual(exporter.spans[1].name, 'connect')
+        self.assertEqual(exporter.spans[1].parent_id, job.span_id)
+        for span in exporter.spans:
+            self.assertEqual(span.trace_id, 'trace')
+            self.assert_(span.end is not None)
+
     def testCreatePipe(self):
         account = Account('user', 'test')
         self.accm.add_account(account)
@@ -189,6 +266,27 @@ class QueueTest(unittest.TestCase):
     def testGetMaxThreads(self):
         pass # Already tested in testSetMaxThreads().
 
+    def testSetProfileRate(self):
+        self.assertEqual(self.queue.get_profile_rate(), 0.0)
+        self.queue.set_profile_rate(0.5)
+        self.assertEqual(self.queue.get_profile_rate(), 0.5)
+
+    def testGetProfileRate(self):
+        pass # Already tested in testSetProfileRate().
+
+    def testGetProfile(self):
+        self.queue.run(['dummy://host1', 'dummy://host2'], do_nothing)
+        self.queue.join()
+        self.assertEqual(self.queue.get_profile().get_count(), 0)
+        self.assertEqual(self.queue.get_profile().get_stats(), None)
+
+        self.queue.set_profile_rate(1)
+        self.queue.run(['dummy://host3', 'dummy://host4'], do_nothing)
+        self.queue.join()
+        profile = self.queue.get_profile()
+        self.assertEqual(profile.get_count(), 2)
+        self.assert_(profile.get_stats().total_calls > 0)
+
     def testGetProgress(self):
         self.assertEqual(0.0, self.queue.get_progress())
         self.testIsCompleted()
@@ -284,6 +382,21 @@ class QueueTest(unittest.TestCase):
         self.queue.reset()
         self.assertEqual(self.accm.default_pool.n_accounts(), 0)
 
+        # Statistics that are collected after a reset are not lost.
+        stats   = self.queue.stats
+        profile = self.queue.profile
+        self.queue.stats.record('login', 1.0)
+        self.queue.profile.add({})
+        self.queue.reset()
+        self.assert_(self.queue.stats is stats)
+        self.assert_(self.queue.profile is profile)
+        self.assertEqual(self.queue.stats.get_phases(), [])
+        self.assertEqual(self.queue.profile.get_count(), 0)
+        self.queue.add_account(Account('user', 'test'))
+        self.queue.run('dummy://dummy1', bind(count_calls2, Value('i', 0)))
+        self.queue.join()
+        self.assertEqual(self.queue.stats.get_histogram('job').get_count(), 1)
+
     def testRun(self):
         data  = Value('i', 0)
         hosts = ['dummy://dummy1', 'dummy://dummy2']
@@ -48,6 +48,9 @@ class ProtocolTest(unittest.TestCase):
         self.device.add_command('exit', '')
         self.device.add_command('this-command-causes-an-error',
                                 '\ncommand not found')
+        self.device.add_command('lines', 'line1\nline2\nline3\nline4')
+        self.device.add_command('error-lines',
+                                'line1\ncommand not found\nline3\nline4')
 
     def createDaemon(self):
         pass
@@ -405,6 +408,64 @@ class ProtocolTest(unittest.TestCase):
                           self.protocol.execute,
                           'this-command-causes-an-error')
 
+    def testExecutePipelined(self):
+        # Test can not work on the abstract base.
+        if self.protocol.__class__ == Protocol:
+            self.assertRaises(Exception,
+                              self.protocol.execute_pipelined,
+                              ['ls'])
+            return
+        self.doLogin()
+        commands = ['ls', 'df', 'ls', 'df', 'df']
+        expected = []
+        for command in commands:
+            self.protocol.execute(command)
+            expected.append(self.protocol.response)
+        self.assert_(expected[0].startswith('ls'))
+        self.assert_(expected[1].startswith('df'))
+
+        # The responses are the same as when executing each command.
+        for window in (1, 2, 10):
+            responses = self.protocol.execute_pipelined(commands, window)
+            self.assertEqual(responses, expected)
+            self.assertEqual(self.protocol.response, expected[-1])
+
+        # Make sure that we raise an error if the device responds
+        # with something that matches any of the error prompts.
+        self.protocol.set_error_prompt('not found')
+        self.assertRaises(InvalidCommandException,
+                          self.protocol.execute_pipelined,
+                          ['ls', 'this-command-causes-an-error'])
+
+    def testSetResponseHandler(self):
+        # Test can not work on the abstract base.
+        if self.protocol.__class__ == Protocol:
+            self.protocol.set_response_handler(None)
+            return
+        self.doLogin()
+        self.protocol.execute('lines')
+        response = self.protocol.response
+
+        # Complete lines are passed to the handler while they are
+        # received, and removed from the response.
+        parts = []
+        self.protocol.set_response_handler(parts.append)
+        self.protocol.execute('lines')
+        self.assert_(len(parts) > 0)
+        self.failIf('line1' in self.protocol.response)
+        self.assertEqual(''.join(parts) + self.protocol.response, response)
+
+        # Error prompts are also found in the data that was passed to the
+        # handler, once the prompt was received.
+        self.protocol.set_error_prompt('not found')
+        self.assertRaises(InvalidCommandException,
+                          self.protocol.execute,
+                          'error-lines')
+        self.protocol.execute('lines')
+        self.protocol.set_response_handler(None)
+        self.protocol.execute('lines')
+        self.assertEqual(self.protocol.response, response)
+
     def testWaitfor(self):
         # Test can not work on the abstract base.
         if self.protocol.__class__ == Protocol:
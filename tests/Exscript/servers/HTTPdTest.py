@@ -0,0 +1,257 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import time
+import socket
+from threading              import Thread
+from httplib                import HTTPConnection, HTTPResponse
+from urllib2                import parse_http_list, parse_keqv_list
+from Exscript.servers.HTTPd import HTTPd, RequestHandler, md5hex
+
+class EchoHandler(RequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def handle_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(('GET ' + self.path).encode('utf8'))
+
+    def handle_POST(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(self.bdata)
+
+class HTTPdTest(unittest.TestCase):
+    CORRELATE = HTTPd
+
+    def setUp(self):
+        self.server = HTTPd(('localhost', 0), EchoHandler)
+        self.server.add_account('user', 'password')
+        self.port   = self.server.server_address[1]
+        self.thread = Thread(target = self.server.serve_forever,
+                             kwargs = {'poll_interval': .05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get_nonce(self, response):
+        header = response.getheader('WWW-Authenticate')
+        token, fields = header.split(' ', 1)
+        challenge     = parse_keqv_list(parse_http_list(fields))
+        return challenge['nonce'], challenge.get('stale') == 'TRUE'
+
+    def _auth(self, method, path, nonce, count, password = 'password'):
+        pwhash   = md5hex('user:%s:%s' % (self.server.realm, password))
+        location = md5hex('%s:%s' % (method, path))
+        count    = '%08x' % count
+        info     = pwhash, nonce, count, 'cnonce', 'auth', location
+        response = md5hex(':'.join(info))
+        return 'Digest username="user", realm="%s", nonce="%s", ' \
+               'uri="%s", response="%s", qop=auth, nc=%s, ' \
+               'cnonce="cnonce"' % (self.server.realm,
+                                    nonce,
+                                    path,
+                                    response,
+                                    count)
+
+    def _request(self, conn, method, path, auth = None, body = None):
+        headers = {}
+        if auth:
+            headers['Authorization'] = auth
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def testConstructor(self):
+        self.assertEqual(self.server.realm, 'exscript')
+        self.assertEqual(self.server.user_data, None)
+
+    def testAddAccount(self):
+        self.server.add_account('user2', 'password2')
+        self.assertEqual(self.server.get_password('user2'), 'password2')
+
+    def testGetPassword(self):
+        self.assertEqual(self.server.get_password('user'), 'password')
+        self.assertEqual(self.server.get_password('nobody'), None)
+
+    def testGetNonce(self):
+        nonce = self.server.get_nonce()
+        self.assert_(self.server.check_nonce(nonce, 1))
+
+        # Nonces of another server are not accepted.
+        other = HTTPd(('localhost', 0), EchoHandler)
+        other.server_close()
+        self.failIf(self.server.check_nonce(other.get_nonce(), 1))
+        self.failIf(self.server.check_nonce('foo', 1))
+        self.failIf(self.server.check_nonce('1:foo:bar', 1))
+
+    def testCheckNonce(self):
+        nonce = self.server.get_nonce()
+
+        # Each nonce count is accepted once, in any order.
+        self.assert_(self.server.check_nonce(nonce, 2))
+        self.assert_(self.server.check_nonce(nonce, 1))
+        self.failIf(self.server.check_nonce(nonce, 1))
+        self.failIf(self.server.check_nonce(nonce, 2))
+        self.assert_(self.server.check_nonce(nonce, 3))
+
+        # Counts that lag too far behind are rejected.
+        window = self.server.nonce_window
+        self.assert_(self.server.check_nonce(nonce, window + 10))
+        self.failIf(self.server.check_nonce(nonce, 9))
+        self.assert_(self.server.check_nonce(nonce, 11))
+
+        # Without a nonce count, the nonce can be used once.
+        nonce = self.server.get_nonce()
+        self.assert_(self.server.check_nonce(nonce))
+        self.failIf(self.server.check_nonce(nonce))
+
+        # Each nonce is unique.
+        self.assertNotEqual(self.server.get_nonce(), self.server.get_nonce())
+
+        # Expired nonces.
+        def make_nonce(age):
+            timestamp = int(time.time()) - age
+            signature = self.server._sign_nonce(timestamp, 'salt')
+            return '%d:salt:%s' % (timestamp, signature)
+        lifetime = self.server.nonce_lifetime
+        self.failIf(self.server.check_nonce(make_nonce(lifetime + 1), 1))
+        self.assert_(self.server.check_nonce(make_nonce(lifetime - 60), 1))
+
+    def testNonceExpiry(self):
+        conn = HTTPConnection('localhost', self.port)
+        response, data = self._request(conn, 'GET', '/foo')
+        self.assertEqual(response.status, 401)
+        nonce, stale = self._get_nonce(response)
+        self.failIf(stale)
+
+        # An expired nonce is reported as stale.
+        self.server.nonce_lifetime = -1
+        auth = self._auth('GET', '/foo', nonce, 1)
+        response, data = self._request(conn, 'GET', '/foo', auth)
+        self.assertEqual(response.status, 401)
+        nonce, stale = self._get_nonce(response)
+        self.assert_(stale)
+
+        # Wrong credentials are not.
+        self.server.nonce_lifetime = 3600
+        auth = self._auth('GET', '/foo', nonce, 1, 'wrong')
+        response, data = self._request(conn, 'GET', '/foo', auth)
+        self.assertEqual(response.status, 401)
+        self.failIf(self._get_nonce(response)[1])
+
+        auth = self._auth('GET', '/foo', nonce, 1)
+        response, data = self._request(conn, 'GET', '/foo', auth)
+        self.assertEqual(response.status, 200)
+        conn.close()
+
+    def testKeepAlive(self):
+        conn = HTTPConnection('localhost', self.port)
+        response, data = self._request(conn, 'POST', '/', body = 'x' * 100)
+        self.assertEqual(response.status, 401)
+        nonce, stale = self._get_nonce(response)
+        sock = conn.sock
+        self.assert_(sock is not None)
+
+        # The nonce can be reused for multiple requests over the same
+        # connection.
+        for count in range(1, 4):
+            auth = self._auth('GET', '/foo', nonce, count)
+            response, data = self._request(conn, 'GET', '/foo', auth)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(data, 'GET /foo')
+        auth = self._auth('POST', '/', nonce, 4)
+        response, data = self._request(conn, 'POST', '/', auth, 'body')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, 'body')
+        self.assert_(conn.sock is sock)
+
+        # Every request must be authenticated, even on a connection
+        # that was authenticated before.
+        response, data = self._request(conn, 'GET', '/foo')
+        self.assertEqual(response.status, 401)
+
+        # Replayed requests are rejected.
+        auth = self._auth('GET', '/foo', nonce, 2)
+        response, data = self._request(conn, 'GET', '/foo', auth)
+        self.assertEqual(response.status, 401)
+        self.assert_(self._get_nonce(response)[1])
+        self.assert_(conn.sock is sock)
+        conn.close()
+
+    def testChunkedBody(self):
+        nonce = self.server.get_nonce()
+        sock  = socket.create_connection(('localhost', self.port))
+        for count in range(1, 3):
+            auth = self._auth('POST', '/', nonce, count)
+            sock.sendall('POST / HTTP/1.1\r\n'
+                         'Host: localhost\r\n'
+                         'Authorization: ' + auth + '\r\n'
+                         'Transfer-Encoding: chunked\r\n'
+                         '\r\n'
+                         '5\r\nhello\r\n'
+                         '7;foo=bar\r\n, world\r\n'
+                         '0\r\n'
+                         'X-Trailer: foo\r\n'
+                         '\r\n')
+            response = HTTPResponse(sock, method = 'POST')
+            response.begin()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.read(), 'hello, world')
+        sock.close()
+
+    def testBodySize(self):
+        # Large bodies of unauthenticated requests are not read; the
+        # connection is closed instead. The body is never sent here,
+        # so the response would time out if the server waited for it.
+        sock = socket.create_connection(('localhost', self.port))
+        sock.settimeout(5)
+        sock.sendall('POST / HTTP/1.1\r\n'
+                     'Host: localhost\r\n'
+                     'Content-Length: 1000000000\r\n'
+                     '\r\n')
+        response = HTTPResponse(sock, method = 'POST')
+        response.begin()
+        self.assertEqual(response.status, 401)
+        self.assertEqual(response.getheader('Connection'), 'close')
+        response.read()
+        self.assertEqual(sock.recv(1), '')
+        sock.close()
+
+        # Authenticated requests are rejected if the body is too large.
+        self.server.max_body_size = 10
+        nonce = self.server.get_nonce()
+        conn  = HTTPConnection('localhost', self.port)
+        auth  = self._auth('POST', '/', nonce, 1)
+        response, data = self._request(conn, 'POST', '/', auth, 'x' * 10)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, 'x' * 10)
+        auth  = self._auth('POST', '/', nonce, 2)
+        response, data = self._request(conn, 'POST', '/', auth, 'x' * 11)
+        self.assertEqual(response.status, 413)
+        self.assertEqual(response.getheader('Connection'), 'close')
+        conn.close()
+
+        sock = socket.create_connection(('localhost', self.port))
+        sock.settimeout(5)
+        auth = self._auth('POST', '/', nonce, 3)
+        sock.sendall('POST / HTTP/1.1\r\n'
+                     'Host: localhost\r\n'
+                     'Authorization: ' + auth + '\r\n'
+                     'Transfer-Encoding: chunked\r\n'
+                     '\r\n'
+                     '8\r\n12345678\r\n'
+                     '8\r\n12345678\r\n')
+        response = HTTPResponse(sock, method = 'POST')
+        response.begin()
+        self.assertEqual(response.status, 413)
+        sock.close()
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(HTTPdTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
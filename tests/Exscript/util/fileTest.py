@@ -60,6 +60,27 @@ class fileTest(unittest.TestCase):
         self.assertEqual(hostnames, expected_hosts)
         self.assertEqual(testvars, ['blah' for h in result])
 
+    def testIterHostsFromCsv(self):
+        from Exscript.util.file import iter_hosts_from_csv
+        result = iter_hosts_from_csv(self.csv_host_file.name)
+        self.failIf(isinstance(result, list))
+        result = list(result)
+        self.assertEqual([h.get_name() for h in result], expected_hosts)
+
+        # Consecutive lines for the same host are merged.
+        csv_file = NamedTemporaryFile()
+        csv_file.write('address\tvar\n')
+        csv_file.write('10.0.0.1\tfoo\n')
+        csv_file.write('10.0.0.1\tbar\n')
+        csv_file.write('10.0.0.2\tbaz\n')
+        csv_file.flush()
+        result = list(iter_hosts_from_csv(csv_file.name))
+        self.assertEqual([h.get_address() for h in result],
+                         ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(result[0].get('var'), ['foo', 'bar'])
+        self.assertEqual(result[1].get('var'), ['baz'])
+        csv_file.close()
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(fileTest)
 if __name__ == '__main__':
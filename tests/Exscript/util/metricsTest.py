@@ -0,0 +1,88 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import urllib2
+import Exscript.util.metrics
+from Exscript import Queue
+from Exscript.util.metrics import MetricsServer
+
+class metricsTest(unittest.TestCase):
+    CORRELATE = Exscript.util.metrics
+
+    def setUp(self):
+        self.queue = Queue(verbose = -1)
+        self.queue.stats.record('connect', 0.5)
+        self.queue.stats.record('account_wait', 2.0)
+        self.queue.stats.increment('bytes_received', 100)
+        self.queue.stats.increment('sessions', label = 'ios')
+
+    def tearDown(self):
+        self.queue.destroy()
+
+    def testCollect(self):
+        from Exscript.util.metrics import collect
+        metrics = dict((m[0], m) for m in collect(self.queue))
+        name, type, help, samples = metrics['exscript_queue_sessions_total']
+        self.assertEqual(type, 'counter')
+        self.assertEqual(samples, [('', {'queue': 'default',
+                                         'driver': 'ios'}, 1)])
+        samples = metrics['exscript_queue_account_waits_total'][3]
+        self.assertEqual(samples, [('', {'queue': 'default'}, 1)])
+        samples = metrics['exscript_queue_duration_seconds'][3]
+        self.assertEqual(len(samples), 5)
+
+        queues  = {'foo': self.queue, 'bar': Queue(verbose = -1)}
+        metrics = dict((m[0], m) for m in collect(queues))
+        samples = metrics['exscript_queue_jobs_total'][3]
+        self.assertEqual([s[1]['queue'] for s in samples], ['bar', 'foo'])
+        queues['bar'].destroy()
+
+    def testFormat(self):
+        from Exscript.util.metrics import format
+        result = format(self.queue)
+        self.assert_(result.endswith('\n'))
+        lines = result.split('\n')
+        self.assert_('# TYPE exscript_queue_depth gauge' in lines)
+        self.assert_('exscript_queue_depth{queue="default"} 0' in lines)
+        self.assert_('exscript_queue_bytes_received_total{queue="default"} 100'
+                     in lines)
+        expected = 'exscript_queue_duration_seconds_count' \
+                 + '{phase="connect",queue="default"} 1'
+        self.assert_(expected in lines)
+
+        result = format({'a"b': self.queue})
+        self.assert_('exscript_queue_depth{queue="a\\"b"} 0' in result)
+
+class MetricsServerTest(unittest.TestCase):
+    CORRELATE = MetricsServer
+
+    def setUp(self):
+        self.queue  = Queue(verbose = -1)
+        self.server = MetricsServer(('localhost', 0), self.queue)
+        self.url    = 'http://localhost:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+        self.queue.destroy()
+
+    def testConstructor(self):
+        self.assertEqual(self.server.user_data, self.queue)
+
+    def testStart(self):
+        self.server.start()
+        response = urllib2.urlopen(self.url + '/metrics')
+        self.assert_('text/plain' in response.info()['Content-type'])
+        self.assert_('exscript_queue_depth' in response.read())
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen, self.url + '/')
+
+    def testStop(self):
+        self.server.start()
+        self.server.stop()
+        self.assertEqual(self.server.thread, None)
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(metricsTest),
+                               loader.loadTestsFromTestCase(MetricsServerTest)])
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -0,0 +1,82 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import cProfile
+import pstats
+from tempfile import mkstemp
+from Exscript.util.profiler import Profile
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+def profile_fib(n):
+    profiler = cProfile.Profile()
+    profiler.runcall(fib, n)
+    profiler.create_stats()
+    return profiler.stats
+
+def get_fib_stats(stats):
+    for func, stat in stats.stats.iteritems():
+        if func[2] == 'fib':
+            return stat
+    return None
+
+class ProfileTest(unittest.TestCase):
+    CORRELATE = Profile
+
+    def setUp(self):
+        self.profile = Profile()
+
+    def testConstructor(self):
+        self.assertEqual(self.profile.get_count(), 0)
+        self.assertEqual(self.profile.get_stats(), None)
+
+    def testAdd(self):
+        self.profile.add(profile_fib(5))
+        self.profile.add(profile_fib(5))
+        self.assertEqual(self.profile.get_count(), 2)
+
+        # fib(5) results in 15 calls.
+        cc, nc, tt, ct, callers = get_fib_stats(self.profile.get_stats())
+        self.assertEqual(nc, 30)
+        self.assertEqual(cc, 2)
+
+    def testClear(self):
+        self.profile.add(profile_fib(3))
+        self.profile.clear()
+        self.assertEqual(self.profile.get_count(), 0)
+        self.assertEqual(self.profile.get_stats(), None)
+
+    def testGetCount(self):
+        self.assertEqual(self.profile.get_count(), 0)
+        self.profile.add({})
+        self.assertEqual(self.profile.get_count(), 1)
+
+    def testGetStats(self):
+        self.assertEqual(self.profile.get_stats(), None)
+        self.profile.add(profile_fib(3))
+        stats = self.profile.get_stats()
+        self.assert_(isinstance(stats, pstats.Stats))
+        self.assertEqual(get_fib_stats(stats)[1], 5)
+
+        # The returned object must not change when more data is added.
+        self.profile.add(profile_fib(3))
+        self.assertEqual(get_fib_stats(stats)[1], 5)
+
+    def testDump(self):
+        self.profile.add(profile_fib(4))
+        fd, filename = mkstemp()
+        os.close(fd)
+        try:
+            self.profile.dump(filename)
+            stats = pstats.Stats(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(get_fib_stats(stats)[1], 9)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ProfileTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
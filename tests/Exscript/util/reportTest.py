@@ -96,6 +96,56 @@ fake1
 fake3'''.strip() % file
         self.assertEqual(format(self.logger), expected)
 
+    def createStats(self):
+        from Exscript.util.stats import Stats
+        stats = Stats()
+        stats.record('connect', 0.5)
+        stats.record('connect', 1.5)
+        stats.record_host('host1', 2.0)
+        stats.record_host('host2', 5.0)
+        stats.record_command('show ip int 1', 0.25)
+        stats.record_command('show ip int 2', 0.25)
+        stats.record_command('ls', 0.125)
+        stats.record_completion(120)
+        stats.record_completion(130)
+        stats.record_completion(250)
+        return stats
+
+    def testLatency(self):
+        from Exscript.util.report import latency
+        expected = '''
+Latency (seconds):
+------------------
+Phase    Count    Min    p50    p90    p99    Max
+connect      2  0.500  0.504  1.500  1.500  1.500'''.strip()
+        self.assertEqual(latency(self.createStats()), expected)
+
+    def testSlowestHosts(self):
+        from Exscript.util.report import slowest_hosts
+        expected = '''
+Slowest hosts:
+--------------
+Host   Seconds
+host2    5.000'''.strip()
+        self.assertEqual(slowest_hosts(self.createStats(), 1), expected)
+
+    def testSlowestCommands(self):
+        from Exscript.util.report import slowest_commands
+        expected = '''
+Slowest commands:
+-----------------
+Command        Count    p95
+show ip int #      2  0.250
+ls                 1  0.125'''.strip()
+        self.assertEqual(slowest_commands(self.createStats()), expected)
+
+    def testThroughput(self):
+        from Exscript.util.report import throughput
+        result = throughput(self.createStats()).split('\n')
+        self.assertEqual(result[0], 'Throughput (jobs per 60 seconds):')
+        self.assertEqual(len(result), 6)
+        self.assertEqual([l.split()[-1] for l in result[3:]], ['2', '0', '1'])
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(reportTest)
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from Exscript.util.shared import SharedData
+
+class SharedDataTest(unittest.TestCase):
+    CORRELATE = SharedData
+
+    def setUp(self):
+        self.data   = {'a': [1, 2], 'b': 'foo', 3: {'x': None}}
+        self.shared = SharedData(self.data)
+
+    def tearDown(self):
+        self.shared.close()
+
+    def testConstructor(self):
+        shared = SharedData()
+        self.assertEqual(len(shared), 0)
+        self.assertEqual(shared.get('a'), None)
+
+        shared = SharedData((n, str(n)) for n in range(3))
+        self.assertEqual(dict(shared), {0: '0', 1: '1', 2: '2'})
+
+    def testGetItem(self):
+        self.assertEqual(len(self.shared), 3)
+        self.assertEqual(dict(self.shared), self.data)
+        self.assert_('a' in self.shared)
+        self.assert_('c' not in self.shared)
+        self.assertRaises(KeyError, self.shared.__getitem__, 'c')
+
+        # Values are copies.
+        self.shared['a'].append(3)
+        self.assertEqual(self.shared['a'], [1, 2])
+
+    def testFork(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, self.shared['b'])
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(read, 10), 'foo')
+        os.close(read)
+        os.close(write)
+
+    def testClose(self):
+        self.shared.close()
+        self.assertEqual(len(self.shared), 0)
+        self.shared.close()
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SharedDataTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -0,0 +1,239 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import pickle
+import Exscript.util.stats
+from Exscript.util.stats import Histogram, Stats, normalize_command
+
+class statsTest(unittest.TestCase):
+    CORRELATE = Exscript.util.stats
+
+    def testNormalizeCommand(self):
+        self.assertEqual(normalize_command('ls'), 'ls')
+        self.assertEqual(normalize_command(' show  int\tGi0/12 '),
+                         'show int Gi#/#')
+
+class HistogramTest(unittest.TestCase):
+    CORRELATE = Histogram
+
+    def testConstructor(self):
+        h = Histogram()
+        self.assertEqual(h.get_count(), 0)
+        h = Histogram(3, 1000)
+        self.assertEqual(h.get_count(), 0)
+
+    def testRecord(self):
+        h = Histogram()
+        h.record(1.0)
+        h.record(2.0, 3)
+        self.assertEqual(h.get_count(), 4)
+        self.assertEqual(h.get_total(), 7.0)
+
+    def testMerge(self):
+        h1 = Histogram()
+        h1.record(1.0)
+        h2 = Histogram()
+        h2.record(3.0)
+        h1.merge(h2)
+        self.assertEqual(h1.get_count(), 2)
+        self.assertEqual(h1.get_min(), 1.0)
+        self.assertEqual(h1.get_max(), 3.0)
+        h1.merge(Histogram())
+        self.assertEqual(h1.get_count(), 2)
+        self.assertRaises(ValueError, h1.merge, Histogram(3))
+
+    def testGetCount(self):
+        h = Histogram()
+        self.assertEqual(h.get_count(), 0)
+        h.record(0)
+        self.assertEqual(h.get_count(), 1)
+
+    def testGetMin(self):
+        h = Histogram()
+        self.assertEqual(h.get_min(), None)
+        h.record(2.5)
+        h.record(0.5)
+        self.assertEqual(h.get_min(), 0.5)
+
+    def testGetMax(self):
+        h = Histogram()
+        self.assertEqual(h.get_max(), None)
+        h.record(2.5)
+        h.record(0.5)
+        self.assertEqual(h.get_max(), 2.5)
+
+    def testGetMean(self):
+        h = Histogram()
+        self.assertEqual(h.get_mean(), None)
+        h.record(1)
+        h.record(2)
+        self.assertEqual(h.get_mean(), 1.5)
+
+    def testGetTotal(self):
+        h = Histogram()
+        self.assertEqual(h.get_total(), 0.0)
+        h.record(1.25)
+        h.record(2)
+        self.assertEqual(h.get_total(), 3.25)
+
+    def testGetPercentile(self):
+        h = Histogram()
+        self.assertEqual(h.get_percentile(50), None)
+        for n in range(1, 101):
+            h.record(n / 100.0)
+        self.assertEqual(h.get_percentile(100), 1.0)
+        for percentile in (1, 10, 50, 90, 99):
+            expected = percentile / 100.0
+            result   = h.get_percentile(percentile)
+            self.assert_(abs(result - expected) <= expected / 64)
+
+class StatsTest(unittest.TestCase):
+    CORRELATE = Stats
+
+    def setUp(self):
+        self.stats = Stats()
+
+    def testConstructor(self):
+        self.assertEqual(self.stats.get_phases(), [])
+
+    def testRecord(self):
+        self.stats.record('connect', 1.0)
+        self.stats.record('connect', 2.0)
+        self.assertEqual(self.stats.get_histogram('connect').get_count(), 2)
+
+    def testRecordCommand(self):
+        self.stats.record_command('show int 1', 1.0)
+        self.stats.record_command('show  int 2', 2.0)
+        commands = self.stats.get_slowest_commands()
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(commands[0][0], 'show int #')
+        self.assertEqual(commands[0][1].get_count(), 2)
+
+    def testRecordHost(self):
+        self.stats.record_host('host1', 1.0)
+        self.stats.record_host('host1', 2.0)
+        self.assertEqual(self.stats.get_slowest_hosts(), [('host1', 3.0)])
+
+    def testRecordCompletion(self):
+        self.stats.record_completion()
+        self.assertEqual(len(self.stats.get_throughput(60)), 1)
+        self.stats = Stats()
+        self.stats.record_completion(0)
+        self.stats.record_completion(1)
+        self.assertEqual(self.stats.get_throughput(60), [(0, 2)])
+
+    def testIncrement(self):
+        self.stats.increment('bytes_received', 10)
+        self.stats.increment('bytes_received')
+        self.stats.increment('sessions', label = 'ios')
+        self.assertEqual(self.stats.get_counter('bytes_received'), 11)
+        self.assertEqual(self.stats.get_counter('sessions', 'ios'), 1)
+
+    def testClear(self):
+        self.stats.record('login', 1.0)
+        self.stats.record_host('host1', 1.0)
+        self.stats.record_command('ls', 1.0)
+        self.stats.record_completion()
+        self.stats.increment('foo')
+        self.stats.clear()
+        self.assertEqual(self.stats.get_phases(), [])
+        self.assertEqual(self.stats.get_slowest_hosts(), [])
+        self.assertEqual(self.stats.get_slowest_commands(), [])
+        self.assertEqual(self.stats.get_throughput(), [])
+        self.assertEqual(self.stats.get_counter('foo'), 0)
+        self.stats.record('login', 1.0)
+        self.assertEqual(self.stats.get_phases(), ['login'])
+
+    def testMerge(self):
+        self.stats.record('login', 1.0)
+        self.stats.record_host('host1', 1.0)
+        other = Stats()
+        other.record('login', 2.0)
+        other.record('connect', 2.0)
+        other.record_host('host1', 2.0)
+        other.record_command('ls', 1.0)
+        other.record_completion(10)
+        other.increment('bytes_received', 5)
+
+        # Make sure that the object survives the trip through a pipe.
+        other = pickle.loads(pickle.dumps(other))
+        self.stats.merge(other)
+        self.assertEqual(self.stats.get_phases(), ['connect', 'login'])
+        self.assertEqual(self.stats.get_histogram('login').get_count(), 2)
+        self.assertEqual(self.stats.get_slowest_hosts(), [('host1', 3.0)])
+        self.assertEqual(len(self.stats.get_slowest_commands()), 1)
+        self.assertEqual(self.stats.get_throughput(), [(0, 1)])
+        self.assertEqual(self.stats.get_counter('bytes_received'), 5)
+
+    def testGetPhases(self):
+        self.assertEqual(self.stats.get_phases(), [])
+        self.stats.record('login', 1.0)
+        self.stats.record('connect', 1.0)
+        self.assertEqual(self.stats.get_phases(), ['connect', 'login'])
+
+    def testGetHistogram(self):
+        self.assertEqual(self.stats.get_histogram('login'), None)
+        self.stats.record('login', 1.0)
+        self.assertEqual(self.stats.get_histogram('login').get_max(), 1.0)
+
+        # The returned histogram is a copy.
+        histogram = self.stats.get_histogram('login')
+        self.stats.record('login', 2.0)
+        self.assertEqual(histogram.get_count(), 1)
+
+    def testGetCounter(self):
+        self.assertEqual(self.stats.get_counter('foo'), 0)
+        self.stats.increment('foo', 2)
+        self.stats.increment('foo', 3, 'bar')
+        self.assertEqual(self.stats.get_counter('foo'), 2)
+        self.assertEqual(self.stats.get_counter('foo', 'bar'), 3)
+
+    def testGetCounters(self):
+        self.assertEqual(self.stats.get_counters('sessions'), {})
+        self.stats.increment('sessions', label = 'ios')
+        self.stats.increment('sessions', label = 'ios')
+        self.stats.increment('sessions', label = 'junos')
+        self.stats.increment('foo')
+        self.assertEqual(self.stats.get_counters('sessions'),
+                         {'ios': 2, 'junos': 1})
+
+    def testGetSlowestHosts(self):
+        self.assertEqual(self.stats.get_slowest_hosts(), [])
+        self.stats.record_host('host1', 1.0)
+        self.stats.record_host('host2', 3.0)
+        self.stats.record_host('host3', 2.0)
+        result = self.stats.get_slowest_hosts(2)
+        self.assertEqual(result, [('host2', 3.0), ('host3', 2.0)])
+
+    def testGetSlowestCommands(self):
+        self.assertEqual(self.stats.get_slowest_commands(), [])
+        self.stats.record_command('ls', 1.0)
+        self.stats.record_command('pwd', 3.0)
+        self.stats.record_command('id', 2.0)
+        result = self.stats.get_slowest_commands(2)
+        self.assertEqual([c for c, h in result], ['pwd', 'id'])
+
+    def testGetThroughput(self):
+        self.assertEqual(self.stats.get_throughput(), [])
+        self.stats.record_completion(60)
+        self.stats.record_completion(61)
+        self.stats.record_completion(185)
+        result = self.stats.get_throughput(60)
+        self.assertEqual(result, [(60, 2), (120, 0), (180, 1)])
+
+    def testGetRate(self):
+        self.assertEqual(self.stats.get_rate(), 0.0)
+        self.stats.record_completion(100)
+        self.stats.record_completion(150)
+        self.stats.record_completion(160)
+        self.assertEqual(self.stats.get_rate(60, 160), 2 / 60.0)
+        self.assertEqual(self.stats.get_rate(10, 160), 0.1)
+        self.assertEqual(self.stats.get_rate(10, 1000), 0.0)
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(statsTest),
+                               loader.loadTestsFromTestCase(HistogramTest),
+                               loader.loadTestsFromTestCase(StatsTest)])
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
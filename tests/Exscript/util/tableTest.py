@@ -0,0 +1,211 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import Exscript.util.table
+from Exscript.util.table import get_parser, TableParser, ColumnParser, \
+                                FixedWidthParser, StateMachine
+
+brief = '''show ip interface brief
+Interface                  IP-Address      OK? Method Status                Protocol
+FastEthernet0/0            10.0.0.1        YES NVRAM  up                    up
+GigabitEthernet0/0/0.100   unassigned      YES unset  administratively down down
+Loopback0                  192.168.0.1     YES manual up                    up
+'''.splitlines()
+
+bgp = '''
+Neighbor        V           AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd
+10.0.0.2        4        65001   12345   12346      100    0    0 1d02h           5
+10.0.0.3        4   4200000001 123456789     12      100    0    0 never    Idle
+'''.splitlines()
+
+vlan = '''
+VLAN Name                             Status    Ports
+---- -------------------------------- --------- -------------------------------
+1    default                          active    Gi0/1, Gi0/2
+
+10   users                            active
+'''.splitlines()
+
+interfaces = r'''
+# Parses the output of "show interfaces".
+Value Filldown Chassis (\S+)
+Value Required Interface (\S+)
+Value Status (up|down|administratively down)
+Value Mtu (\d+)
+
+Start
+  ^Chassis ${Chassis}
+  ^\S+ is -> Continue.Record
+  ^${Interface} is ${Status}
+  ^\s+MTU ${Mtu} bytes
+  ^END -> End
+'''
+
+show_interfaces = '''Chassis R1
+Gi0/1 is up
+  MTU 1500 bytes
+Gi0/2 is administratively down
+  MTU 9000 bytes
+Gi0/3 is down
+END
+Gi0/4 is up
+'''.splitlines()
+
+class tableTest(unittest.TestCase):
+    CORRELATE = Exscript.util.table
+
+    def testGetParser(self):
+        parser = get_parser(ColumnParser, 'Interface Status')
+        self.assert_(isinstance(parser, ColumnParser))
+        self.assert_(get_parser(ColumnParser, 'Interface Status') is parser)
+        self.assert_(get_parser(ColumnParser, 'Interface') is not parser)
+        self.assert_(get_parser(FixedWidthParser, '3 *') is not parser)
+        self.assertRaises(ValueError, get_parser, FixedWidthParser, 'a')
+
+class TableParserTest(unittest.TestCase):
+    CORRELATE = TableParser
+
+    def testConstructor(self):
+        parser = TableParser('foo')
+        self.assertEqual(parser.definition, 'foo')
+
+    def testParse(self):
+        parser = ColumnParser('Interface Status')
+        result = parser.parse(brief)
+        self.assertEqual(result.keys(), ['Interface', 'Status'])
+        self.assertEqual(len(result['Status']), 3)
+
+        # The result of the last call is reused.
+        self.assert_(parser.parse(brief) is result)
+        self.assert_(parser.parse(list(brief)) is result)
+        self.assert_(parser.parse(brief[:-1]) is not result)
+
+        # Strings are split into lines.
+        self.assertEqual(parser.parse('\n'.join(brief)), result)
+
+class ColumnParserTest(unittest.TestCase):
+    CORRELATE = ColumnParser
+
+    def testConstructor(self):
+        self.assertRaises(ValueError, ColumnParser, '')
+        self.assertRaises(ValueError, ColumnParser, 'Status Status')
+
+    def testParse(self):
+        header = 'Interface IP-Address OK? Method Status Protocol'
+        result = ColumnParser(header).parse(brief)
+        self.assertEqual(result.keys(), header.split())
+        self.assertEqual(result['Interface'], ['FastEthernet0/0',
+                                               'GigabitEthernet0/0/0.100',
+                                               'Loopback0'])
+        self.assertEqual(result['IP-Address'], ['10.0.0.1',
+                                                'unassigned',
+                                                '192.168.0.1'])
+        self.assertEqual(result['Status'], ['up',
+                                            'administratively down',
+                                            'up'])
+        self.assertEqual(result['Protocol'], ['up', 'down', 'up'])
+
+        # Columns whose title is not listed belong to their left neighbor.
+        result = ColumnParser('IP-Address Status').parse(brief)
+        self.assertEqual(result['IP-Address'], ['FastEthernet0/0 10.0.0.1 YES NVRAM',
+                                                'GigabitEthernet0/0/0.100 unassigned YES unset',
+                                                'Loopback0 192.168.0.1 YES manual'])
+        self.assertEqual(result['Status'][1], 'administratively down down')
+
+        # Right aligned columns.
+        header = 'Neighbor V AS MsgRcvd MsgSent TblVer InQ OutQ ' \
+               + 'Up/Down State/PfxRcd'
+        result = ColumnParser(header).parse(bgp)
+        self.assertEqual(result['AS'], ['65001', '4200000001'])
+        self.assertEqual(result['MsgRcvd'], ['12345', '123456789'])
+        self.assertEqual(result['MsgSent'], ['12346', '12'])
+        self.assertEqual(result['State/PfxRcd'], ['5', 'Idle'])
+
+        # Missing header.
+        result = ColumnParser('Foo Bar').parse(brief)
+        self.assertEqual(result, {'Foo': [], 'Bar': []})
+
+class FixedWidthParserTest(unittest.TestCase):
+    CORRELATE = FixedWidthParser
+
+    def testConstructor(self):
+        self.assertRaises(ValueError, FixedWidthParser, '')
+        self.assertRaises(ValueError, FixedWidthParser, '1 0')
+        self.assertRaises(ValueError, FixedWidthParser, '* 1')
+
+    def testParse(self):
+        result = FixedWidthParser('5 33 10 *').parse(vlan)
+        self.assertEqual(result.keys(), [0, 1, 2, 3])
+        self.assertEqual(result[0], ['1', '10'])
+        self.assertEqual(result[1], ['default', 'users'])
+        self.assertEqual(result[3], ['Gi0/1, Gi0/2', ''])
+
+        # Without a separator line, all lines are rows.
+        result = FixedWidthParser('5 5').parse(['a    b    c', 'd'])
+        self.assertEqual(result, {0: ['a', 'd'], 1: ['b', '']})
+
+class StateMachineTest(unittest.TestCase):
+    CORRELATE = StateMachine
+
+    def testConstructor(self):
+        StateMachine(interfaces)
+        self.assertRaises(ValueError, StateMachine, 'Value X (a)')
+        self.assertRaises(ValueError, StateMachine, 'Start\n  ^$X')
+        self.assertRaises(ValueError, StateMachine, 'Value List X (a)')
+        self.assertRaises(ValueError, StateMachine, 'Start\n  ^a -> Foo')
+        self.assertRaises(ValueError, StateMachine, 'Start\n  ^a -> Next.Foo')
+        self.assertRaises(ValueError, StateMachine, 'Start\n  ^a -> Continue Start')
+        self.assertRaises(ValueError, StateMachine, 'Start\n  ^(a')
+
+    def testParse(self):
+        result = StateMachine(interfaces).parse(show_interfaces)
+        self.assertEqual(result.keys(), ['Chassis', 'Interface', 'Status', 'Mtu'])
+        self.assertEqual(result['Chassis'], ['R1', 'R1'])
+        self.assertEqual(result['Interface'], ['Gi0/1', 'Gi0/2'])
+        self.assertEqual(result['Status'], ['up', 'administratively down'])
+        self.assertEqual(result['Mtu'], ['1500', '9000'])
+
+        # Without the End state, the last record is stored at EOF.
+        definition = interfaces.replace(' -> End', '')
+        result     = StateMachine(definition).parse(show_interfaces)
+        self.assertEqual(result['Interface'], ['Gi0/1', 'Gi0/2', 'Gi0/3', 'Gi0/4'])
+        self.assertEqual(result['Mtu'], ['1500', '9000', '', ''])
+
+        # Rules with inline flags are not combined, but work the same.
+        definition = interfaces.replace('bytes', '(?i)BYTES')
+        machine    = StateMachine(definition)
+        self.assertEqual(machine.masters['Start'], None)
+        self.assertEqual(machine.parse(show_interfaces)['Mtu'],
+                         ['1500', '9000'])
+
+        # Fillup, Clearall, state changes and errors.
+        definition = r'''
+Value Fillup Host (\S+)
+Value Key Name (\w+)
+
+Start
+  ^BEGIN -> Items
+
+Items
+  ^item ${Name} -> Record
+  ^host ${Host}
+  ^reset -> Clearall
+  ^bad -> Error "unexpected line"
+'''
+        result = StateMachine(definition).parse(['item a', 'BEGIN',
+                                                 'item b', 'item c',
+                                                 'host h1', 'item d'])
+        self.assertEqual(result['Name'], ['b', 'c', 'd'])
+        self.assertEqual(result['Host'], ['h1', 'h1', 'h1'])
+        machine = StateMachine(definition)
+        self.assertRaises(ValueError, machine.parse, ['BEGIN', 'bad'])
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(tableTest),
+                               loader.loadTestsFromTestCase(TableParserTest),
+                               loader.loadTestsFromTestCase(ColumnParserTest),
+                               loader.loadTestsFromTestCase(FixedWidthParserTest),
+                               loader.loadTestsFromTestCase(StateMachineTest)])
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
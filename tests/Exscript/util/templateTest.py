@@ -0,0 +1,372 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import pickle
+import tempfile
+import threading
+import Exscript.util.template
+from Exscript                       import Account
+from Exscript.protocols             import Dummy
+from Exscript.emulators             import VirtualDevice
+from Exscript.interpreter           import Parser
+from Exscript.interpreter.Exception import PermissionError
+from Exscript.util                  import template
+
+test_tmpl = r'''show version{extract /^(\S+) (\S+)/ as a, b}
+echo $host
+'''
+
+code_tmpl = r'''{y = ""
+loop from 0 to 5 as i
+    x = i * 2 . "-$i"
+    if x matches /^4/ or i is 4
+        append x to y
+    end
+end
+z = "a" + 1}
+'''
+
+class BrokenParser(Parser):
+    def parse(self, *args, **kwargs):
+        raise Exception('the template was parsed')
+
+unpickled = []
+def _unpickle():
+    unpickled.append(True)
+
+class Unpickled(object):
+    def __reduce__(self):
+        return _unpickle, ()
+
+class templateTest(unittest.TestCase):
+    CORRELATE = Exscript.util.template
+
+    def setUp(self):
+        template._cache.clear()
+        self.tempfile = None
+
+    def tearDown(self):
+        if self.tempfile is not None:
+            os.remove(self.tempfile)
+            if os.path.exists(self.tempfile + 'c'):
+                os.remove(self.tempfile + 'c')
+
+    def _connect(self, hostname):
+        device = VirtualDevice(hostname, echo = True)
+        device.add_command('show version', 'version 1.0\nfoo bar')
+        device.add_command(r'echo (\S+)', lambda x: x.split()[1])
+        conn = Dummy(device = device)
+        conn.connect(hostname)
+        conn.login(Account('user', 'test'))
+        return conn
+
+    def _write_template(self, content):
+        fd, self.tempfile = tempfile.mkstemp()
+        os.write(fd, content)
+        os.close(fd)
+        return self.tempfile
+
+    def testCompile(self):
+        program = template.compile(test_tmpl, host = 'x')
+        self.assertEqual(len(template._cache), 1)
+
+        # Only the names of the variables are part of the cache key.
+        self.assert_(template.compile(test_tmpl, host = 'y') is program)
+        self.assertEqual(len(template._cache), 1)
+
+        # Different options produce a different program.
+        other = template.compile(test_tmpl, strip_command = False, host = 'x')
+        self.failIf(other is program)
+        self.assertEqual(len(template._cache), 2)
+
+        # Compiled programs may be sent to other processes.
+        self.assert_(pickle.loads(pickle.dumps(program, 2)))
+
+        # The cached program does not keep the values of the caller.
+        program = template.compile(test_tmpl, host = 'secret')
+        self.assertNotEqual(program.init_variables['host'], ['secret'])
+        self.assertNotEqual(program.init_variables['host'], ['x'])
+        self.failIf('secret' in pickle.dumps(program, 2))
+
+        self.assertRaises(Exception, template.compile, test_tmpl)
+        self.assertRaises(Exception, template.compile, '{extract')
+
+        # Runtime errors point to the failing statement, and the
+        # statements that ran before it took effect.
+        program = template.compile(code_tmpl)
+        program.variables = program.init_variables.copy()
+        try:
+            program.code(program.variables)
+        except Exception, e:
+            error = str(e)
+        else:
+            self.fail('no runtime error')
+        self.assertEqual(program.variables['y'], ['', '4-2', '8-4'])
+        self.assert_(error.endswith('not a number in undefined:8'), error)
+
+    def testCompileFile(self):
+        filename = self._write_template(test_tmpl)
+        program  = template.compile_file(filename, host = 'x')
+        self.assert_(template.compile_file(filename, host = 'y') is program)
+        self.failIf(os.path.exists(filename + 'c'))
+        self.assertRaises(Exception, template.compile_file, filename)
+
+    def testPrecompileFile(self):
+        filename = self._write_template(test_tmpl)
+        artifact = template.precompile_file(filename, host = 'x')
+        self.assertEqual(artifact, filename + 'c')
+        template.precompile_file(filename, strip_command = False, host = 'x')
+        template._cache.clear()
+
+        # Fresh artifacts are used instead of parsing the template.
+        template.Parser = BrokenParser
+        try:
+            template.test_file(filename, host = 'y')
+            template.compile_file(filename, strip_command = False, host = 'y')
+            conn = self._connect('one')
+            vars = template.eval_file(conn, filename, host = 'z')
+            self.assertEqual(vars['a'], ['version', 'foo'])
+            self.assertEqual(vars['__response__'], ['z'])
+            self.assertRaises(Exception,
+                              template.compile_file,
+                              filename,
+                              parser_args = {'stream': True},
+                              host        = 'x')
+
+            # The artifact is stale once the template is modified.
+            template._cache.clear()
+            mtime = os.path.getmtime(filename) - 10
+            os.utime(filename, (mtime, mtime))
+            self.assertRaises(Exception,
+                              template.test_file,
+                              filename,
+                              host = 'x')
+        finally:
+            template.Parser = Parser
+        template.test_file(filename, host = 'x')
+
+        self.assertRaises(Exception, template.precompile_file, filename)
+
+        # The values of the variables are not stored in the artifact.
+        template.precompile_file(filename, host = 'hunter2')
+        with open(artifact, 'rb') as fp:
+            self.failIf('hunter2' in fp.read())
+
+        # Artifacts are never unpickled when parsing in secure mode.
+        with open(artifact, 'wb') as fp:
+            pickle.dump(Unpickled(), fp, 2)
+        template._cache.clear()
+        template._compile(filename, test_tmpl, {'secure': True}, host = 'x')
+        self.assertEqual(unpickled, [])
+        template.compile_file(filename, host = 'x')
+        self.assertEqual(unpickled, [True])
+
+    def testTest(self):
+        template.test(test_tmpl, host = 'x')
+        self.assertRaises(Exception, template.test, test_tmpl)
+
+    def testTestSecure(self):
+        template.test_secure('{connection.sendline("exit")}')
+        self.assertRaises(PermissionError,
+                          template.test_secure,
+                          '{sys.exec("ls")}')
+
+    def testTestFile(self):
+        filename = self._write_template(test_tmpl)
+        template.test_file(filename, host = 'x')
+        self.assertRaises(Exception, template.test_file, filename)
+
+    def testEval(self):
+        conn1 = self._connect('one')
+        conn2 = self._connect('two')
+        vars1 = template.eval(conn1, test_tmpl, host = 'x')
+        vars2 = template.eval(conn2, test_tmpl, host = 'y')
+        self.assertEqual(len(template._cache), 1)
+        self.assertEqual(vars1['a'], ['version', 'foo'])
+        self.assertEqual(vars1['b'], ['1.0', 'bar'])
+        self.assertEqual(vars1['__hostname__'], ['one'])
+        self.assertEqual(vars1['__username__'], ['user'])
+        self.assertEqual(vars1['__response__'], ['x'])
+        self.assertEqual(vars2['__hostname__'], ['two'])
+        self.assertEqual(vars2['__response__'], ['y'])
+        self.assert_(vars2['__connection__'] is conn2)
+
+        # The same compiled program may be run by many threads at once.
+        errors = []
+        def run(n):
+            conn = self._connect('host%d' % n)
+            try:
+                for i in range(10):
+                    vars = template.eval(conn, test_tmpl, host = str(n))
+                    self.assertEqual(vars['__hostname__'], ['host%d' % n])
+                    self.assertEqual(vars['__response__'], [str(n)])
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = run, args = (n,))
+                   for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(template._cache), 1)
+
+        # Values that a run did not bind are shared with the next run,
+        # so they can not be modified in place.
+        tmpl  = '{if 0 is 1}\nshow version{extract /(\S+)/ as c}\n{end}'
+        vars = template.eval(conn1, tmpl)
+        self.assertEqual(vars['c'], [])
+        self.assertRaises(TypeError, vars['c'].append, 'x')
+        self.assertRaises(TypeError, vars['c'].__setslice__, 0, 0, ['x'])
+        vars = template.eval(conn2, tmpl)
+        self.assertEqual(vars['c'], [])
+
+        # Regular expressions may contain variables.
+        tmpl = r'show version{extract /^(\S+) ($word)/ as a, b}'
+        vars = template.eval(conn1, tmpl, word = 'bar')
+        self.assertEqual(vars['a'], ['foo'])
+        vars = template.eval(conn1, tmpl, word = '1.0')
+        self.assertEqual(vars['a'], ['version'])
+        tmpl = r'show version{extract /^(\S+)/ as a, b}'
+        self.assertRaises(Exception, template.eval, conn1, tmpl)
+
+        # Patterns that are anchored at the start of the line are
+        # matched against all lines at once, other patterns line by
+        # line. Either way, only the first match of each line counts.
+        lines = ['foo 1 foo 2', 'bar 3', '', 'foo 4 ', 'foo 5']
+        for regex in (r'^foo (\d)', r'foo (\d)', r'^foo (\d)\s*$word'):
+            tmpl = '{extract /%s/ as a from lines}' % regex
+            vars = template.eval(conn1, tmpl, lines = lines, word = '')
+            self.assertEqual(vars['a'], ['1', '4', '5'])
+            lines2 = ['foo 6\nfoo 7']
+            vars   = template.eval(conn1, tmpl, lines = lines2, word = '')
+            self.assertEqual(vars['a'], ['6'])
+
+        # Errors in one run do not affect the next run.
+        tmpl    = '{x = "foo $word"}'
+        program = template.compile(tmpl, word = 'bar')
+        errors  = []
+        for i in range(2):
+            try:
+                program.execute(variables = {'word': None})
+            except Exception, e:
+                errors.append(str(e))
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(errors[0], errors[1])
+        self.assert_("\n          '---'\n" in errors[0], errors[0])
+        vars = template.eval(conn1, tmpl, word = 'bar')
+        self.assertEqual(vars['x'], ['foo bar'])
+
+        # The values of the variables are not copied, but they are never
+        # modified in place either.
+        names = ['a', 'b']
+        tmpl  = r'''show version{extract /^(\S+)/ into names}
+{append "c" to names
+loop names as name
+    append name to names
+end}'''
+        vars = template.eval(conn1, tmpl, names = names)
+        self.assertEqual(names, ['a', 'b'])
+        self.assertEqual(vars['names'], ['a', 'b', 'version', 'foo', 'c',
+                                         'a', 'b', 'version', 'foo', 'c'])
+
+        # In streaming mode, the extract statements that follow a command
+        # are applied to the response while it is read.
+        tmpl = r'''show version{extract /^(\S+)/ as a
+extract /^\S+ (\S+)/ into b}
+show version
+{extract /(bar)/ as c
+x = __response__}'''
+        vars = template.eval(conn1, tmpl, b = 'x')
+        self.assertEqual(vars['x'], ['version 1.0', 'foo bar'])
+        options  = {'stream': True}
+        streamed = template.eval(conn1, tmpl, parser_args = options, b = 'x')
+        self.assertEqual(streamed['x'], [])
+        self.failIf('version' in conn1.response)
+        for key in ('a', 'b', 'c'):
+            self.assertEqual(streamed[key], vars[key])
+        self.assertEqual(streamed['b'], ['x', '1.0', 'bar'])
+        self.assertEqual(streamed['c'], ['bar'])
+        vars = template.eval(conn1, tmpl, False, options, b = 'x')
+        self.assertEqual(vars['a'], ['show', 'version', 'foo'])
+
+        # Parser options never collide with template variables.
+        vars = template.eval(conn1, tmpl, b = 'x', stream = True)
+        self.assertEqual(vars['stream'], [True])
+        self.assertEqual(vars['x'], ['version 1.0', 'foo bar'])
+        self.assertRaises(TypeError,
+                          template.eval,
+                          conn1,
+                          tmpl,
+                          parser_args = {'strip_command': False})
+
+        # Consecutive commands may be sent without waiting for the
+        # prompt of each command.
+        tmpl = r'''echo $host
+show version
+show version{extract /^(\S+) (\S+)/ as a, b}
+echo $host
+'''
+        vars     = template.eval(conn1, tmpl, host = 'x')
+        executed = []
+        execute  = conn1.execute
+        conn1.execute = lambda cmd: executed.append(cmd) or execute(cmd)
+        for window in (2, 10):
+            piped = template.eval(conn1,
+                                  tmpl,
+                                  parser_args = {'window': window},
+                                  host        = 'x')
+            for key in ('a', 'b', '__response__'):
+                self.assertEqual(piped[key], vars[key])
+        self.assertEqual(executed, ['echo x', 'echo x'])
+
+        # A variable named window is passed to the template.
+        del executed[:]
+        vars = template.eval(conn1, tmpl, window = 10, host = 'x')
+        self.assertEqual(vars['window'], [10])
+        self.assertEqual(len(executed), 4)
+
+        # Tables are parsed by the functions of the table library, and
+        # each of their columns may be assigned to a variable.
+        tmpl  = r"""{header = "Interface Status"
+a = table.column(lines, header, "Interface")
+b = table.column(lines, header, "Status")
+c = table.fixed(lines, "10 *", 1)
+d = table.fsm(lines, fsm, "Name")}"""
+        lines = ['Interface Status', 'Gi0/1     up', 'Gi0/2     admin down']
+        fsm   = ['Value Name (\S+)', '', 'Start', '  ^${Name}\s+up -> Record']
+        vars  = template.eval(conn1, tmpl, lines = lines, fsm = fsm)
+        self.assertEqual(vars['a'], ['Gi0/1', 'Gi0/2'])
+        self.assertEqual(vars['b'], ['up', 'admin down'])
+        self.assertEqual(vars['c'], ['Status', 'up', 'admin down'])
+        self.assertEqual(vars['d'], ['Gi0/1'])
+        tmpl = r'{a = table.column(lines, "Interface Status", "Foo")}'
+        self.assertRaises(Exception, template.eval, conn1, tmpl, lines = lines)
+
+    def testEvalFile(self):
+        filename = self._write_template(test_tmpl)
+        conn     = self._connect('one')
+        vars     = template.eval_file(conn, filename, host = 'x')
+        self.assertEqual(vars['__filename__'], [filename])
+        self.assertEqual(vars['__response__'], ['x'])
+
+    def testPaste(self):
+        conn = self._connect('one')
+        vars = template.paste(conn, 'echo $host\n', host = 'x')
+        self.assertEqual(vars['__hostname__'], ['one'])
+        self.assertRaises(Exception,
+                          template.paste,
+                          conn,
+                          test_tmpl,
+                          host = 'x')
+
+    def testPasteFile(self):
+        filename = self._write_template('echo $host\n')
+        conn     = self._connect('one')
+        vars     = template.paste_file(conn, filename, host = 'x')
+        self.assertEqual(vars['__hostname__'], ['one'])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(templateTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -0,0 +1,157 @@
+import sys, unittest, re, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import json
+import pickle
+from tempfile import mkstemp
+import Exscript.util.trace
+from Exscript.util.trace import Span, FileExporter
+
+class FakeExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+class traceTest(unittest.TestCase):
+    CORRELATE = Exscript.util.trace
+
+    def tearDown(self):
+        Exscript.util.trace.set_exporter(None)
+
+    def testNewTraceId(self):
+        from Exscript.util.trace import new_trace_id
+        self.assert_(re.match(r'^[0-9a-f]{32}$', new_trace_id()))
+        self.assertNotEqual(new_trace_id(), new_trace_id())
+
+    def testNewSpanId(self):
+        from Exscript.util.trace import new_span_id
+        self.assert_(re.match(r'^[0-9a-f]{16}$', new_span_id()))
+        self.assertNotEqual(new_span_id(), new_span_id())
+
+    def testSetExporter(self):
+        from Exscript.util.trace import set_exporter, get_exporter
+        self.assertEqual(get_exporter(), None)
+        exporter = FakeExporter()
+        set_exporter(exporter)
+        self.assertEqual(get_exporter(), exporter)
+        set_exporter(None)
+        self.assertEqual(get_exporter(), None)
+
+    def testGetExporter(self):
+        pass # Tested in testSetExporter().
+
+    def testExport(self):
+        from Exscript.util.trace import set_exporter, export
+        span = Span('order')
+        span.create_child('check')
+        export(span) # No exporter, must not fail.
+
+        exporter = FakeExporter()
+        set_exporter(exporter)
+        export(span)
+        self.assertEqual([s.name for s in exporter.spans], ['order', 'check'])
+
+class SpanTest(unittest.TestCase):
+    CORRELATE = Span
+
+    def testConstructor(self):
+        span = Span('foo')
+        self.assertEqual(span.name, 'foo')
+        self.assertEqual(len(span.trace_id), 32)
+        self.assertEqual(len(span.span_id), 16)
+        self.assertEqual(span.parent_id, None)
+        self.assert_(span.start is not None)
+
+        span = Span('bar', 'trace', 'parent', 'span', 0, host = 'h')
+        self.assertEqual(span.get_context(), ('trace', 'span'))
+        self.assertEqual(span.parent_id, 'parent')
+        self.assertEqual(span.start, 0)
+        self.assertEqual(span.attributes, {'host': 'h'})
+
+        # Spans are passed between processes.
+        span = pickle.loads(pickle.dumps(span))
+        self.assertEqual(span.get_context(), ('trace', 'span'))
+
+    def testGetContext(self):
+        span = Span('foo', span_id = 'span')
+        self.assertEqual(span.get_context(), (span.trace_id, 'span'))
+
+    def testCreateChild(self):
+        span  = Span('foo')
+        child = span.create_child('bar', 10.0, host = 'h')
+        self.assertEqual(span.children, [child])
+        self.assertEqual(child.trace_id, span.trace_id)
+        self.assertEqual(child.parent_id, span.span_id)
+        self.assertNotEqual(child.span_id, span.span_id)
+        self.assertEqual(child.start, 10.0)
+        self.assertEqual(child.attributes, {'host': 'h'})
+
+    def testSetAttribute(self):
+        span = Span('foo')
+        span.set_attribute('status', 'ok')
+        self.assertEqual(span.attributes, {'status': 'ok'})
+
+    def testFinish(self):
+        span  = Span('foo', start = 1.0)
+        child = span.create_child('bar', 2.0)
+        self.assertEqual(span.end, None)
+        span.finish(5.0)
+        self.assertEqual(span.end, 5.0)
+        self.assertEqual(child.end, 5.0)
+
+        span = Span('foo')
+        span.finish()
+        self.assert_(span.end >= span.start)
+
+    def testGetDuration(self):
+        span = Span('foo', start = 1.0)
+        self.assertEqual(span.get_duration(), None)
+        span.finish(3.5)
+        self.assertEqual(span.get_duration(), 2.5)
+
+    def testTodict(self):
+        span = Span('foo', 'trace', 'parent', 'span', 1.0, host = 'h')
+        span.finish(2.0)
+        self.assertEqual(span.todict(), {'name':       'foo',
+                                         'trace_id':   'trace',
+                                         'span_id':    'span',
+                                         'parent_id':  'parent',
+                                         'start':      1.0,
+                                         'end':        2.0,
+                                         'duration':   1.0,
+                                         'attributes': {'host': 'h'}})
+
+class FileExporterTest(unittest.TestCase):
+    CORRELATE = FileExporter
+
+    def setUp(self):
+        fd, self.filename = mkstemp()
+        os.close(fd)
+        self.exporter = FileExporter(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def testConstructor(self):
+        self.assertEqual(self.exporter.filename, self.filename)
+
+    def testExport(self):
+        span = Span('foo', start = 1.0)
+        span.finish(2.0)
+        self.exporter.export(span)
+        self.exporter.export(Span('bar', span.trace_id, span.span_id))
+        with open(self.filename) as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual([l['name'] for l in lines], ['foo', 'bar'])
+        self.assertEqual(lines[0]['duration'], 1.0)
+        self.assertEqual(lines[1]['parent_id'], span.span_id)
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(traceTest),
+                               loader.loadTestsFromTestCase(SpanTest),
+                               loader.loadTestsFromTestCase(FileExporterTest)])
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -45,6 +45,14 @@ class PipelineTest(unittest.TestCase):
         self.assertEqual(self.pipeline.get_from_name('foo'), item1)
         self.assertEqual(self.pipeline.get_from_name('bar'), item2)
 
+    def testGetFromId(self):
+        item1 = object()
+        self.assertEqual(self.pipeline.get_from_id('foo'), None)
+
+        id1 = self.pipeline.append(item1)
+        self.assertEqual(self.pipeline.get_from_id('foo'), None)
+        self.assertEqual(self.pipeline.get_from_id(id1), item1)
+
     def testHasId(self):
         item1 = object()
         item2 = object()
@@ -158,6 +158,17 @@ class WorkQueueTest(unittest.TestCase):
         self.wq.pause()
         self.assert_(self.wq.is_paused())
 
+    def testGetJobFromId(self):
+        self.wq.pause()
+        self.assertEqual(self.wq.get_job_from_id('foo'), None)
+        id  = self.wq.enqueue(nop, 'nop')
+        job = self.wq.get_job_from_id(id)
+        self.assertEqual(job.id, id)
+        self.assertEqual(job.name, 'nop')
+        self.wq.unpause()
+        self.wq.wait_until_done()
+        self.assertEqual(self.wq.get_job_from_id(id), None)
+
     def testGetRunningJobs(self):
         def function(job):
             self.assertEqual(self.wq.get_running_jobs(), [job])
@@ -0,0 +1,123 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import os
+import time
+from threading              import Thread, Lock
+from Exscript.servers.HTTPd import HTTPd, RequestHandler
+from Exscriptd.Client       import Client
+
+class CountHandler(RequestHandler):
+    """
+    Responds to /task/count/ with the number of requests that were
+    handled, and counts the connections that were opened.
+    """
+    timeout = 5
+
+    def setup(self):
+        RequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            count = self.server.requests
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(str(count))
+
+class ClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPd(('localhost', 0), CountHandler)
+        self.server.add_account('user', 'password')
+        self.server.lock        = Lock()
+        self.server.connections = 0
+        self.server.requests    = 0
+        self.thread = Thread(target = self.server.serve_forever,
+                             kwargs = {'poll_interval': .05})
+        self.thread.daemon = True
+        self.thread.start()
+        address     = 'localhost:%d' % self.server.server_address[1]
+        self.client = Client(address, 'user', 'password')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testConstructor(self):
+        self.assertEqual(self.client.nonce, None)
+        self.assertEqual(self.client.pool.idle, [])
+
+    def testDigest(self):
+        # The first request fetches a nonce, which is then reused.
+        for i in range(1, 4):
+            self.assertEqual(self.client.count_tasks(), i)
+        self.assertEqual(self.client.nonce_count, 3)
+        self.assertEqual(self.server.connections, 1)
+
+        # If the nonce is no longer valid, a new one is fetched.
+        nonce              = self.client.nonce
+        self.server.secret = os.urandom(16)
+        self.assertEqual(self.client.count_tasks(), 4)
+        self.assertNotEqual(self.client.nonce, nonce)
+        self.assertEqual(self.client.nonce_count, 1)
+
+        # Invalid credentials are not retried.
+        self.client.password = 'wrong'
+        self.assertRaises(Exception, self.client.count_tasks)
+        self.assertEqual(self.server.requests, 4)
+
+    def testPool(self):
+        self.client.count_tasks()
+        self.assertEqual(len(self.client.pool.idle), 1)
+        self.assertEqual(self.server.connections, 1)
+
+        # Concurrent requests use separate connections, and sharing
+        # the nonce does not lead to rejected requests.
+        errors = []
+        def run():
+            try:
+                for i in range(5):
+                    self.client.count_tasks()
+            except Exception, e:
+                errors.append(e)
+        threads = [Thread(target = run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.requests, 21)
+        self.assert_(1 <= len(self.client.pool.idle) <= 4)
+        self.assertEqual(self.server.connections, len(self.client.pool.idle))
+
+        # Idle connections that were closed by the server are replaced.
+        self.client.pool.max_idle = 1
+        self.client.close()
+        CountHandler.timeout = .1
+        try:
+            self.assertEqual(self.client.count_tasks(), 22)
+            connections = self.server.connections
+            time.sleep(.5)
+            self.assertEqual(self.client.count_tasks(), 23)
+        finally:
+            CountHandler.timeout = 5
+        self.assertEqual(self.server.connections, connections + 1)
+        self.assertEqual(len(self.client.pool.idle), 1)
+
+    def testClose(self):
+        self.client.count_tasks()
+        conn = self.client.pool.idle[0]
+        self.client.close()
+        self.assertEqual(self.client.pool.idle, [])
+        self.assertEqual(conn.sock, None)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ClientTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
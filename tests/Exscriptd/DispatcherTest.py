@@ -0,0 +1,313 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import shutil
+import logging
+from tempfile             import NamedTemporaryFile, mkdtemp
+from sqlalchemy           import create_engine
+from sqlalchemy.pool      import NullPool
+from Exscript.util.event  import Event
+from Exscriptd.Order      import Order
+from Exscriptd.OrderDB    import OrderDB
+from Exscriptd.Dispatcher import Dispatcher
+
+class FakeWorkQueue(object):
+    def __init__(self):
+        self.job_init_event      = Event()
+        self.job_started_event   = Event()
+        self.job_error_event     = Event()
+        self.job_succeeded_event = Event()
+        self.job_aborted_event   = Event()
+        self.jobs                = {}
+
+    def get_job_from_id(self, job_id):
+        return self.jobs.get(job_id)
+
+class FakeQueue(object):
+    def __init__(self):
+        self.workqueue = FakeWorkQueue()
+
+class FakeJob(object):
+    def __init__(self, id):
+        self.id   = id
+        self.data = {}
+
+class FakeService(object):
+    """
+    Creates one task per name when an order is entered, and assigns
+    a job id to each of them. The jobs are started before they are
+    bound to their task, by calling the given function.
+    """
+    def __init__(self, names, queue_name = None, start_jobs = None):
+        self.name       = 'fooservice'
+        self.names      = names
+        self.queue_name = queue_name
+        self.start_jobs = start_jobs
+        self.parent     = None
+        self.tasks      = []
+
+    def get_queue_name(self):
+        return self.queue_name
+
+    def check(self, order):
+        return True
+
+    def enter(self, order):
+        self.tasks = self.parent.create_tasks(order, self.names)
+        if self.start_jobs is not None:
+            self.start_jobs(['job-' + name for name in self.names])
+        for task in self.tasks:
+            task.set_job_id('job-' + task.get_name())
+
+class LogRecorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = NamedTemporaryFile()
+        self.engine = create_engine('sqlite:///' + self.dbfile.name,
+                                    poolclass = NullPool)
+        self.db     = OrderDB(self.engine)
+        self.db.install()
+        self.logdir = mkdtemp()
+        self.log    = LogRecorder()
+        self.logger = logging.getLogger('DispatcherTest')
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.log)
+
+        # A long interval, so that nothing is written in the background.
+        self.dispatcher = Dispatcher(self.db,
+                                     {},
+                                     self.logger,
+                                     self.logdir,
+                                     flush_interval = 3600)
+        self.service = FakeService(['task1', 'task2'])
+        self.dispatcher.service_added(self.service)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+        self.logger.removeHandler(self.log)
+        self.dbfile.close()
+        shutil.rmtree(self.logdir)
+
+    def _enter_order(self):
+        order = Order('fooservice')
+        self.db.add_order(order)
+        self.dispatcher._enter_order(self.service, order)
+        return order
+
+    def _get_db_progress(self, task):
+        return self.db.get_task(id = task.id).get_progress()
+
+    def assertIndexMatchesDatabase(self):
+        dispatcher = self.dispatcher
+        dispatcher.flush()
+        open_orders = [o for o in self.db.get_orders()
+                       if o.get_closed_timestamp() is None]
+        open_tasks  = [t for t in self.db.get_tasks()
+                       if t.get_closed_timestamp() is None]
+
+        self.assertEqual(sorted(dispatcher.orders),
+                         sorted(o.id for o in open_orders))
+        self.assertEqual(sorted(dispatcher.tasks),
+                         sorted(t.job_id for t in open_tasks))
+        for job_id, task in dispatcher.tasks.iteritems():
+            self.assertEqual(self.db.get_task(job_id = job_id).id, task.id)
+        for order in open_orders:
+            tasks    = self.db.get_tasks(order_id = order.id)
+            task_ids = [t.id for t in dispatcher.order_tasks[order.id]]
+            self.assertEqual(sorted(task_ids), sorted(t.id for t in tasks))
+            self.assertEqual(sorted(dispatcher.open_tasks[order.id]),
+                             sorted(t.id for t in open_tasks
+                                    if t.order_id == order.id))
+
+        # Closed orders are removed from the index.
+        order_ids = sorted(o.id for o in open_orders)
+        self.assertEqual(sorted(k for k, v in dispatcher.order_tasks.items()
+                                if v),
+                         order_ids)
+        self.assertEqual(sorted(k for k, v in dispatcher.open_tasks.items()
+                                if v),
+                         order_ids)
+
+    def testFlush(self):
+        self._enter_order()
+        task1, task2 = self.service.tasks
+
+        # Changes are held back until they are flushed.
+        self.dispatcher.set_job_progress(task1.job_id, .5)
+        self.dispatcher.set_job_name(task2.job_id, 'renamed')
+        self.assertEqual(self._get_db_progress(task1), .0)
+        self.dispatcher.flush()
+        self.assertEqual(self._get_db_progress(task1), .5)
+        self.assertEqual(self.db.get_task(id = task2.id).get_name(),
+                         'renamed')
+
+        # Multiple changes of the same task are coalesced.
+        self.dispatcher.set_job_progress(task1.job_id, .6)
+        self.dispatcher.set_job_progress(task1.job_id, .7)
+        self.dispatcher.flush()
+        self.assertEqual(self._get_db_progress(task1), .7)
+        self.assertEqual(self.db.get_order_progress_from_id(task1.order_id),
+                         .35)
+
+        # Closing a task is written immediately, together with the
+        # changes that are still pending.
+        self.dispatcher.set_job_progress(task2.job_id, .2)
+        task1.completed()
+        self.assert_(self.db.get_task(id = task1.id).get_closed_timestamp())
+        self.assertEqual(self._get_db_progress(task2), .2)
+
+    def testShutdown(self):
+        self._enter_order()
+        task1, task2 = self.service.tasks
+
+        # Pending changes are written when the dispatcher is stopped.
+        self.dispatcher.set_job_progress(task1.job_id, .5)
+        task2.set_status('running')
+        self.assertEqual(self._get_db_progress(task1), .0)
+        self.dispatcher.shutdown()
+        self.assertEqual(self._get_db_progress(task1), .5)
+        self.assertEqual(self.db.get_task(id = task2.id).get_status(),
+                         'running')
+
+        # The background thread terminates.
+        self.dispatcher.writer.join(5)
+        self.failIf(self.dispatcher.writer.is_alive())
+
+    def testIndex(self):
+        order1 = self._enter_order()
+        tasks1 = self.service.tasks
+        self.service.names = ['task3']
+        order2 = self._enter_order()
+        task3, = self.service.tasks
+        self.assertIndexMatchesDatabase()
+        self.assertEqual(len(self.dispatcher.tasks), 3)
+
+        # Progress updates do not change the index.
+        self.dispatcher.set_job_progress(tasks1[0].job_id, .5)
+        self.assertIndexMatchesDatabase()
+
+        # Closed tasks are removed.
+        tasks1[0].completed()
+        self.assertIndexMatchesDatabase()
+        self.assertEqual(len(self.dispatcher.tasks), 2)
+
+        # Once all tasks are closed, so is the order.
+        task3.close('aborted')
+        self.assertIndexMatchesDatabase()
+        self.assertEqual(self.db.get_order(id = order2.id).get_status(),
+                         'completed')
+        self.assertEqual(sorted(self.dispatcher.orders), [order1.id])
+
+        tasks1[1].completed()
+        self.assertIndexMatchesDatabase()
+        self.assertEqual(self.dispatcher.tasks, {})
+        self.assertEqual(self.dispatcher.orders, {})
+        self.assertEqual(self.db.get_order_progress_from_id(order1.id), 1.0)
+
+    def testReplayJobEvents(self):
+        queue = FakeQueue()
+        wq    = queue.workqueue
+        jobs  = {}
+        self.dispatcher.add_queue('myqueue', queue)
+
+        def start_jobs(job_ids):
+            for job_id in job_ids:
+                jobs[job_id] = wq.jobs[job_id] = FakeJob(job_id)
+                wq.job_init_event(jobs[job_id])
+            wq.job_started_event(jobs[job_ids[0]])
+            wq.job_succeeded_event(jobs[job_ids[0]])
+            wq.job_started_event(jobs[job_ids[1]])
+            self.assertEqual(len(self.dispatcher.unbound), 2)
+
+            # Changes of the running job are not lost.
+            self.dispatcher.set_job_progress(job_ids[1], .5)
+            self.dispatcher.set_job_name(job_ids[1], 'renamed')
+
+        self.service.queue_name = 'myqueue'
+        self.service.start_jobs = start_jobs
+        cursor = self.dispatcher.feed.get_last_seq()
+        order  = self._enter_order()
+        task1, task2 = self.service.tasks
+        self.assertEqual(self.dispatcher.unbound, {})
+
+        # The held back events were replayed in the order in which
+        # they were emitted, after the job was bound.
+        events, cursor = self.dispatcher.feed.get_events(cursor)
+        statuses = [(e['id'], e['status']) for e in events
+                    if e['type'] == 'task']
+        self.assertEqual(statuses, [(task1.id, 'init'),
+                                    (task1.id, 'running'),
+                                    (task1.id, 'completed'),
+                                    (task2.id, 'init'),
+                                    (task2.id, 'running')])
+        self.assertEqual(task1.get_status(), 'completed')
+        self.assertEqual(task2.get_status(), 'running')
+        self.assertEqual(self.dispatcher.tasks.keys(), [task2.job_id])
+        self.assertEqual(task2.get_progress(), .5)
+        self.assertEqual(task2.get_name(), 'renamed')
+        self.assertEqual(self.dispatcher.updates, {})
+
+        # The trace context is passed to the job when it is bound.
+        for task in task1, task2:
+            self.assertEqual(jobs[task.job_id].data['trace'],
+                             (task.get_trace_id(), task.get_span_id()))
+
+        # Events after binding are handled immediately.
+        wq.job_succeeded_event(jobs[task2.job_id])
+        self.assertEqual(task2.get_status(), 'completed')
+        self.dispatcher.flush()
+        self.assertEqual(self.db.get_task(id = task2.id).get_name(),
+                         'renamed')
+        self.assertEqual(self.db.get_order(id = order.id).get_status(),
+                         'completed')
+
+        # Jobs that were not yet initialized receive the trace context
+        # before they are started.
+        def start_jobs(job_ids):
+            wq.jobs[job_ids[0]] = FakeJob(job_ids[0])
+        self.service.names      = ['task3']
+        self.service.start_jobs = start_jobs
+        self._enter_order()
+        task3, = self.service.tasks
+        self.assertEqual(wq.jobs[task3.job_id].data['trace'],
+                         (task3.get_trace_id(), task3.get_span_id()))
+
+    def testDropUnboundJobs(self):
+        queue1 = FakeQueue()
+        queue2 = FakeQueue()
+        self.dispatcher.add_queue('queue1', queue1)
+        self.dispatcher.add_queue('queue2', queue2)
+
+        def start_jobs(job_ids):
+            # Jobs of the queue that is entered into are held back.
+            queue1.workqueue.job_init_event(FakeJob('unbound'))
+            self.assertEqual(self.dispatcher.unbound.keys(), ['unbound'])
+
+            # Events of other queues are not delayed.
+            queue2.workqueue.job_init_event(FakeJob('other'))
+            self.assertEqual(self.dispatcher.unbound.keys(), ['unbound'])
+            self.assert_('queue2/other: init (untracked)'
+                         in self.log.messages)
+
+        self.service.queue_name = 'queue1'
+        self.service.start_jobs = start_jobs
+        self._enter_order()
+
+        # Jobs that were not bound by the service are handled as
+        # untracked once the order is entered.
+        self.assertEqual(self.dispatcher.unbound, {})
+        self.assertEqual(self.log.messages.count(
+                         'queue1/unbound: init (untracked)'), 1)
+        self.assertEqual(len(self.dispatcher.tasks), 2)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(DispatcherTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -0,0 +1,81 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import time
+from threading           import Timer
+from Exscriptd.EventFeed import EventFeed
+
+class EventFeedTest(unittest.TestCase):
+    CORRELATE = EventFeed
+
+    def setUp(self):
+        self.feed = EventFeed(maxlen = 5)
+
+    def testConstructor(self):
+        feed = EventFeed()
+        self.assertEqual(feed.get_last_seq(), 0)
+
+    def testPublish(self):
+        self.assertEqual(self.feed.publish('task', id = 1), 1)
+        self.assertEqual(self.feed.publish('order', id = 2), 2)
+        events, cursor = self.feed.get_events(0)
+        self.assertEqual(cursor, 2)
+        self.assertEqual(events, [{'seq': 1, 'type': 'task', 'id': 1},
+                                  {'seq': 2, 'type': 'order', 'id': 2}])
+
+    def testGetLastSeq(self):
+        self.assertEqual(self.feed.get_last_seq(), 0)
+        self.feed.publish('task', id = 1)
+        self.assertEqual(self.feed.get_last_seq(), 1)
+
+    def testGetEvents(self):
+        # Without a cursor, only the current position is returned.
+        self.feed.publish('task', id = 1)
+        self.assertEqual(self.feed.get_events(), ([], 1))
+
+        # Events after the cursor are returned.
+        for i in range(2, 5):
+            self.feed.publish('task', id = i, order_id = i % 2)
+        events, cursor = self.feed.get_events(2)
+        self.assertEqual([e['seq'] for e in events], [3, 4])
+        self.assertEqual(cursor, 4)
+
+        # Limit.
+        events, cursor = self.feed.get_events(0, limit = 2)
+        self.assertEqual([e['seq'] for e in events], [1, 2])
+        self.assertEqual(cursor, 2)
+
+        # Filter.
+        events, cursor = self.feed.get_events(0, order_id = 0)
+        self.assertEqual([e['id'] for e in events], [2, 4])
+        self.assertEqual(cursor, 4)
+
+        # Events that were dropped from the buffer are skipped.
+        for i in range(5, 9):
+            self.feed.publish('task', id = i)
+        events, cursor = self.feed.get_events(1)
+        self.assertEqual([e['seq'] for e in events], [4, 5, 6, 7, 8])
+
+        # A cursor from before a restart returns the whole buffer.
+        events, cursor = self.feed.get_events(100)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(cursor, 8)
+
+        # Time out if nothing happens.
+        start = time.time()
+        self.assertEqual(self.feed.get_events(8, timeout = .2), ([], 8))
+        self.assert_(time.time() - start >= .2)
+
+        # Return as soon as a matching event is published.
+        Timer(.1, self.feed.publish, ('task',), {'order_id': 1}).start()
+        Timer(.2, self.feed.publish, ('task',), {'order_id': 2}).start()
+        start          = time.time()
+        events, cursor = self.feed.get_events(8, timeout = 5, order_id = 2)
+        self.assert_(time.time() - start < 2)
+        self.assertEqual(events, [{'seq': 10, 'type': 'task', 'order_id': 2}])
+        self.assertEqual(cursor, 10)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(EventFeedTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -1,6 +1,7 @@
 import sys, unittest, re, os.path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
 
+from datetime          import datetime, timedelta
 from tempfile          import NamedTemporaryFile
 from getpass           import getuser
 from sqlalchemy        import create_engine
@@ -30,6 +31,62 @@ class OrderDBTest(unittest.TestCase):
     def testInstall(self):
         self.db.install()
 
+    def testInstallUpgrade(self):
+        # Create the order table as it was before the task_count,
+        # progress_sum, trace_id and span_id columns were introduced.
+        self.engine.execute("""
+            CREATE TABLE exscriptd_order (
+                id INTEGER NOT NULL PRIMARY KEY,
+                service VARCHAR(50),
+                status VARCHAR(20),
+                description VARCHAR(150),
+                created DATETIME,
+                closed DATETIME,
+                created_by VARCHAR(50))""")
+        self.engine.execute("""
+            INSERT INTO exscriptd_order (id, service, description)
+            VALUES (1, 'fooservice', 'my order')""")
+        self.engine.execute("""
+            INSERT INTO exscriptd_order (id, service, description)
+            VALUES (2, 'fooservice', 'empty order')""")
+        self.db.metadata.tables['exscriptd_task'].create()
+        self.engine.execute("""
+            INSERT INTO exscriptd_task (id, order_id, name, progress)
+            VALUES (1, 1, 'my test task', 0.5)""")
+        self.engine.execute("""
+            INSERT INTO exscriptd_task (id, order_id, name, progress)
+            VALUES (2, 1, 'another test task', 0.0)""")
+
+        # Install() adds the columns and computes their values.
+        self.db.install()
+        self.assertEqual(self.db.get_order_progress_from_id(1), .25)
+        self.assertEqual(self.db.get_order_progress_from_id(2), .0)
+        task = self.db.get_task(id = 2)
+        task.set_progress(1.0)
+        self.db.save_task(task)
+        self.assertEqual(self.db.get_order_progress_from_id(1), .75)
+
+        # Old orders get a new trace, which is kept once saved.
+        order = self.db.get_order(id = 1)
+        self.assert_(order.get_trace_id())
+        self.db.save_order(order)
+        loaded = self.db.get_order(id = 1)
+        self.assertEqual(loaded.get_trace_id(), order.get_trace_id())
+        self.assertEqual(loaded.get_span_id(), order.get_span_id())
+
+        # The indices are added as well.
+        from sqlalchemy.engine.reflection import Inspector
+        inspect = Inspector.from_engine(self.engine)
+        indices = [i['name'] for i in inspect.get_indexes('exscriptd_order')]
+        for index in self.db.metadata.tables['exscriptd_order'].indexes:
+            self.assert_(index.name in indices, index.name)
+
+        # Installing again must not change anything.
+        self.db.install()
+        self.assertEqual(self.db.get_order_progress_from_id(1), .75)
+        self.assertEqual(self.db.get_order(id = 1).get_trace_id(),
+                         order.get_trace_id())
+
     def testUninstall(self):
         self.testInstall()
         self.db.uninstall()
@@ -134,6 +191,11 @@ class OrderDBTest(unittest.TestCase):
         # Check that the order is stored.
         order2 = self.db.get_order(id = order1.get_id())
         self.assertEqual(order1.get_id(), order2.get_id())
+        self.assertEqual(order1.get_trace_id(), order2.get_trace_id())
+        self.assertEqual(order1.get_span_id(), order2.get_span_id())
+        order3 = self.db.get_orders(id = order1.get_id())[0]
+        self.assertEqual(order1.get_trace_id(), order3.get_trace_id())
+        self.assertEqual(order1.get_span_id(), order3.get_span_id())
 
     def testGetOrderProgressFromId(self):
         self.testInstall()
@@ -188,6 +250,37 @@ class OrderDBTest(unittest.TestCase):
         orders = self.db.get_orders()
         self.assertEqual(len(orders), 2)
 
+        # Filter by a list of ids.
+        orders = self.db.get_orders(id = [orders[1].id, 12345])
+        self.assertEqual(len(orders), 1)
+        orders = self.db.get_orders(id = range(1, 2000))
+        self.assertEqual(len(orders), 2)
+
+    def testGetOrdersPaginated(self):
+        self.testInstall()
+        for i in range(5):
+            self.db.add_order(Order('fooservice'))
+
+        # Keyset pagination.
+        orders = self.db.get_orders(limit = 2)
+        self.assertEqual([o.id for o in orders], [5, 4])
+        orders = self.db.get_orders(limit = 2, before = orders[-1].id)
+        self.assertEqual([o.id for o in orders], [3, 2])
+        orders = self.db.get_orders(limit = 2, before = orders[-1].id)
+        self.assertEqual([o.id for o in orders], [1])
+
+        # Time ranges.
+        past   = datetime.utcnow() - timedelta(hours = 1)
+        future = datetime.utcnow() + timedelta(hours = 1)
+        orders = self.db.get_orders(created_after  = past,
+                                    created_before = future,
+                                    before         = 5)
+        self.assertEqual([o.id for o in orders], [4, 3, 2, 1])
+        self.assertEqual(self.db.count_orders(created_before = past), 0)
+        self.assertEqual(self.db.count_orders(closed_after = past), 0)
+        self.db.close_open_orders()
+        self.assertEqual(self.db.count_orders(closed_after = past), 5)
+
     def testCloseOpenOrders(self):
         self.testInstall()
 
@@ -200,6 +293,21 @@ class OrderDBTest(unittest.TestCase):
         order = self.db.get_orders()[0]
         self.failIfEqual(order.get_closed_timestamp(), None)
 
+        # Close selected orders only.
+        order1 = Order('fooservice')
+        order2 = Order('fooservice')
+        self.db.add_order([order1, order2])
+        self.db.add_tasks([Task(order1.id, 'a'), Task(order2.id, 'b')])
+        self.db.close_open_orders([order1.id])
+        order1 = self.db.get_order(id = order1.id)
+        order2 = self.db.get_order(id = order2.id)
+        self.failIfEqual(order1.get_closed_timestamp(), None)
+        self.assertEqual(order2.get_closed_timestamp(), None)
+        task1 = self.db.get_tasks(order_id = order1.id)[0]
+        task2 = self.db.get_tasks(order_id = order2.id)[0]
+        self.failIfEqual(task1.get_closed_timestamp(), None)
+        self.assertEqual(task2.get_closed_timestamp(), None)
+
     def testSaveTask(self):
         self.testInstall()
 
@@ -211,6 +319,19 @@ class OrderDBTest(unittest.TestCase):
         self.db.save_task(task)
         self.assert_(task.id is not None)
 
+        # Saving a task that no longer exists does not change the
+        # progress of the order.
+        order = Order('fooservice')
+        self.db.save_order(order)
+        task = Task(order.id, 'my test task')
+        task.set_progress(.5)
+        self.db.save_task(task)
+        tbl_t = self.db._table_map['task']
+        self.engine.execute(tbl_t.delete(tbl_t.c.id == task.id))
+        task.set_progress(1.0)
+        self.db.save_task(task)
+        self.assertEqual(self.db.get_order_progress_from_id(order.id), .5)
+
     def testGetTask(self):
         self.testInstall()
 
@@ -248,6 +369,143 @@ class OrderDBTest(unittest.TestCase):
         id_list2 = [task.id for task in self.db.get_tasks(order_id = 2)]
         self.assertEqual([], id_list2)
 
+        tasks = self.db.get_tasks(before = max(id_list1))
+        self.assertEqual([task.id for task in tasks], [min(id_list1)])
+        tasks = self.db.get_tasks(closed_before = datetime(2010, 1, 1))
+        self.assertEqual(tasks, [])
+        tasks = self.db.get_tasks(started_after = datetime(2010, 1, 1))
+        self.assertEqual(len(tasks), 2)
+
+    def testAddTasks(self):
+        self.testInstall()
+
+        order = Order('fooservice')
+        self.db.save_order(order)
+        self.db.add_tasks([])
+
+        tasks = [Task(order.id, 'task%d' % i) for i in range(10)]
+        tasks[0].set_progress(1.0)
+        self.db.add_tasks(task for task in tasks)
+        self.assert_(None not in [task.id for task in tasks])
+        self.failIf(True in [task.is_dirty() for task in tasks])
+        self.assertEqual(self.db.count_tasks(order_id = order.id), 10)
+        self.assertEqual(self.db.get_task(id = tasks[3].id).get_name(),
+                         'task3')
+        self.assertEqual(self.db.get_order_progress_from_id(order.id), .1)
+
+        # Tasks can not be added twice.
+        self.assertRaises(AttributeError, self.db.add_tasks, tasks[:1])
+
+    def testRecountTasks(self):
+        self.testInstall()
+
+        orders = [Order('fooservice'), Order('fooservice')]
+        self.db.save_order(orders)
+        tasks = [Task(order.id, 'task') for order in orders]
+        tasks[0].set_progress(.5)
+        tasks[1].set_progress(.5)
+        self.db.add_tasks(tasks)
+
+        # Drift in the denormalized columns is repaired.
+        tbl_o = self.db._table_map['order']
+        self.engine.execute(tbl_o.update().values(task_count   = 2,
+                                                  progress_sum = 2.0))
+        self.db.recount_tasks([orders[0].id])
+        self.assertEqual(self.db.get_order_progress_from_id(orders[0].id), .5)
+        self.assertEqual(self.db.get_order_progress_from_id(orders[1].id), 1.0)
+        self.db.recount_tasks()
+        self.assertEqual(self.db.get_order_progress_from_id(orders[1].id), .5)
+
+    def testUpdateTasks(self):
+        self.testInstall()
+
+        order = Order('fooservice')
+        self.db.save_order(order)
+
+        task1 = Task(order.id, 'my test task')
+        task2 = Task(order.id, 'another test task')
+        task3 = Task(order.id, 'third test task')
+        self.db.save_task(task1)
+        self.db.save_task(task2)
+        self.db.save_task(task3)
+
+        self.db.update_tasks({})
+        self.db.update_tasks({task1.id: {'status': 'running'},
+                              task2.id: {'status': 'running',
+                                         'progress': .5},
+                              task3.id: {}})
+        task = self.db.get_task(id = task1.id)
+        self.assertEqual(task.get_status(), 'running')
+        self.assertEqual(task.get_progress(), .0)
+        self.assertEqual(task.get_name(), 'my test task')
+        task = self.db.get_task(id = task2.id)
+        self.assertEqual(task.get_status(), 'running')
+        self.assertEqual(task.get_progress(), .5)
+        task = self.db.get_task(id = task3.id)
+        self.assertEqual(task.get_status(), 'new')
+        self.assertEqual(self.db.get_order_progress_from_id(order.id), 1 / 6.)
+
+        self.db.update_tasks({task1.id: {'progress': 1.0},
+                              task2.id: {'progress': 1.0},
+                              task3.id: {'progress': 1.0}})
+        self.assertEqual(self.db.get_order_progress_from_id(order.id), 1.0)
+
+        # Closed tasks are no longer counted as open.
+        task1.close('completed')
+        self.db.update_tasks({task1.id: {'status': task1.status,
+                                         'closed': task1.closed}})
+        self.assertEqual(self.db.count_tasks(closed = None), 2)
+
+    def testUpdateTasksInBatches(self):
+        self.testInstall()
+
+        order1 = Order('fooservice')
+        order2 = Order('fooservice')
+        self.db.add_order([order1, order2])
+
+        def assert_progress(progress1, progress2):
+            self.assertAlmostEqual(
+                self.db.get_order_progress_from_id(order1.id), progress1)
+            self.assertAlmostEqual(
+                self.db.get_order_progress_from_id(order2.id), progress2)
+
+        # Tasks are added in several batches, some of them spanning
+        # both orders.
+        tasks1 = [Task(order1.id, 'task%d' % i) for i in range(4)]
+        tasks2 = [Task(order2.id, 'task%d' % i) for i in range(2)]
+        tasks1[0].set_progress(1.0)
+        self.db.add_tasks(tasks1[:2])
+        assert_progress(.5, .0)
+        self.db.add_tasks(tasks1[2:] + tasks2[:1])
+        assert_progress(.25, .0)
+        self.db.add_tasks(tasks2[1:])
+        assert_progress(.25, .0)
+
+        # Each batch only applies the difference to the previous value.
+        self.db.update_tasks({tasks1[1].id: {'progress': .5},
+                              tasks2[0].id: {'progress': .5}})
+        assert_progress(.375, .25)
+        self.db.update_tasks({tasks1[1].id: {'progress': 1.0},
+                              tasks1[2].id: {'status': 'running'}})
+        assert_progress(.5, .25)
+        self.db.update_tasks({tasks1[0].id: {'progress': .0},
+                              tasks2[0].id: {'progress': 1.0},
+                              tasks2[1].id: {'progress': 1.0}})
+        assert_progress(.25, 1.0)
+
+        # Saving single tasks keeps the progress consistent.
+        task = self.db.get_task(id = tasks1[3].id)
+        task.set_progress(1.0)
+        self.db.save_task(task)
+        assert_progress(.5, 1.0)
+
+        # Updates of deleted tasks are ignored.
+        self.db.delete_orders([order2.id])
+        self.db.update_tasks({tasks2[0].id: {'progress': .0},
+                              tasks1[2].id: {'progress': 1.0}})
+        self.assertEqual(self.db.get_order_progress_from_id(order1.id), .75)
+        self.assertEqual(self.db.count_tasks(order_id = order2.id), 0)
+
     def testCountTasks(self):
         self.testInstall()
         self.assertEqual(self.db.count_tasks(), 0)
@@ -256,6 +514,48 @@ class OrderDBTest(unittest.TestCase):
         self.testSaveTask()
         self.assertEqual(self.db.count_tasks(), 2)
 
+    def testGetExpiredOrders(self):
+        self.testInstall()
+        orders = [Order('fooservice') for i in range(5)]
+        self.db.add_order(orders)
+        self.assertEqual(self.db.get_expired_orders(), [])
+
+        # Open orders never expire.
+        past = datetime.utcnow() - timedelta(hours = 1)
+        self.assertEqual(self.db.get_expired_orders(keep = 1), [])
+        self.db.close_open_orders([o.id for o in orders[:4]])
+        self.assertEqual(self.db.get_expired_orders(closed_before = past), [])
+
+        # By age.
+        future = datetime.utcnow() + timedelta(hours = 1)
+        expired = self.db.get_expired_orders(closed_before = future)
+        self.assertEqual([o.id for o in expired], [1, 2, 3, 4])
+        expired = self.db.get_expired_orders(closed_before = future, limit = 2)
+        self.assertEqual([o.id for o in expired], [1, 2])
+
+        # By count.
+        expired = self.db.get_expired_orders(keep = 3)
+        self.assertEqual([o.id for o in expired], [1, 2])
+        expired = self.db.get_expired_orders(closed_before = past, keep = 4)
+        self.assertEqual([o.id for o in expired], [1])
+        self.assertEqual(self.db.get_expired_orders(keep = 5), [])
+
+    def testDeleteOrders(self):
+        self.testInstall()
+        orders = [Order('fooservice') for i in range(3)]
+        self.db.add_order(orders)
+        self.db.add_tasks([Task(order.id, 'task') for order in orders])
+        self.db.delete_orders([])
+        self.db.delete_orders([orders[0].id, orders[1].id])
+        self.assertEqual([o.id for o in self.db.get_orders()], [orders[2].id])
+        tasks = self.db.get_tasks()
+        self.assertEqual([t.order_id for t in tasks], [orders[2].id])
+
+    def testVacuum(self):
+        self.testDeleteOrders()
+        self.db.vacuum()
+        self.assertEqual(self.db.count_orders(), 1)
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(OrderDBTest)
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import json
+import time
+import gzip
+import shutil
+import logging
+from datetime            import timedelta
+from tempfile            import NamedTemporaryFile, mkdtemp
+from sqlalchemy          import create_engine
+from sqlalchemy.pool     import NullPool
+from Exscriptd.Order     import Order
+from Exscriptd.Task      import Task
+from Exscriptd.OrderDB   import OrderDB
+from Exscriptd.Retention import Retention
+
+class RetentionTest(unittest.TestCase):
+    CORRELATE = Retention
+
+    def setUp(self):
+        self.dbfile = NamedTemporaryFile()
+        self.engine = create_engine('sqlite:///' + self.dbfile.name,
+                                    poolclass = NullPool)
+        self.db     = OrderDB(self.engine)
+        self.db.install()
+        self.tmpdir = mkdtemp()
+        self.logdir = os.path.join(self.tmpdir, 'log')
+        self.arcdir = os.path.join(self.tmpdir, 'archive')
+        self.logger = logging.getLogger('RetentionTest')
+
+        # Five orders with one task each; all but the last are closed.
+        self.orders = [Order('fooservice') for i in range(5)]
+        self.db.add_order(self.orders)
+        self.db.add_tasks([Task(o.id, 'task%d' % o.id) for o in self.orders])
+        self.db.close_open_orders([o.id for o in self.orders[:4]])
+        for order in self.orders:
+            os.makedirs(os.path.join(self.logdir, 'orders', str(order.id)))
+
+    def tearDown(self):
+        self.dbfile.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _read_archive(self):
+        result = []
+        for name in sorted(os.listdir(self.arcdir)):
+            with gzip.open(os.path.join(self.arcdir, name)) as file:
+                result += [json.loads(line) for line in file]
+        return result
+
+    def _get_logdirs(self):
+        return sorted(int(n)
+                      for n in os.listdir(os.path.join(self.logdir, 'orders')))
+
+    def testConstructor(self):
+        retention = Retention(self.db, self.logger)
+        self.assertEqual(retention.run_once(), 0)
+
+    def testRunOnce(self):
+        retention = Retention(self.db,
+                              self.logger,
+                              max_orders  = 2,
+                              archive_dir = self.arcdir,
+                              logdir      = self.logdir,
+                              batch_size  = 2,
+                              pause       = 0)
+        self.assertEqual(retention.run_once(), 3)
+        self.assertEqual([o.id for o in self.db.get_orders()], [5, 4])
+        self.assertEqual(self.db.count_tasks(), 2)
+        self.assertEqual(self._get_logdirs(), [4, 5])
+        self.assertEqual([o['id'] for o in self._read_archive()], [1, 2, 3])
+        self.assertEqual(retention.run_once(), 0)
+
+        # By age; the open order is kept.
+        retention.max_orders = None
+        retention.max_age    = timedelta(0)
+        self.assertEqual(retention.run_once(), 1)
+        self.assertEqual([o.id for o in self.db.get_orders()], [5])
+
+    def testArchive(self):
+        retention = Retention(self.db, self.logger, archive_dir = self.arcdir)
+        retention.archive(self.orders[:2])
+        retention.archive(self.orders[2:3])
+        archived = self._read_archive()
+        self.assertEqual([o['id'] for o in archived], [1, 2, 3])
+        self.assertEqual(archived[0]['service'], 'fooservice')
+        self.assertEqual([t['name'] for t in archived[0]['tasks']], ['task1'])
+        self.assertEqual(self.db.count_orders(), 5)
+
+    def testCleanLogdirs(self):
+        retention = Retention(self.db, self.logger, logdir = self.logdir)
+        self.assertEqual(retention.clean_logdirs(), 0)
+        self.db.delete_orders([2, 3])
+        self.assertEqual(retention.clean_logdirs(), 2)
+        self.assertEqual(self._get_logdirs(), [1, 4, 5])
+
+    def testStop(self):
+        retention = Retention(self.db, self.logger, max_orders = 1)
+        retention.stop()
+        self.assertEqual(retention.run_once(), 0)
+        self.assertEqual(self.db.count_orders(), 5)
+
+    def testRun(self):
+        retention = Retention(self.db,
+                              self.logger,
+                              max_orders = 1,
+                              logdir     = self.logdir,
+                              vacuum     = True)
+        retention.start()
+        for i in range(100):
+            if self._get_logdirs() == [5]:
+                break
+            time.sleep(.05)
+        retention.stop()
+        self.assertEqual([o.id for o in self.db.get_orders()], [5])
+        self.assertEqual(self._get_logdirs(), [5])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(RetentionTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
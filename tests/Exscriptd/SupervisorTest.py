@@ -0,0 +1,289 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import os
+import time
+import shutil
+import logging
+from subprocess           import Popen, PIPE
+from multiprocessing      import Process
+from tempfile             import NamedTemporaryFile, mkdtemp
+from sqlalchemy           import create_engine
+from sqlalchemy.pool      import NullPool
+from Exscriptd.Order      import Order
+from Exscriptd.OrderDB    import OrderDB
+from Exscriptd.Supervisor import Supervisor
+
+basedir  = os.path.join(os.path.dirname(__file__), '..', '..')
+services = 'crash', 'hold', 'ok', 'slow'
+
+def fake_worker(index, service_names, conn):
+    """
+    Stands in for a worker process. Orders of the 'ok' service are
+    completed immediately, orders of the 'slow' service after a short
+    delay, and orders of the 'hold' service never. An order of the
+    'crash' service kills the worker.
+    """
+    conn.send(('events', [{'seq':      0,
+                           'type':     'worker',
+                           'index':    index,
+                           'pid':      os.getpid(),
+                           'services': service_names}]))
+    seq = 0
+    while True:
+        xml = conn.recv()
+        if xml is None:
+            break
+        order   = Order.from_xml(xml)
+        service = order.get_service_name()
+        if service == 'crash':
+            os._exit(1)
+        elif service == 'hold':
+            continue
+        elif service == 'slow':
+            time.sleep(.3)
+        seq += 1
+        conn.send(('events', [{'seq':      seq,
+                               'type':     'order',
+                               'id':       order.get_id(),
+                               'order_id': order.get_id(),
+                               'status':   'completed',
+                               'closed':   time.time(),
+                               'worker':   index}]))
+
+class FakeSupervisor(Supervisor):
+    def _create_process(self, worker, conn):
+        args = worker.index, worker.services, conn
+        return Process(target = fake_worker, args = args)
+
+class SupervisorTest(unittest.TestCase):
+    CORRELATE = Supervisor
+
+    def setUp(self):
+        self.dbfile = NamedTemporaryFile()
+        self.engine = create_engine('sqlite:///' + self.dbfile.name,
+                                    poolclass = NullPool)
+        self.db     = OrderDB(self.engine)
+        self.db.install()
+        self.logger = logging.getLogger('SupervisorTest')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+        # A config directory that defines one service per name.
+        self.cfgdir = mkdtemp()
+        with open(os.path.join(self.cfgdir, 'main.xml'), 'w') as file:
+            file.write('<xml><exscriptd/></xml>')
+        for name in services:
+            dirname = os.path.join(self.cfgdir, 'services', name)
+            os.makedirs(dirname)
+            with open(os.path.join(dirname, 'config.xml'), 'w') as file:
+                file.write('<xml><service name="%s"/></xml>' % name)
+        self.supervisor = None
+
+    def tearDown(self):
+        if self.supervisor is not None:
+            self.supervisor.shutdown()
+        shutil.rmtree(self.cfgdir)
+        self.dbfile.close()
+
+    def _start(self, n_workers, shard_by):
+        self.supervisor = FakeSupervisor(self.cfgdir,
+                                         self.db,
+                                         self.logger,
+                                         n_workers,
+                                         shard_by)
+        self.supervisor.restart_delay = 0
+        self.supervisor.start()
+        self._wait(lambda: len(self._get_workers()) == n_workers)
+        return self.supervisor
+
+    def _wait(self, condition, timeout = 5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('timeout')
+            time.sleep(.01)
+
+    def _get_events(self, type):
+        events, cursor = self.supervisor.feed.get_events(0)
+        return [e for e in events if e['type'] == type]
+
+    def _get_workers(self):
+        # Maps worker index to the last reported process id.
+        events = self._get_events('worker')
+        return dict((e['index'], e['pid']) for e in events)
+
+    def _get_worker_of(self, order):
+        for event in self._get_events('order'):
+            if event['id'] == order.id and 'worker' in event:
+                return event['worker']
+        return None
+
+    def _create(self, n_workers, shard_by):
+        return Supervisor(self.cfgdir,
+                          self.db,
+                          self.logger,
+                          n_workers,
+                          shard_by)
+
+    def _place_order(self, service):
+        order = Order(service)
+        self.supervisor.place_order(order, 'test')
+        return order
+
+    def testConstructor(self):
+        self.assertRaises(ValueError, self._create, 2, 'foo')
+
+        # Services are assigned to the workers in the order of their
+        # names.
+        supervisor = self._create(3, 'service')
+        workers    = supervisor.workers
+        self.assertEqual(supervisor.shards, {'crash': workers[0],
+                                             'hold':  workers[1],
+                                             'ok':    workers[2],
+                                             'slow':  workers[0]})
+
+        # Open orders are closed.
+        order = Order('ok')
+        self.db.save_order(order)
+        supervisor = self._create(1, 'order')
+        self.assertEqual(supervisor.shards, {})
+        order = self.db.get_order(id = order.id)
+        self.assert_(order.get_closed_timestamp() is not None)
+
+    def testGetOrderDb(self):
+        supervisor = self._create(1, 'order')
+        self.assertEqual(supervisor.get_order_db(), self.db)
+
+    def testDaemonAdded(self):
+        from Exscript.util.event import Event
+        class FakeDaemon(object):
+            name                 = 'mydaemon'
+            order_incoming_event = Event()
+        daemon = FakeDaemon()
+        self._start(1, 'order')
+        self.supervisor.daemon_added(daemon)
+        self.assertEqual(daemon.parent, self.supervisor)
+        self.assertEqual(self.supervisor.daemons, {'mydaemon': daemon})
+
+        order = Order('ok')
+        daemon.order_incoming_event(order)
+        self._wait(lambda: self._get_worker_of(order) == 0)
+
+    def testStart(self):
+        self._start(2, 'service')
+        services = dict((e['index'], e['services'])
+                        for e in self._get_events('worker'))
+        self.assertEqual(services, {0: set(['crash', 'ok']),
+                                    1: set(['hold', 'slow'])})
+
+    def testPlaceOrder(self):
+        # Sharding by service.
+        self._start(2, 'service')
+        orders = [self._place_order(name) for name in ('ok', 'slow', 'ok')]
+        orders.append(self._place_order('unknown'))
+        self._wait(lambda: None not in map(self._get_worker_of, orders))
+        self.assertEqual(map(self._get_worker_of, orders), [0, 1, 0, 0])
+        for worker in self.supervisor.workers:
+            self.assertEqual(worker.pending, set())
+        self.supervisor.shutdown()
+
+        # Sharding by order id.
+        self._start(3, 'order')
+        orders = [self._place_order('ok') for i in range(6)]
+        self._wait(lambda: None not in map(self._get_worker_of, orders))
+        for order in orders:
+            self.assertEqual(self._get_worker_of(order), order.id % 3)
+
+    def testBackPressure(self):
+        self._start(1, 'order')
+        self.supervisor.max_pending = 1
+
+        # A busy worker blocks until it completes an order.
+        start  = time.time()
+        order1 = self._place_order('slow')
+        order2 = self._place_order('ok')
+        self.assert_(time.time() - start >= .2)
+        self.assertEqual(self._get_worker_of(order1), 0)
+        self._wait(lambda: self._get_worker_of(order2) == 0)
+
+        # If the worker does not complete an order in time, the
+        # order is rejected.
+        self.supervisor.wait_timeout = .2
+        order3 = self._place_order('hold')
+        order4 = self._place_order('ok')
+        self.assertEqual(self.supervisor.workers[0].pending, set([order3.id]))
+        order4 = self.db.get_order(id = order4.id)
+        self.assertEqual(order4.get_status(), 'busy')
+        self.assert_(order4.get_closed_timestamp() is not None)
+        self.assertEqual(self._get_worker_of(order4), None)
+
+    def testWorkerRestart(self):
+        self._start(2, 'order')
+        pids = self._get_workers()
+
+        # Order ids are assigned in sequence, so they alternate
+        # between the workers.
+        order1 = self._place_order('hold')  # worker 1
+        order2 = self._place_order('hold')  # worker 0
+        order3 = self._place_order('ok')    # worker 1
+        order4 = self._place_order('crash') # worker 0
+        self._wait(lambda: self._get_workers()[0] != pids[0])
+
+        # The pending orders of the dead worker are closed, the other
+        # worker is not affected.
+        self._wait(lambda: not self.supervisor.workers[0].pending)
+        for order in order2, order4:
+            order = self.db.get_order(id = order.id)
+            self.assert_(order.get_closed_timestamp() is not None)
+        closed = [e['id'] for e in self._get_events('order')
+                  if 'worker' not in e]
+        self.assertEqual(sorted(closed), [order2.id, order4.id])
+        self.assertEqual(self._get_worker_of(order3), 1)
+        order1 = self.db.get_order(id = order1.id)
+        self.assertEqual(order1.get_closed_timestamp(), None)
+        self.assertEqual(self._get_workers()[1], pids[1])
+        self.assertEqual(self.supervisor.workers[1].pending,
+                         set([order1.id]))
+
+        # The restarted worker handles new orders.
+        order5 = self._place_order('ok') # worker 1
+        order6 = self._place_order('ok') # worker 0
+        self._wait(lambda: self._get_worker_of(order6) == 0)
+        self._wait(lambda: self._get_worker_of(order5) == 1)
+
+    def testShutdown(self):
+        self._start(2, 'order')
+        processes = [w.process for w in self.supervisor.workers]
+        self.supervisor.shutdown()
+        for process in processes:
+            self.failIf(process.is_alive())
+
+        # Orders placed after the shutdown are rejected.
+        order = self._place_order('ok')
+        order = self.db.get_order(id = order.id)
+        self.assertEqual(order.get_status(), 'busy')
+
+    def testOptions(self):
+        def run(*args):
+            env = dict(os.environ, PYTHONPATH = os.path.join(basedir, 'src'))
+            cmd = [sys.executable, os.path.join(basedir, 'exscriptd')]
+            cmd += list(args) + ['--config-dir', self.cfgdir, 'start']
+            proc = Popen(cmd, stdout = PIPE, stderr = PIPE, env = env)
+            stdout, stderr = proc.communicate()
+            return proc.returncode, stderr
+
+        returncode, stderr = run('--workers', 'foo')
+        self.assertEqual(returncode, 2)
+        self.assert_('--workers' in stderr, stderr)
+        returncode, stderr = run('--workers', '-1')
+        self.assertEqual(returncode, 2)
+        self.assert_('--workers must not be negative' in stderr, stderr)
+        returncode, stderr = run('--workers', '2', '--shard-by', 'foo')
+        self.assertEqual(returncode, 2)
+        self.assert_('--shard-by' in stderr, stderr)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SupervisorTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())
@@ -0,0 +1,8 @@
+commands = (
+('show ip interface brief', """
+Interface                  IP-Address      OK? Method Status                Protocol
+FastEthernet0/0            10.0.0.1        YES NVRAM  up                    up
+GigabitEthernet0/1         unassigned      YES unset  administratively down down
+Loopback0                  192.168.0.1     YES manual up                    up
+"""),
+)